@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Compare letter.letter.escape_latex with the former implementation, which ran
+# one str.replace per symbol over each line of the body. escape_latex searches
+# short strings in a single pass and replaces only the symbols found in longer
+# ones, and letter.text.prepare_text escapes a body at once instead of line by
+# line, so besides whole strings the preparation of bodies is measured as well.
+#
+#   python benchmarks/bench_escape.py
+
+import os, sys, timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from letter.letter import escape_latex, LATEX_SYMBOLS
+from letter.text import prepare_text
+
+TEXTS = {
+    'plain': 'Sehr geehrte Damen und Herren, wir schreiben Ihnen wegen der Rechnung vom 1.1.2020 (50%).\n',
+    'symbols': 'Wir berechnen 19% MwSt. auf 100 € (§ 12 UStG) ~ Kto. #4711_a\\b {Anlage} <1> & ^2 | 3°\n',
+    }
+
+
+def replace_sequential(text):
+    text = text.replace('\\', '\\textbackslash ')
+    for i, j in LATEX_SYMBOLS.items():
+        if i != '\\':
+            text = text.replace(i, j)
+    return text
+
+
+def prepare_text_sequential(raw):
+    return [replace_sequential(line) + '\\\\\n' for line in raw.split('\n')]
+
+
+def bench(func, text, number):
+    return min(timeit.repeat(lambda: func(text), number=number, repeat=7)) / number
+
+
+def compare(title, old_func, new_func):
+    print(title)
+    print('%8s %12s %14s %14s %8s' % ('text', 'size', 'sequential', 'escape_latex', 'speedup'))
+    for name, line in sorted(TEXTS.items()):
+        for size in (30, 100, 10 * 1000, 1000 * 1000, 10 * 1000 * 1000):
+            text = (line * (size // len(line) + 1))[:size]
+            assert old_func(text) == new_func(text)
+            number = max(1, 1000000 // size)
+            old = bench(old_func, text, number)
+            new = bench(new_func, text, number)
+            print('%8s %12d %12.3fms %12.3fms %7.1fx' % (name, size, old * 1000, new * 1000, old / new))
+    print()
+
+
+def main():
+    compare('body, escaped line by line', prepare_text_sequential, prepare_text)
+    compare('whole string', replace_sequential, escape_latex)
+
+
+if __name__ == '__main__':
+    main()
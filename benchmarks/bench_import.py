@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Import time of the modules used by scripts and worker processes, measured
+# with python -X importtime in a fresh interpreter each. The cumulative time of
+# the module itself is reported, the best of a few runs.
+#
+#   python benchmarks/bench_import.py [--max-ms 50]
+#
+# With --max-ms the script fails if one of the modules takes longer.
+
+import argparse, os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('letter.letter', 'letter.spec', 'letter.batch', 'main')
+
+
+def import_time(module, runs=5):
+    best = None
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                             cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                             universal_newlines=True, check=True).stderr
+        for line in out.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                cumulative = int(fields[1]) / 1000.0
+                best = cumulative if best is None else min(best, cumulative)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time of the letter modules.')
+    parser.add_argument('--max-ms', type=float, help='fail if a module takes longer to import')
+    args = parser.parse_args()
+
+    failed = False
+    for module in MODULES:
+        ms = import_time(module)
+        too_slow = args.max_ms is not None and ms > args.max_ms
+        failed = failed or too_slow
+        print('%-16s %8.1f ms%s' % (module, ms, '  TOO SLOW' if too_slow else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Microbenchmarks of the hot paths of rendering a letter, with synthetic bodies
+# from a few lines up to several megabytes.
+#
+#   python benchmarks/bench_letter.py             compare with baseline.json
+#   python benchmarks/bench_letter.py --save      store the results as baseline
+#   python benchmarks/bench_letter.py -k escape   only benchmarks containing 'escape'
+#
+# The comparison fails if a benchmark is slower than its baseline by more than
+# the tolerance. Baselines depend on the machine, so refresh them with --save
+# when the reference machine changes. create_pdf is measured with a builder
+# which doesn't run TeX, to see the overhead around the compilation.
+
+import argparse, itertools, json, os, shutil, sys, tempfile, timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from letter.letter import Letter
+from letter.spec import letter_from_spec, letter_from_template, merge_specs, template_from_spec
+from letter.text import prepare_line, prepare_text, prepare_content, prepare_attachment
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+LINE = 'Sehr geehrte Damen und Herren, anbei die Rechnung über 100 € (19% MwSt., § 14 UStG) für #4711.\n'
+
+SIZES = {
+    'tiny': 200,
+    'small': 10 * 1000,
+    'large': 1000 * 1000,
+    'huge': 5 * 1000 * 1000,
+    }
+
+
+class NullPdf:
+    def __init__(self, source):
+        self.data = source.encode('utf-8')
+
+    def save_to(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.data)
+
+
+# Stands in for TeX, see Letter.set_builder
+class NullBuilder:
+    def build_pdf(self, source, texinputs=[]):
+        return NullPdf(source)
+
+
+def body(size):
+    return (LINE * (size // len(LINE) + 1))[:size]
+
+
+def make_letter(raw):
+    letter = Letter()
+    letter.set_absender('John Doe', 'Straße der Freiheit 1', '12345 Berlin')
+    letter.set_adresse(prepare_text('Klaus Störtebeker\nHafenstraße 1\n20359 Hamburg'))
+    letter.set_betreff(prepare_line('Rechnung #4711'))
+    letter.set_anrede('Sehr geehrte Damen und Herren,')
+    letter.set_gruss('Mit freundlichen Grüßen')
+    letter.set_anlagen(prepare_attachment('Rechnung\nLieferschein', '--'))
+    letter.set_text(prepare_content(raw))
+    return letter
+
+
+# a mail merge, where only the address and salutation differ per letter
+def template_spec(raw):
+    return {'name': 'John Doe', 'strasse': 'Straße der Freiheit 1', 'ort': '12345 Berlin',
+            'bank': 'Top Bank', 'blz': '12345678', 'konto': '0123456789',
+            'betreff': 'Rechnung #4711', 'gruss': 'Mit freundlichen Grüßen', 'text': raw}
+
+RECIPIENT = {'adresse': 'Klaus Störtebeker\nHafenstraße 1\n20359 Hamburg', 'anrede': 'Moin,'}
+
+
+# Render the body of the letter again, the kept document would be returned
+# otherwise. The same list is set again, which is rendered again like a list
+# changed in place.
+def update_body(letter):
+    text = letter.get_text()
+
+    def update():
+        letter.set_text(text)
+        letter._update_tex()
+    return update
+
+
+# Change one field and render the document, like an edit in the GUI. The
+# subject alternates, setting an equal value keeps the rendered document.
+def edit_render(letter):
+    subjects = itertools.cycle([prepare_line('Rechnung #4712'), prepare_line('Rechnung #4713')])
+
+    def edit():
+        letter.set_betreff(next(subjects))
+        return letter.render_tex()
+    return edit
+
+
+def benchmarks(tmpdir):
+    tex = os.path.join(tmpdir, 'letter.tex')
+    pdf = os.path.join(tmpdir, 'letter.pdf')
+    yield 'new_letter', Letter
+    for name, size in sorted(SIZES.items(), key=lambda s: s[1]):
+        raw = body(size)
+        letter = make_letter(raw)
+        stubbed = make_letter(raw)
+        stubbed.set_builder(NullBuilder())
+        yield 'replace_symbols_latex/%s' % name, lambda: letter.replace_symbols_latex(raw)
+        yield 'prepare_text/%s' % name, lambda: prepare_text(raw)
+        yield 'prepare_content/%s' % name, lambda: prepare_content(raw)
+        yield 'prepare_attachment/%s' % name, lambda: prepare_attachment(raw, '--')
+        yield '_update_tex/%s' % name, update_body(letter)
+        yield 'edit_render/%s' % name, edit_render(letter)
+        yield 'save_tex/%s' % name, lambda: letter.save_tex(tex)
+        yield 'create_pdf_stubbed/%s' % name, lambda: stubbed.create_pdf(pdf)
+        spec = template_spec(raw)
+        template = template_from_spec(spec)
+        yield 'merge_from_spec/%s' % name, lambda: letter_from_spec(merge_specs(spec, RECIPIENT)).render_tex()
+        yield 'merge_from_template/%s' % name, lambda: letter_from_template(template, RECIPIENT).render_tex()
+
+
+def measure(func, min_time=0.2):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rendering letters.')
+    parser.add_argument('--save', action='store_true', help='store the results as new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown compared to the baseline (default: 0.25 = 25%%)')
+    parser.add_argument('-k', dest='filter', default='', help='only run benchmarks containing this text')
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name, func in benchmarks(tmpdir):
+            if args.filter not in name:
+                continue
+            results[name] = seconds = measure(func)
+            line = '%-36s %12.3f ms' % (name, seconds * 1000)
+            if name in baseline:
+                ratio = seconds / baseline[name]
+                line += '  %5.2fx baseline' % ratio
+                if ratio > 1 + args.tolerance:
+                    regressions.append(name)
+                    line += '  REGRESSION'
+            print(line)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.save:
+        baseline.update(results)
+        with open(BASELINE, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('baseline saved to %s' % BASELINE)
+    elif regressions:
+        print('%d regressions: %s' % (len(regressions), ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+# A local address book of senders and recipients in SQLite. The contacts are
+# kept in a full text index (FTS5), so completing a few typed letters stays a
+# matter of milliseconds with hundreds of thousands of contacts.
+#
+#   python -m letter.addressbook import contacts.csv
+#   python -m letter.addressbook search 'stört ham'
+#
+# Every word typed is matched as prefix of a word of the name, the address or
+# the email, umlauts and accents are ignored ('stort' finds 'Störtebeker').
+
+import os, re, sqlite3, sys
+from collections import namedtuple
+
+# the columns of a contact, named like the fields of the Letter class
+COLUMNS = ('name', 'zusatz', 'strasse', 'ort', 'land', 'telefon', 'email', 'anrede')
+
+# the columns in the full text index
+SEARCH_COLUMNS = ('name', 'zusatz', 'strasse', 'ort', 'land', 'email')
+
+SCHEMA_VERSION = 1
+
+_NAMES = {
+    'columns': ',\n    '.join("%s TEXT NOT NULL DEFAULT ''" % c for c in COLUMNS),
+    'search': ', '.join(SEARCH_COLUMNS),
+    'new': ', '.join('new.%s' % c for c in SEARCH_COLUMNS),
+    'old': ', '.join('old.%s' % c for c in SEARCH_COLUMNS),
+    }
+
+# keeps the index up to date, dropped while many contacts are added at once
+INSERT_TRIGGER = '''
+CREATE TRIGGER IF NOT EXISTS contacts_ai AFTER INSERT ON contacts BEGIN
+    INSERT INTO contacts_fts(rowid, %(search)s) VALUES (new.id, %(new)s);
+END
+''' % _NAMES
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS contacts (
+    id INTEGER PRIMARY KEY,
+    %(columns)s
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(
+    %(search)s, content='contacts', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+);
+CREATE TRIGGER IF NOT EXISTS contacts_ad AFTER DELETE ON contacts BEGIN
+    INSERT INTO contacts_fts(contacts_fts, rowid, %(search)s) VALUES ('delete', old.id, %(old)s);
+END;
+CREATE TRIGGER IF NOT EXISTS contacts_au AFTER UPDATE ON contacts BEGIN
+    INSERT INTO contacts_fts(contacts_fts, rowid, %(search)s) VALUES ('delete', old.id, %(old)s);
+    INSERT INTO contacts_fts(rowid, %(search)s) VALUES (new.id, %(new)s);
+END;
+''' % _NAMES + INSERT_TRIGGER + ';'
+
+_WORD = re.compile(r'\w+')
+
+# a line of the recipient address with the postcode and the city
+_CITY_LINE = re.compile(r'^([A-Z]{1,3}-)?\d')
+
+
+class Contact(namedtuple('Contact', ('id',) + COLUMNS)):
+    __slots__ = ()
+
+    def address(self):
+        """The lines of the recipient address."""
+        lines = [self.name] + self.zusatz.split('\n') + [self.strasse, self.ort, self.land]
+        return [line for line in lines if line]
+
+    def sender_spec(self):
+        """The fields of the sender, see ``letter.spec``."""
+        return {name: getattr(self, name) for name in ('name', 'zusatz', 'strasse', 'ort', 'land',
+                                                       'telefon', 'email')}
+
+    def recipient_spec(self):
+        """The fields of the recipient, see ``letter.spec``."""
+        spec = {'adresse': '\n'.join(self.address())}
+        if self.anrede:
+            spec['anrede'] = self.anrede
+        return spec
+
+    @classmethod
+    def from_address(cls, text, **fields):
+        """Split the lines of a recipient address into the columns of a contact.
+
+        The first line is the name, the last line starting with a postcode the city
+        followed by the country and the line before it the street. Further lines
+        are kept as zusatz, e.g. a department.
+        """
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        values = dict.fromkeys(COLUMNS, '')
+        if lines:
+            values['name'] = lines.pop(0)
+        city = max((i for i, line in enumerate(lines) if _CITY_LINE.match(line)), default=len(lines) - 1)
+        if city >= 0:
+            values['ort'] = lines[city]
+            values['land'] = ' '.join(lines[city + 1:])
+            if city >= 1:
+                values['strasse'] = lines[city - 1]
+                values['zusatz'] = '\n'.join(lines[:city - 1])
+        values.update(fields)
+        return cls(None, **values)
+
+
+def default_path():
+    data = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(data, 'latex-letter', 'addresses.db')
+
+
+def match_query(text):
+    """The FTS5 query matching every word of text as prefix, None without words."""
+    words = _WORD.findall(text)
+    if not words:
+        return None
+    return ' '.join('"%s"*' % word for word in words)
+
+
+class AddressBook:
+    """The contacts in the SQLite database at path, created if missing.
+
+    A connection may only be used by the thread which opened it, so threads
+    searching in the background open their own AddressBook on the same path.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.__db = sqlite3.connect(self.path)
+        version = self.__db.execute('PRAGMA user_version').fetchone()[0]
+        if version > SCHEMA_VERSION:
+            self.__db.close()
+            raise ValueError('%s was created by a newer version (schema %d)' % (self.path, version))
+        if version < SCHEMA_VERSION:
+            with self.__db:
+                self.__db.executescript(SCHEMA)
+                self.__db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.__db.close()
+
+    def __len__(self):
+        return self.__db.execute('SELECT count(*) FROM contacts').fetchone()[0]
+
+    @staticmethod
+    def __values(contact):
+        if isinstance(contact, Contact):
+            contact = contact._asdict()
+        elif contact.get('adresse'):
+            fields = {c: contact[c] for c in COLUMNS if contact.get(c)}
+            contact = Contact.from_address(contact['adresse'], **fields)._asdict()
+        return [contact.get(c) or '' for c in COLUMNS]
+
+    def add(self, contact):
+        """Add a contact and return its id.
+
+        The contact is a Contact or a dict with its columns or the lines of the
+        recipient as 'adresse', other keys are ignored. So the recipients of the
+        batch mode can be added as they are.
+        """
+        with self.__db:
+            cursor = self.__db.execute('INSERT INTO contacts (%s) VALUES (%s)'
+                                       % (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                                       self.__values(contact))
+        return cursor.lastrowid
+
+    def add_many(self, contacts):
+        """Add many contacts in one transaction, e.g. on import, and return their number."""
+        # indexing all new rows at the end is about five times faster than a
+        # trigger per row
+        with self.__db:
+            self.__db.execute('BEGIN')
+            last = self.__db.execute('SELECT coalesce(max(id), 0) FROM contacts').fetchone()[0]
+            self.__db.execute('DROP TRIGGER contacts_ai')
+            cursor = self.__db.executemany('INSERT INTO contacts (%s) VALUES (%s)'
+                                           % (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                                           (self.__values(c) for c in contacts))
+            self.__db.execute('INSERT INTO contacts_fts(rowid, %(search)s) SELECT id, %(search)s FROM contacts '
+                              'WHERE id > ?' % _NAMES, (last,))
+            self.__db.execute(INSERT_TRIGGER)
+        return cursor.rowcount
+
+    def update(self, id, contact):
+        with self.__db:
+            self.__db.execute('UPDATE contacts SET %s WHERE id = ?' % ', '.join('%s = ?' % c for c in COLUMNS),
+                              self.__values(contact) + [id])
+
+    def remove(self, id):
+        with self.__db:
+            self.__db.execute('DELETE FROM contacts WHERE id = ?', (id,))
+
+    def get(self, id):
+        """The Contact with id, KeyError if there is none."""
+        row = self.__db.execute('SELECT id, %s FROM contacts WHERE id = ?' % ', '.join(COLUMNS),
+                                (id,)).fetchone()
+        if row is None:
+            raise KeyError(id)
+        return Contact(*row)
+
+    def search(self, text, limit=10):
+        """Up to limit contacts with all words of text as prefixes.
+
+        Contacts whose name matches come first, then the ones matching in the
+        other columns, the newest first. Ranking all matches instead (bm25) takes
+        a hundred times longer for the first letter typed in a large book.
+        """
+        query = match_query(text)
+        if query is None:
+            return []
+        sql = ('SELECT c.id, %s FROM contacts_fts JOIN contacts c ON c.id = contacts_fts.rowid '
+               'WHERE contacts_fts MATCH ? ORDER BY contacts_fts.rowid DESC LIMIT ?'
+               % ', '.join('c.%s' % c for c in COLUMNS))
+        contacts = [Contact(*row) for row in self.__db.execute(sql, ('{name} : (%s)' % query, limit))]
+        if len(contacts) < limit:
+            found = set(c.id for c in contacts)
+            rows = self.__db.execute(sql, (query, limit + len(contacts)))
+            contacts.extend(c for c in map(Contact._make, rows) if c.id not in found)
+        return contacts[:limit]
+
+
+# Fill a recipient with a 'kontakt' id from the address book. Like with
+# letter.spec.merge_specs, the fields of the recipient which aren't None take
+# precedence over the ones of the contact, so an empty field stays empty.
+# Raises a ValueError if the id isn't a number or there is no such contact.
+def resolve_contact(recipient, book):
+    id = recipient.get('kontakt')
+    if id is None:
+        return recipient
+    try:
+        contact = book.get(int(id))
+    except (KeyError, ValueError):
+        raise ValueError('There is no contact %r in the address book' % id) from None
+    spec = contact.recipient_spec()
+    spec.update((k, v) for k, v in recipient.items() if k != 'kontakt' and v is not None)
+    return spec
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Manage the address book of the letters.')
+    parser.add_argument('--db', default=None, help='the address book (default: %s)' % default_path())
+    commands = parser.add_subparsers(dest='command', required=True)
+    imports = commands.add_parser('import', help='add the contacts of a CSV, JSON or JSON lines file')
+    imports.add_argument('filename')
+    search = commands.add_parser('search', help='print the contacts matching the words')
+    search.add_argument('text')
+    search.add_argument('-n', '--limit', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    with AddressBook(args.db) as book:
+        if args.command == 'import':
+            from letter.batch import iter_recipients
+            print('%d contacts imported' % book.add_many(iter_recipients(args.filename)))
+        else:
+            for contact in book.search(args.text, args.limit):
+                print('%6d  %s' % (contact.id, ', '.join(contact.address())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
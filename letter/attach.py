@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+# Append the PDF files of the attachments (Letter.set_attachment_pdfs) to the
+# PDF of a letter, so the letter and its enclosures end up in one file.
+#
+# The pages are copied into the writer with their content streams as they
+# are: pypdf doesn't decode the streams of pages it doesn't change and writes
+# them out with their original filters, so neither decoding nor compressing
+# again costs time for attachments with hundreds of pages. The copied pages of
+# the letter and all attachments are held in memory until the result is written.
+
+from contextlib import ExitStack
+
+from letter.combine import _pypdf
+from letter.files import replacing
+
+
+def append_pdfs(filename, attachments):
+    """Append the pages of the PDF files attachments to the PDF file filename.
+
+    The result is written to a new file with the permissions of filename,
+    which replaces it, so a file linked from a PdfCache isn't changed. The
+    pages of all files are held in memory until it is written.
+
+    :raises OSError: If a file can't be read or written.
+    :raises ValueError: If an attachment isn't a valid PDF file.
+    """
+    pypdf = _pypdf()
+    try:
+        with replacing(filename, suffix='.pdf') as tmp:
+            # the files are closed first, an open file can't be replaced on Windows
+            with ExitStack() as stack:
+                writer = pypdf.PdfWriter()
+                for name in [filename] + list(attachments):
+                    f = stack.enter_context(open(name, 'rb'))
+                    try:
+                        for page in pypdf.PdfReader(f).pages:
+                            writer.add_page(page)
+                    except pypdf.errors.PyPdfError as e:
+                        raise ValueError('%s is no valid PDF file: %s' % (name, e)) from None
+                writer.write(tmp)
+    except pypdf.errors.PyPdfError as e:
+        raise ValueError('The attachments of %s are no valid PDF files: %s' % (filename, e))
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+
+# Headless mail merge: build one letter per recipient from a shared template.
+# The TeX compiles are spread over a pool of processes; a failing letter is
+# reported in its result and doesn't stop the remaining ones, even if it kills
+# its worker process.
+#
+# CSV and JSON lines recipients are read one at a time while the letters are
+# built and only a bounded window of jobs is submitted to the pool, so the
+# memory doesn't grow with the number of recipients (see iter_batch).
+#
+# With a manifest (see letter.manifest) the built letters are recorded, so an
+# interrupted batch is continued by running it again: letters which are
+# already built from the same inputs are skipped.
+#
+#   python -m letter.batch template.json recipients.csv -o out -j 4
+
+import csv, json, os, sys
+from collections import namedtuple
+from contextlib import ExitStack
+
+from letter.letter import build_errors, describe_error
+from letter.spec import load_spec, letter_from_spec, letter_from_template, template_from_spec
+from letter.timing import NULL_RECORDER, Recorder, make_sink
+
+# skipped: the letter was already built by an earlier run, see letter.manifest
+BatchResult = namedtuple('BatchResult', ['index', 'filename', 'ok', 'error', 'cached', 'timings', 'skipped'])
+
+# caches of the current (worker) process by directory
+_caches = {}
+
+# the name of the manifest in the output directory, see letter.manifest
+DEFAULT_MANIFEST = 'manifest.jsonl'
+
+# the template of the batch in the current worker process, a spec until the
+# first letter prepares it as LetterTemplate
+_template = None
+
+
+# Yields the recipients one by one, CSV and JSON lines files are read while
+# the recipients are consumed. A JSON file is a single document and is loaded
+# as a whole. The byte order mark of CSV files saved by Excel is dropped.
+def iter_recipients(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    encoding = 'utf-8-sig' if ext == '.csv' else 'utf-8'
+    with open(filename, encoding=encoding, newline='') as f:
+        if ext == '.csv':
+            yield from csv.DictReader(f)
+        elif ext in ('.jsonl', '.ndjson'):
+            yield from (json.loads(line) for line in f if line.strip())
+        else:
+            recipients = json.load(f)
+            # a single letter, e.g. a draft
+            yield from [recipients] if isinstance(recipients, dict) else recipients
+
+
+def read_recipients(filename):
+    return list(iter_recipients(filename))
+
+
+def output_filename(outdir, index, recipient):
+    key = recipient.get('key') or 'letter_%05d' % (index + 1)
+    return os.path.join(outdir, '%s.pdf' % key)
+
+
+def _init_worker(template):
+    global _template
+    _template = template
+
+
+def _letter_from_spec(spec):
+    global _template
+    if _template is None:
+        return letter_from_spec(spec)
+    if isinstance(_template, dict):
+        _template = template_from_spec(_template)
+    return letter_from_template(_template, spec)
+
+
+def _get_cache(directory, max_size=None):
+    if directory not in _caches:
+        from letter.cache import PdfCache, DEFAULT_MAX_SIZE
+        _caches[directory] = PdfCache(directory, max_size or DEFAULT_MAX_SIZE)
+    return _caches[directory]
+
+
+def _new_recorder(options):
+    return Recorder() if options.get('timing') else NULL_RECORDER
+
+
+def _setup_letter(spec, options, recorder):
+    with recorder.stage('collect'):
+        letter = _letter_from_spec(spec)
+    letter.set_recorder(recorder)
+    if options.get('reproducible'):
+        letter.set_reproducible()
+    if options.get('format'):
+        from letter.fmt import FormatBuilder
+        letter.set_builder(FormatBuilder())
+    if options.get('cache'):
+        letter.set_cache(_get_cache(options['cache'], options.get('cache_size')))
+    return letter
+
+
+# Runs in the worker processes, therefore only picklable values go in and out.
+# The spec of the recipient is merged with the template of the worker.
+# The exceptions of the latex package can't be pickled, so they are turned into
+# a message right here. Returns the error message (None on success), whether
+# the PDF came from the cache and the timings of the stages (see letter.timing).
+def render_letter(spec, filename, options=None):
+    options = options or {}
+    recorder = _new_recorder(options)
+    try:
+        letter = _setup_letter(spec, options, recorder)
+        cache = letter.get_cache()
+        hits = cache.hits if cache else 0
+        letter.compile_pdf(filename)
+    except build_errors() + (RuntimeError, ValueError, OSError) as e:
+        return describe_error(e), False, recorder.take()
+    return None, bool(cache and cache.hits > hits), recorder.take()
+
+
+# Like render_letter for several letters, which are compiled in one TeX run
+# (see letter.combine). items are pairs of spec and filename, the result is
+# a list with the result of render_letter for each of them.
+def render_chunk(items, options=None):
+    from letter.combine import build_combined
+
+    options = options or {}
+    results = [None] * len(items)
+    recorders = [_new_recorder(options) for _ in items]
+    letters, filenames, indices = [], [], []
+    for index, (spec, filename) in enumerate(items):
+        try:
+            letters.append(_setup_letter(spec, options, recorders[index]))
+        except (RuntimeError, ValueError, OSError) as e:
+            results[index] = describe_error(e), False
+            continue
+        filenames.append(filename)
+        indices.append(index)
+
+    try:
+        built = build_combined(letters, filenames, len(letters))
+    except RuntimeError as e:  # pypdf is missing
+        built = [(describe_error(e), False)] * len(letters)
+    for index, result in zip(indices, built):
+        results[index] = result
+    return [result + (recorder.take(),) for result, recorder in zip(results, recorders)]
+
+
+# options: 'format' to compile against a precompiled preamble, 'reproducible'
+# to build the same bytes from the same letter (see Letter.set_reproducible),
+# 'cache' with the directory of a PdfCache, 'cache_size' for its limit in bytes,
+# 'timing' with a sink of letter.timing, which gets the timings of each letter,
+# 'chunk' with the number of letters compiled in one TeX run, 'window' with the
+# number of jobs (single letters or chunks) submitted at a time, by default two
+# per worker, 'manifest' with the file of a Manifest, which records the built
+# letters and skips those which are already built, and 'contacts' with an
+# AddressBook to fill the recipients with a 'kontakt' id (see
+# letter.addressbook.resolve_contact). A recipient whose contact isn't found
+# fails, the others are still built.
+#
+# recipients may be any iterable, e.g. iter_recipients. It is only consumed as
+# far as the window allows, the next job is submitted when one has finished.
+# The results are yielded in the order the letters are finished.
+def iter_batch(template, recipients, outdir, workers=None, options=None):
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    options = dict(options or {})
+    # the sink stays in this process, the workers only record
+    sink = options.pop('timing', None)
+    if sink is not None:
+        options['timing'] = True
+    chunk_size = max(1, options.get('chunk') or 1)
+    window = max(1, options.pop('window', None) or 2 * (workers or os.cpu_count() or 1))
+    manifest_file = options.pop('manifest', None)
+    # the address book stays in this process, the workers get the filled recipients
+    contacts = options.pop('contacts', None)
+
+    with ExitStack() as stack:
+        manifest = None
+        if manifest_file:
+            from letter.manifest import Manifest
+            manifest = stack.enter_context(Manifest(manifest_file))
+        pool = stack.enter_context(_Pool(workers, template))
+        pending = {}
+        for job in _jobs(template, recipients, outdir, chunk_size, manifest, contacts, options):
+            if isinstance(job, BatchResult):
+                yield job
+                continue
+            pending[_submit(pool, job, options)] = job
+            if len(pending) >= window:
+                yield from _finished(pool, pending, options, sink, manifest)
+        while pending:
+            yield from _finished(pool, pending, options, sink, manifest)
+
+
+# The process pool of a batch. ProcessPoolExecutor uses one worker per core if
+# workers is None, the template goes to each worker once instead of with every
+# letter. A worker process which dies, e.g. killed for lack of memory, breaks
+# the whole executor, which is then replaced by a new one (see _finished).
+class _Pool:
+    def __init__(self, workers, template):
+        self.workers = workers
+        self.template = template
+        self.executor = self.__new_executor()
+
+    def __new_executor(self):
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                   initargs=(self.template,))
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def restart(self):
+        self.executor.shutdown()
+        self.executor = self.__new_executor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.executor.shutdown()
+
+
+# Like iter_batch, but returns the results of all letters sorted by their index
+# and hands each of them to callback as soon as it is finished
+def run_batch(template, recipients, outdir, workers=None, callback=None, options=None):
+    results = []
+    for result in iter_batch(template, recipients, outdir, workers, options):
+        if callback:
+            callback(result)
+        results.append(result)
+    results.sort(key=lambda r: r.index)
+    return results
+
+
+# The chunks of letters to build, each letter as tuple of its index, spec,
+# filename and its entry of the manifest (key and input hash, None without a
+# manifest). Letters which the manifest has as done and recipients whose
+# contact isn't found are passed on as BatchResult instead.
+def _jobs(template, recipients, outdir, chunk_size, manifest, contacts=None, options=None):
+    if manifest is not None:
+        from letter.manifest import input_digest, template_digest
+        base = template_digest(template, options)
+    if contacts is not None:
+        from letter.addressbook import resolve_contact
+    chunk = []
+    for index, recipient in enumerate(recipients):
+        filename = output_filename(outdir, index, recipient)
+        if contacts is not None:
+            try:
+                recipient = resolve_contact(recipient, contacts)
+            except ValueError as e:
+                yield BatchResult(index, filename, False, describe_error(e), False, [], False)
+                continue
+        entry = None
+        if manifest is not None:
+            entry = os.path.relpath(filename, outdir), input_digest(base, recipient)
+            if manifest.done(entry[0], entry[1], filename):
+                yield BatchResult(index, filename, True, None, False, [], True)
+                continue
+        chunk.append((index, recipient, filename, entry))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Yields the results of the jobs of pending which are finished next and removes
+# them. If a worker process died, all jobs which were in flight fail, most of
+# them only because they shared the pool. The pool is replaced and their
+# letters are built again one at a time, so only a letter which kills its
+# worker again fails.
+def _finished(pool, pending, options, sink, manifest):
+    from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    if not any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+        for future in done:
+            yield from _results(future, pending.pop(future), sink, manifest)
+        return
+
+    # the others fail as well, the ones finished before keep their results
+    wait(pending, return_when=ALL_COMPLETED)
+    suspects = []
+    for future, chunk in list(pending.items()):
+        del pending[future]
+        if isinstance(future.exception(), BrokenProcessPool):
+            suspects.extend(chunk)
+        else:
+            yield from _results(future, chunk, sink, manifest)
+    pool.restart()
+    for letter in suspects:
+        future = _submit(pool, [letter], options)
+        wait([future])
+        if isinstance(future.exception(), BrokenProcessPool):
+            pool.restart()
+        yield from _results(future, [letter], sink, manifest)
+
+
+def _results(future, chunk, sink, manifest=None):
+    try:
+        outcomes = future.result()
+    except Exception as e:  # e.g. a worker process died
+        outcomes = [(describe_error(e), False, [])] * len(chunk)
+    for (index, recipient, filename, entry), (error, cached, timings) in zip(chunk, outcomes):
+        if sink is not None:
+            sink.emit(os.path.basename(filename), timings)
+        if manifest is not None and error is None:
+            try:
+                manifest.record(entry[0], entry[1], filename)
+            except OSError as e:
+                error = 'The letter could not be recorded in the manifest: %s' % e
+        yield BatchResult(index, filename, error is None, error, cached, timings, False)
+
+
+# A pool which broke since the last results is only noticed when its jobs are
+# finished, see _finished
+def _submit(pool, chunk, options):
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+
+    try:
+        if len(chunk) == 1:
+            index, recipient, filename, entry = chunk[0]
+            return pool.submit(_render_single, recipient, filename, options)
+        return pool.submit(render_chunk, [(recipient, filename) for index, recipient, filename, entry in chunk],
+                           options)
+    except BrokenProcessPool as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+
+def _render_single(spec, filename, options):
+    return [render_letter(spec, filename, options)]
+
+
+def _print_result(result):
+    if result.skipped:
+        print('done    %s' % result.filename)
+    elif result.cached:
+        print('cached  %s' % result.filename)
+    elif result.ok:
+        print('ok      %s' % result.filename)
+    else:
+        print('FAILED  %s: %s' % (result.filename, result.error))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Create one letter per recipient from a template.')
+    parser.add_argument('template', help='JSON file with the fields shared by all letters')
+    parser.add_argument('recipients', help='CSV, JSON or JSON lines file with one entry per letter')
+    parser.add_argument('-o', '--outdir', default='letters', help='directory for the PDF files')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: one per core)')
+    parser.add_argument('--format', action='store_true',
+                        help='load the preamble from a precompiled format (see letter.fmt)')
+    parser.add_argument('--reproducible', action='store_true',
+                        help='build identical PDF files from identical letters, \\today is the date of '
+                             'SOURCE_DATE_EPOCH if set')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='reuse PDF files of identical letters from this directory (see letter.cache)')
+    parser.add_argument('--cache-size', type=int, default=512, metavar='MB',
+                        help='size limit of the cache (default: 512 MB)')
+    parser.add_argument('--chunk', type=int, default=1, metavar='N',
+                        help='compile up to N letters in one TeX run and split the PDF (needs pypdf)')
+    parser.add_argument('--window', type=int, default=None, metavar='N',
+                        help='number of jobs submitted at a time (default: two per worker)')
+    parser.add_argument('--manifest', metavar='FILE',
+                        help='record the built letters and skip them when the batch is run again '
+                             '(default: %s in the output directory)' % DEFAULT_MANIFEST)
+    parser.add_argument('--no-manifest', action='store_true',
+                        help="don't record the built letters, build all letters")
+    parser.add_argument('--timing', metavar='log|summary|FILE',
+                        help='time the stages of each letter: log them, print percentiles at the end '
+                             'or append them to a JSON lines file')
+    parser.add_argument('--address-book', metavar='DB', nargs='?', const='',
+                        help="fill the recipients with a 'kontakt' id from the address book "
+                             '(default: see letter.addressbook)')
+    args = parser.parse_args(argv)
+
+    template = load_spec(args.template)
+    options = {'format': args.format, 'reproducible': args.reproducible, 'cache': args.cache,
+               'cache_size': args.cache_size * 1024 * 1024, 'chunk': args.chunk, 'window': args.window}
+    if not args.no_manifest:
+        options['manifest'] = args.manifest or os.path.join(args.outdir, DEFAULT_MANIFEST)
+    sink = None
+    if args.timing:
+        if args.timing == 'log':
+            import logging
+            logging.basicConfig(level=logging.INFO, format='%(message)s')
+        options['timing'] = sink = make_sink(args.timing)
+
+    # only the counts are kept, the results are printed as they come
+    total = failed = cached = skipped = 0
+    with ExitStack() as stack:
+        if args.address_book is not None:
+            from letter.addressbook import AddressBook
+            options['contacts'] = stack.enter_context(AddressBook(args.address_book or None))
+        recipients = iter_recipients(args.recipients)
+        for result in iter_batch(template, recipients, args.outdir, args.jobs, options):
+            _print_result(result)
+            total += 1
+            failed += not result.ok
+            cached += bool(result.cached)
+            skipped += result.skipped
+    if sink is not None:
+        sink.close()
+        if args.timing == 'summary':
+            print(sink.format_report())
+
+    print('%d letters created (%d from cache, %d done before), %d failed'
+          % (total - failed, cached, skipped, failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+# Build a letter in a separate process, which can be cancelled.
+#
+# The TeX compilation can't be interrupted from within Python, so a build is
+# run in a child process of its own. Cancelling it terminates the process
+# group of that child, which includes the latexmk and pdflatex processes.
+
+import multiprocessing, os, signal
+
+from letter.letter import build_errors, describe_error
+
+
+# The GUI starts builds from a thread, where forking isn't safe
+_context = multiprocessing.get_context('spawn')
+
+
+def _compile(letter, filename, conn):
+    # own process group, so a cancel also stops the TeX processes
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    # what the parent recorded before the start stays with the parent
+    letter.get_recorder().take()
+    error = None
+    try:
+        letter.compile_pdf(filename)
+    except build_errors() + (RuntimeError, ValueError, OSError) as e:
+        error = describe_error(e)
+    # the timings recorded in this process go back with the result
+    conn.send((error, letter.get_recorder().take()))
+    conn.close()
+
+
+class BuildProcess:
+    """Compile a letter to a PDF file in a child process.
+
+    The letter is copied into the child when the build is started, so it may be
+    changed afterwards without affecting the running build.
+
+    :param letter: The :class:`~letter.letter.Letter` to build.
+    :param filename: The name of the PDF file, see ``Letter.compile_pdf``.
+    """
+
+    def __init__(self, letter, filename=''):
+        self.letter = letter
+        self.filename = filename or 'letter.pdf'
+        self.error = None
+        self.records = []
+        self.cancelled = False
+        self.__process = None
+        self.__conn = None
+        self.__done = False
+
+    def start(self):
+        self.__conn, child_conn = _context.Pipe(duplex=False)
+        self.__process = _context.Process(target=_compile,
+                                       args=(self.letter, self.filename, child_conn))
+        self.__process.daemon = True
+        self.__process.start()
+        child_conn.close()
+
+    def is_alive(self):
+        return self.__process is not None and self.__process.is_alive()
+
+    def cancel(self):
+        if not self.is_alive():
+            return
+        self.cancelled = True
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(self.__process.pid, signal.SIGTERM)
+            else:
+                self.__process.terminate()
+        except OSError:  # finished in the meantime or not yet in its own group
+            self.__process.terminate()
+        self.__process.join()
+
+    # Wait for the build to finish. Returns True if it is finished (successful
+    # or not, see error and cancelled) and False if the timeout expired.
+    def wait(self, timeout=None):
+        if self.__done:
+            return True
+        if not self.cancelled:
+            if not self.__conn.poll(timeout):
+                return False
+            try:
+                self.error, self.records = self.__conn.recv()
+            except EOFError:  # died without a result, e.g. killed from outside
+                self.__process.join()
+                self.error = 'Build process exited with code %s' % self.__process.exitcode
+        self.__process.join()
+        self.__conn.close()
+        self.__done = True
+        return True
+
+    @property
+    def ok(self):
+        return self.__done and not self.cancelled and self.error is None
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# On-disk cache for built PDF files.
+#
+# The entries are addressed by a hash of the TeX source and the settings of
+# the builder, so a letter which is built again with the same content, e.g. a
+# reprint, is copied from the cache instead of being compiled. The cache has a
+# size limit; when it is exceeded the least recently used entries are removed.
+#
+# The entries are listed once per process, afterwards the size and the order
+# of use are kept up to date with each get and put. Entries added by other
+# processes in the meantime are only counted once they are used here.
+
+import hashlib, os, shutil
+from collections import OrderedDict
+
+from letter.files import replacing
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+
+def default_cache_dir():
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'latex-letter', 'pdf')
+
+
+class PdfCache:
+    """Content addressed store of PDF files with LRU eviction.
+
+    :param directory: Where the entries are stored.
+    :param max_size: Upper limit of the size of all entries in bytes.
+    :param link: Hardlink hits to the requested filename instead of copying
+                 them. The cache and Letter.compile_pdf replace output files
+                 instead of writing into them, but any other program changing
+                 a linked file in place also changes the entry.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE, link=False):
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        self.__size = None
+        # the sizes of the entries, the least recently used first
+        self.__index = None
+
+    @staticmethod
+    def key(source, settings=''):
+        h = hashlib.sha256(source.encode('utf-8'))
+        h.update(b'\0')
+        h.update(settings.encode('utf-8'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pdf')
+
+    def get(self, key, filename):
+        entry = self.path(key)
+        try:
+            # the modification time is the age used for the eviction
+            os.utime(entry)
+            self._materialize(entry, filename)
+            if self.__index is not None:
+                self.__used(entry, os.path.getsize(entry))
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key, pdf, filename=''):
+        entry = self.path(key)
+        basedir = os.path.dirname(entry)
+        if not os.path.exists(basedir):
+            os.makedirs(basedir)
+
+        # write under a temporary name first, so that concurrent readers never
+        # see an incomplete entry
+        with replacing(entry) as tmp:
+            pdf.save_to(tmp)
+
+        self.__used(entry, os.path.getsize(entry))
+        self._evict()
+
+        if filename:
+            self._materialize(entry, filename)
+
+    # The target is replaced, never written into: it may still be a link to
+    # another entry
+    def _materialize(self, entry, filename):
+        with replacing(filename) as tmp:
+            if self.link:
+                try:
+                    os.remove(tmp)
+                    os.link(entry, tmp)
+                    return
+                except FileNotFoundError:
+                    raise
+                except OSError:
+                    pass  # e.g. another file system, copy it instead
+            shutil.copyfile(entry, tmp)
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return
+        for sub in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, sub)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if name.endswith('.pdf'):
+                    path = os.path.join(subdir, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:  # evicted by another process
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def __load(self):
+        if self.__index is None:
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            self.__index = OrderedDict((path, size) for path, size, _ in entries)
+            self.__size = sum(self.__index.values())
+        return self.__index
+
+    # Make the entry the most recently used one
+    def __used(self, path, size):
+        index = self.__load()
+        self.__size += size - index.pop(path, 0)
+        index[path] = size
+
+    def size(self):
+        self.__load()
+        return self.__size
+
+    # The entry used last is kept even if it exceeds the limit on its own
+    def _evict(self):
+        index = self.__load()
+        while self.__size > self.max_size and len(index) > 1:
+            path, size = index.popitem(last=False)
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # evicted by another process
+                pass
+            self.__size -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.__index = OrderedDict()
+        self.__size = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': self.size()}
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+# Build many letters in one TeX run and split the PDF into one file per letter.
+# Starting TeX and loading the preamble costs more than typesetting a letter,
+# so a batch can compile its letters in chunks (see letter.batch --chunk).
+#
+# The letters of a chunk follow each other in one document, each with its own
+# g-brief environment and its fields set right before it. Switches such as
+# \faltmarken can't be turned off again, so only letters with the same switches,
+# builder and reproducible setting share a chunk. After each letter the number
+# of pages shipped out so far is recorded; the list ends up in the info
+# dictionary of the PDF, which is split at these page boundaries with pypdf.
+#
+# If a chunk fails, it is halved and both halves are built again until the
+# failing letter is built on its own, where it gets its usual error. The time
+# of compiling and splitting a chunk is recorded by its first letter.
+
+import os, shutil, tempfile
+
+from letter.letter import FIELDS, FIELD_NAMES, PREAMBLE, LatexNotAvailable, _latex, build_errors, describe_error
+
+DEFAULT_CHUNK_SIZE = 20
+
+# counts the shipped out pages and writes the page after each letter to the PDF
+SETUP = [
+    '\\usepackage{atbegshi}\n',
+    '\\newcounter{lettersheets}\n',
+    '\\AtBeginShipout{\\stepcounter{lettersheets}}\n',
+    '\\def\\letterends{}\n',
+    '\\AtEndDocument{\\pdfinfo{/LetterEnds (\\letterends)}}\n',
+    '\\begin{document}\n',
+    ]
+LETTER_END = '\\clearpage\\xdef\\letterends{\\letterends\\arabic{lettersheets} }\n'
+INFO_KEY = '/LetterEnds'
+
+BEGIN_DOCUMENT = '\\begin{document}\n'
+END_DOCUMENT = '\\end{document}\n'
+
+_SWITCHES = tuple(i for i, field in enumerate(FIELDS) if isinstance(field.default, bool))
+_TEXT = FIELD_NAMES.index('text')
+
+
+class PageInfoError(ValueError):
+    pass
+
+
+def _pypdf():
+    try:
+        import pypdf
+    except ImportError:
+        raise RuntimeError("The package 'pypdf' for Python is needed to split the PDF! "
+                           "Please make sure to install it: pip install pypdf")
+    return pypdf
+
+
+# The fields and text of a letter without \begin{document} and \end{document},
+# None if the text isn't a complete document, such a letter is built alone
+def letter_body(letter):
+    fragments = letter._fragments()
+    text = fragments[_TEXT]
+    begin = text.find(BEGIN_DOCUMENT)
+    end = text.rfind(END_DOCUMENT)
+    if begin < 0 or end < begin or text.count(BEGIN_DOCUMENT) != 1 or text.count(END_DOCUMENT) != 1:
+        return None
+    fragments[_TEXT] = text[:begin] + text[begin + len(BEGIN_DOCUMENT):end]
+    return fragments
+
+
+def combined_source(bodies, setup=''):
+    tex = list(PREAMBLE)
+    tex.append(setup)
+    tex.extend(SETUP)
+    for body in bodies:
+        tex.extend(body)
+        tex.append(LETTER_END)
+    tex.append(END_DOCUMENT)
+    return ''.join(tex)
+
+
+# Letters which may share a chunk
+def chunk_key(letter):
+    values = letter._values()
+    return letter._builder_settings(), letter._setup(), tuple(values[i] for i in _SWITCHES)
+
+
+def page_ranges(reader, count):
+    info = reader.metadata or {}
+    try:
+        ends = [int(end) for end in str(info.get(INFO_KEY, '')).split()]
+    except ValueError:
+        ends = []
+    if len(ends) != count or ends != sorted(set(ends)) or ends[-1] != len(reader.pages) or ends[0] < 1:
+        raise PageInfoError('The PDF has no valid page boundaries of its %d letters' % count)
+    return list(zip([0] + ends[:-1], ends))
+
+
+class _Pages:
+    # the pages of one letter, with save_to like the data returned by the builders
+    def __init__(self, writer):
+        self.writer = writer
+
+    def save_to(self, filename):
+        with open(filename, 'wb') as f:
+            self.writer.write(f)
+
+
+def split_pdf(pdf, count):
+    """Split the PDF of a chunk into the PDFs of its letters.
+
+    :param pdf: The combined PDF as returned by the builders, only ``save_to`` is used.
+    :param count: The number of letters in the chunk.
+    :return: A list of objects with ``save_to(filename)``, one per letter.
+    """
+    pypdf = _pypdf()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'chunk.pdf')
+        pdf.save_to(filename)
+        reader = pypdf.PdfReader(filename)
+        parts = []
+        for start, end in page_ranges(reader, count):
+            writer = pypdf.PdfWriter()
+            for page in reader.pages[start:end]:
+                writer.add_page(page)
+            parts.append(_Pages(writer))
+        # the reader keeps the whole file in memory, it may be removed now
+        return parts
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def _build_pdf(letter, source):
+    builder = letter.get_builder()
+    if builder is None:
+        return _latex().build_pdf(source)
+    return builder.build_pdf(source)
+
+
+def _save(letter, part, filename, source):
+    cache = letter.get_cache()
+    if cache is not None:
+        cache.put(cache.key(source, letter._builder_settings()), part, filename)
+    else:
+        part.save_to(filename)
+
+
+def _build_chunk(items, errors):
+    # items: (index, letter, filename, body, source) of letters sharing a chunk
+    if len(items) == 1:
+        index, letter, filename = items[0][:3]
+        try:
+            letter.compile_pdf(filename)
+        except build_errors() + (RuntimeError, ValueError, OSError) as e:
+            errors[index] = describe_error(e)
+        return
+
+    first = items[0][1]
+    try:
+        with first.get_recorder().stage('compile') as stage:
+            source = combined_source((item[3] for item in items), first._setup())
+            stage.size = len(source)
+            pdf = _build_pdf(first, source)
+        with first.get_recorder().stage('split'):
+            parts = split_pdf(pdf, len(items))
+    except LatexNotAvailable as e:
+        for item in items:
+            errors[item[0]] = describe_error(e)
+        return
+    except build_errors() + (RuntimeError, ValueError, OSError):
+        half = len(items) // 2
+        _build_chunk(items[:half], errors)
+        _build_chunk(items[half:], errors)
+        return
+
+    for (index, letter, filename, body, source), part in zip(items, parts):
+        try:
+            with letter.get_recorder().stage('save'):
+                _save(letter, part, filename, source)
+            letter._append_attachments(filename)
+        except (OSError, ValueError) as e:
+            errors[index] = describe_error(e)
+
+
+def build_combined(letters, filenames, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Build the PDF files of many letters with one TeX run per chunk of letters.
+
+    The result is the same as calling ``compile_pdf`` of each letter, including
+    the cache of the letters, but only letters which fail to build are compiled
+    on their own.
+
+    :param letters: The :class:`~letter.letter.Letter` objects to build.
+    :param filenames: The name of the PDF file of each letter.
+    :param chunk_size: The maximum number of letters compiled together.
+    :return: A list with the error message of each letter (None if it was built)
+        and whether its PDF came from the cache.
+    :raises RuntimeError: If pypdf isn't installed.
+    """
+    _pypdf()
+    errors = [None] * len(letters)
+    cached = [False] * len(letters)
+    chunks = {}
+    for index, (letter, filename) in enumerate(zip(letters, filenames)):
+        source = letter.render_tex()
+        cache = letter.get_cache()
+        if cache is not None and cache.get(cache.key(source, letter._builder_settings()), filename):
+            cached[index] = True
+            try:
+                letter._append_attachments(filename)
+            except (OSError, ValueError) as e:
+                errors[index] = describe_error(e)
+            continue
+        body = letter_body(letter)
+        item = (index, letter, filename, body, source)
+        if body is None:
+            _build_chunk([item], errors)
+        else:
+            chunks.setdefault(chunk_key(letter), []).append(item)
+
+    chunk_size = max(1, chunk_size)
+    for items in chunks.values():
+        for start in range(0, len(items), chunk_size):
+            _build_chunk(items[start:start + chunk_size], errors)
+    return list(zip(errors, cached))
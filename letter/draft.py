@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+# Drafts keep the complete state of a letter in a small versioned JSON document,
+# to continue writing it later or as input of the batch mode:
+#
+#   {"format":"latex-letter-draft","version":1,
+#    "fields":{"name":"John Doe","adresse":["Klaus\\\\\n",...],...},
+#    "anlagen_pdf":["agb.pdf"],
+#    "gui":{"name_line":"John Doe","faltmarken_checkbox":true,...}}
+#
+# fields has the prepared values of the fields which differ from their default,
+# so loading a draft doesn't escape anything again. A body which is read from a
+# file while the letter is written is kept as {"file": ..., "encoding": ...},
+# other bodies as their lines. anlagen_pdf is only there if PDF files are
+# appended to the letter. gui has the raw values of the GUI widgets by name.
+
+import json, os, tempfile, threading
+
+from letter.letter import Letter, FIELDS, FIELD_NAMES, TextSource
+from letter.text import Content
+
+FORMAT = 'latex-letter-draft'
+VERSION = 1
+
+_DEFAULTS = tuple(field.default for field in FIELDS)
+
+
+def default_autosave_path():
+    data = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(data, 'latex-letter', 'autosave.json')
+
+
+def is_draft(spec):
+    return isinstance(spec, dict) and spec.get('format') == FORMAT
+
+
+def check_draft(draft):
+    if not is_draft(draft):
+        raise ValueError('Not a draft of a letter')
+    if draft.get('version', 0) > VERSION:
+        raise ValueError('The draft was saved by a newer version (format %s)' % draft['version'])
+    unknown = set(draft.get('fields', ())) - set(FIELD_NAMES)
+    if unknown:
+        raise ValueError("Unknown letter field '%s'" % sorted(unknown)[0])
+
+
+def draft_from_letter(letter, gui=None):
+    """The draft of letter and the raw values of the GUI.
+
+    The values are only referenced, so this is cheap; bodies are only turned
+    into lines when the draft is encoded, see encode_draft.
+    """
+    fields = {name: val for name, val, default in zip(FIELD_NAMES, letter._values(), _DEFAULTS)
+              if val != default}
+    draft = {'format': FORMAT, 'version': VERSION, 'fields': fields, 'gui': dict(gui or {})}
+    if letter.get_attachment_pdfs():
+        draft['anlagen_pdf'] = list(letter.get_attachment_pdfs())
+    return draft
+
+
+def letter_from_draft(draft, letter=None):
+    """Set all fields of letter, a new one if not given, to the ones of draft."""
+    check_draft(draft)
+    letter = Letter() if letter is None else letter
+    fields = draft.get('fields', {})
+    for name, default in zip(FIELD_NAMES, _DEFAULTS):
+        val = fields.get(name, default)
+        if isinstance(val, dict):
+            val = Content.from_file(val['file'], val.get('encoding', 'utf-8'))
+        letter._set_val(name, val)
+    letter.set_attachment_pdfs(draft.get('anlagen_pdf', ()))
+    return letter
+
+
+def _encode_value(val):
+    if isinstance(val, Content) and val.file:
+        filename, encoding = val.file
+        return {'file': filename, 'encoding': encoding}
+    if isinstance(val, TextSource):
+        return list(val)
+    raise TypeError('%s values of letters can\'t be saved' % type(val).__name__)
+
+
+def encode_draft(draft):
+    return json.dumps(draft, ensure_ascii=False, separators=(',', ':'), default=_encode_value).encode('utf-8')
+
+
+def decode_draft(data):
+    draft = json.loads(data)
+    check_draft(draft)
+    return draft
+
+
+# Write into a temporary file next to filename first, so an interrupted write
+# never leaves a broken draft behind
+def save_draft(filename, draft):
+    data = encode_draft(draft)
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def load_draft(filename):
+    with open(filename, 'rb') as f:
+        return decode_draft(f.read())
+
+
+class AutoSaver:
+    """Saves drafts to filename in a background thread.
+
+    save only hands the draft over, the thread encodes and writes it. A draft
+    which is replaced by a newer one before the thread gets to it isn't written
+    at all. Errors are passed to on_error, in the thread of the saver.
+    """
+
+    def __init__(self, filename, on_error=None):
+        self.filename = filename
+        self.saved = 0  # the number of drafts written
+        self.__on_error = on_error
+        self.__condition = threading.Condition()
+        self.__pending = None
+        self.__writing = False
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__run, name='AutoSaver', daemon=True)
+        self.__thread.start()
+
+    def save(self, draft):
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError('The AutoSaver is closed')
+            self.__pending = draft
+            self.__condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until the last draft is written, return False on timeout."""
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__pending is None and not self.__writing, timeout)
+
+    def discard(self):
+        """Drop the draft which isn't written yet and remove the file, e.g.
+        once the letter is saved."""
+        with self.__condition:
+            self.__pending = None
+            self.__condition.wait_for(lambda: not self.__writing)
+            try:
+                os.remove(self.filename)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Write the last draft and stop the thread."""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+        self.__thread.join()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__pending is not None or self.__closed)
+                draft, self.__pending = self.__pending, None
+                if draft is None:
+                    return
+                self.__writing = True
+            saved = False
+            try:
+                save_draft(self.filename, draft)
+                saved = True
+            except (OSError, TypeError, ValueError) as e:
+                if self.__on_error is not None:
+                    self.__on_error(e)
+            with self.__condition:
+                self.__writing = False
+                self.saved += saved
+                self.__condition.notify_all()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+# Replace files as a whole: the new content is written to a temporary file next
+# to the target, which replaces it once it is complete. Readers see either the
+# old or the new file, never a partial one, and the old file is never truncated,
+# so other names linked to it, e.g. the entry of a PdfCache, keep their content.
+
+import contextlib, os, stat, tempfile
+
+# the umask can only be read by setting it, which isn't safe once threads run
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@contextlib.contextmanager
+def replacing(filename, suffix='.tmp'):
+    """Yield the name of a temporary file which replaces filename when the
+    block is left without an exception and is removed otherwise.
+
+    The file gets the permissions of filename, or those of a new file if
+    filename doesn't exist yet.
+    """
+    fd, tmp = tempfile.mkstemp(suffix=suffix, dir=os.path.dirname(os.path.abspath(filename)))
+    os.close(fd)
+    try:
+        yield tmp
+        try:
+            mode = stat.S_IMODE(os.stat(filename).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp, mode)
+        os.replace(tmp, filename)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
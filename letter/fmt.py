@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+# Compile letters against a precompiled LaTeX format.
+#
+# The preamble of every letter is the same (see PREAMBLE in letter.letter), but
+# TeX parses it again for each compilation, which takes most of the time for
+# a short letter. The FormatBuilder dumps the preamble once with the
+# mylatexformat package into a .fmt file and loads that instead.
+#
+# The name of the format contains a hash of the preamble and of the TeX
+# installation (binary, base format and the used packages), so a changed
+# preamble or an updated TeX distribution leads to a new format automatically.
+
+import hashlib, os, shutil, subprocess, tempfile
+
+from data import Data as I
+from latex.build import LatexBuilder, PdfLatexBuilder
+from latex.exc import LatexBuildError
+
+from letter.letter import PREAMBLE
+
+# mylatexformat stops dumping at this point, everything after it is read from
+# the document. When compiled without the format it's just \relax.
+END_OF_DUMP = '\\csname endofdump\\endcsname\n'
+
+# files the fingerprint of the TeX installation depends on, besides the
+# packages used in the preamble
+BASE_FILES = ['pdflatex.fmt', 'mylatexformat.ltx']
+
+_fingerprints = {}
+
+
+def default_cache_dir():
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'latex-letter', 'formats')
+
+
+def _preamble_files(preamble):
+    files = []
+    for line in preamble:
+        line = line.strip()
+        if line.startswith('\\documentclass'):
+            files.append(line.rpartition('{')[2].rstrip('}') + '.cls')
+        elif line.startswith('\\usepackage'):
+            files.append(line.rpartition('{')[2].rstrip('}') + '.sty')
+    return files
+
+
+def tex_fingerprint(pdflatex='pdflatex', files=()):
+    key = (pdflatex, tuple(files))
+    if key in _fingerprints:
+        return _fingerprints[key]
+
+    binary = shutil.which(pdflatex)
+    if not binary:
+        return None
+    binary = os.path.realpath(binary)
+    version = subprocess.check_output([binary, '--version'], stdin=subprocess.DEVNULL)
+    # kpsewhich fails if a file isn't found, the others are printed anyway
+    kpsewhich = subprocess.Popen(['kpsewhich', '-engine=pdftex'] + BASE_FILES + list(files),
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL)
+    paths = kpsewhich.communicate()[0]
+
+    h = hashlib.sha1(version.splitlines()[0])
+    for path in [binary] + paths.decode('utf-8', 'replace').split():
+        st = os.stat(path)
+        h.update(('%s:%d:%d\n' % (path, st.st_size, st.st_mtime)).encode('utf-8'))
+    _fingerprints[key] = h.hexdigest()
+    return _fingerprints[key]
+
+
+class FormatBuilder(LatexBuilder):
+    """A pdflatex based builder which loads the letter preamble from a
+    precompiled format.
+
+    Sources which don't start with the preamble are built with the
+    :class:`~latex.build.PdfLatexBuilder`.
+
+    :param preamble: The lines of the preamble to dump into the format.
+    :param pdflatex: The path to the ``pdflatex`` binary.
+    :param cache_dir: The directory the format files are stored in.
+    :param max_runs: Upper limit on the amount of ``pdflatex`` runs.
+    """
+
+    def __init__(self, preamble=PREAMBLE, pdflatex='pdflatex', cache_dir=None, max_runs=15):
+        self.preamble = ''.join(preamble)
+        self.pdflatex = pdflatex
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_runs = max_runs
+
+    def is_available(self):
+        return bool(shutil.which(self.pdflatex)) and bool(shutil.which('kpsewhich'))
+
+    def format_name(self):
+        fingerprint = tex_fingerprint(self.pdflatex, _preamble_files(self.preamble.splitlines()))
+        h = hashlib.sha1(self.preamble.encode('utf-8'))
+        h.update(fingerprint.encode('utf-8'))
+        return 'letter-%s' % h.hexdigest()[:16]
+
+    def format_file(self):
+        name = self.format_name()
+        fmt = os.path.join(self.cache_dir, name + '.fmt')
+        if not os.path.exists(fmt):
+            self._dump_format(name, fmt)
+        return fmt
+
+    def _dump_format(self, name, fmt):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        # dump in a temporary directory and move the result into the cache,
+        # this way concurrent builds never see a half written format
+        tmpdir = tempfile.mkdtemp(dir=self.cache_dir)
+        try:
+            with open(os.path.join(tmpdir, 'preamble.tex'), 'w', encoding='utf-8') as f:
+                f.write(self.preamble + END_OF_DUMP)
+                f.write('\\begin{document}\\end{document}\n')
+            args = [self.pdflatex, '-ini', '-jobname=%s' % name, '-interaction=batchmode',
+                    '-halt-on-error', '&pdflatex', 'mylatexformat.ltx', 'preamble.tex']
+            try:
+                subprocess.check_call(args, cwd=tmpdir,
+                                      stdin=subprocess.DEVNULL,
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+            except subprocess.CalledProcessError as e:
+                raise LatexBuildError(os.path.join(tmpdir, name + '.log')) from e
+            os.replace(os.path.join(tmpdir, name + '.fmt'), fmt)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def build_pdf(self, source, texinputs=[]):
+        if not source.startswith(self.preamble):
+            return PdfLatexBuilder(self.pdflatex, self.max_runs).build_pdf(source, texinputs)
+
+        if not self.is_available():
+            raise RuntimeError('pdflatex is not available. Please make sure LaTeX is installed.')
+
+        fmt = self.format_file()
+        source = self.preamble + END_OF_DUMP + source[len(self.preamble):]
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpdir, 'letter.tex'), 'w', encoding='utf-8') as f:
+                f.write(source)
+
+            args = [self.pdflatex, '-fmt=%s' % os.path.splitext(os.path.basename(fmt))[0],
+                    '-interaction=batchmode', '-halt-on-error', '-no-shell-escape',
+                    '-file-line-error', 'letter.tex']
+
+            newenv = os.environ.copy()
+            newenv['TEXINPUTS'] = os.pathsep.join(texinputs) + os.pathsep
+            # keep the default search path by the trailing separator
+            newenv['TEXFORMATS'] = os.path.dirname(fmt) + os.pathsep
+
+            # run until the aux file settles, like the PdfLatexBuilder
+            prev_aux = None
+            for _ in range(self.max_runs):
+                try:
+                    subprocess.check_call(args, cwd=tmpdir, env=newenv,
+                                          stdin=subprocess.DEVNULL,
+                                          stdout=subprocess.DEVNULL)
+                except subprocess.CalledProcessError as e:
+                    raise LatexBuildError(os.path.join(tmpdir, 'letter.log')) from e
+
+                with open(os.path.join(tmpdir, 'letter.aux'), 'rb') as f:
+                    aux = f.read()
+                if aux == prev_aux:
+                    break
+                prev_aux = aux
+            else:
+                raise RuntimeError('Maximum number of runs ({}) without a stable .aux file '
+                                   'reached.'.format(self.max_runs))
+
+            with open(os.path.join(tmpdir, 'letter.pdf'), 'rb') as f:
+                return I(f.read(), encoding=None)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
@@ -0,0 +1,770 @@
+# -*- coding: utf-8 -*-
+
+# The Qt GUI, started by main.py
+
+import contextlib, sys, os, queue, shutil, subprocess, tempfile, time
+
+from PyQt5.QtCore import Qt, QDate, QEvent, QModelIndex, QObject, QStringListModel, QThread, QTimer, pyqtSignal
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtWidgets import QDialog, QApplication, QMainWindow, QMessageBox, QProgressBar, QPushButton, \
+        QDockWidget, QScrollArea, QLabel, QLineEdit, QPlainTextEdit, QCheckBox, QRadioButton, QCompleter, \
+        QFileDialog
+
+from letter.draft import AutoSaver, default_autosave_path, draft_from_letter, letter_from_draft, load_draft, \
+        save_draft
+from letter.letter import Letter
+from letter.build import BuildProcess
+from letter.timing import Recorder, make_sink, process_start_time
+from letter.text import prepare_line, prepare_text, content_source, prepare_attachment
+from letter.main_gui import Ui_MainWindow as gui
+from letter.bank_gui import Ui_BankDialog as bank
+
+#TODO: maybe include something like pdf.is_available() to check if latex is installed and can be used  (http://pythonhosted.org/latex/)
+#if not pdf.is_available(): ...
+
+#TODO: save/create button filedialog öffnen http://doc.qt.io/qt-5/qfiledialog.html
+
+# the time this module was imported, the start of the GUI if the start of the
+# process is unknown
+_IMPORTED = time.time()
+
+class BankDialog(QDialog, bank):
+    def __init__(self, parent=None):
+        super(BankDialog, self).__init__(parent)
+        self.setupUi(self)
+
+
+# Runs a BuildProcess and reports back via signals, so the GUI stays responsive
+# while TeX is running
+class BuildThread(QThread):
+    progress = pyqtSignal(str)
+    succeeded = pyqtSignal(str)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, letter, filename='', parent=None):
+        super(BuildThread, self).__init__(parent)
+        self.build = BuildProcess(letter, filename)
+        self.__cancel = False
+
+    def cancel(self):
+        self.__cancel = True
+
+    def run(self):
+        self.progress.emit('PDF wird erstellt ...')
+        try:
+            self.build.start()
+        except OSError as e:
+            self.failed.emit(str(e))
+            return
+        start = time.time()
+        seconds = 0
+        # check for a cancel request a few times per second
+        while not self.build.wait(0.2):
+            if self.__cancel:
+                self.build.cancel()
+                self.build.wait()
+                break
+            if int(time.time() - start) > seconds:
+                seconds = int(time.time() - start)
+                self.progress.emit('PDF wird erstellt ... %d s' % seconds)
+
+        if self.build.cancelled:
+            self.cancelled.emit()
+        elif self.build.ok:
+            try:
+                self.succeeded.emit(self._result())
+            except (OSError, subprocess.SubprocessError) as e:
+                self.failed.emit(str(e))
+        else:
+            self.failed.emit(self.build.error)
+
+    def _result(self):
+        return self.build.filename
+
+
+# Builds the preview and converts its first page to an image with pdftoppm
+class PreviewThread(BuildThread):
+    def _result(self):
+        base = os.path.splitext(self.build.filename)[0]
+        subprocess.check_call(['pdftoppm', '-png', '-r', '80', '-singlefile', self.build.filename, base],
+                              stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return base + '.png'
+
+
+# Searches the address book with its own connection, so typing never waits for
+# SQLite. Queries overtaken by further typing are skipped.
+class ContactSearch(QThread):
+    found = pyqtSignal(str, list)
+
+    def __init__(self, path=None, parent=None):
+        super(ContactSearch, self).__init__(parent)
+        self.path = path
+        self.__queries = queue.Queue()
+
+    def search(self, text):
+        self.__queries.put(text)
+
+    def stop(self):
+        self.__queries.put(None)
+
+    def run(self):
+        import sqlite3
+        from letter.addressbook import AddressBook
+        try:
+            book = AddressBook(self.path)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print('Address book not available: %s' % e)
+            return
+        with book:
+            while True:
+                text = self.__queries.get()
+                while text is not None and not self.__queries.empty():
+                    text = self.__queries.get()
+                if text is None:
+                    return
+                self.found.emit(text, book.search(text))
+
+
+# Prints the time from the start of the process to the first paint of the
+# window, split into its phases, and quits (main.py --startup-time)
+class StartupTimer(QObject):
+    def __init__(self, parent=None):
+        super(StartupTimer, self).__init__(parent)
+        start = process_start_time()
+        self.marks = [('start', _IMPORTED)] if start is None else [('start', start), ('imports', _IMPORTED)]
+
+    def mark(self, name):
+        self.marks.append((name, time.time()))
+
+    def report(self):
+        phases = ', '.join('%s %.0f ms' % (name, (end - start) * 1000)
+                           for (_, start), (name, end) in zip(self.marks, self.marks[1:]))
+        total = self.marks[-1][1] - self.marks[0][1]
+        return 'Startup: %.0f ms to the first paint (%s)' % (total * 1000, phases)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            QApplication.instance().removeEventFilter(self)
+            self.mark('paint')
+            print(self.report())
+            QTimer.singleShot(0, QApplication.instance().quit)
+        return False
+
+
+class MainWindow(QMainWindow, gui):
+    def __init__(self, parent=None):
+        #QMainWindow.__init__(self, parent)
+        super(MainWindow, self).__init__(parent)
+        self.setupUi(self)
+        # set minimum date to 30 days ago, the calendar pops up from date_edit
+        # and is only built when it is opened
+        today = QDate.currentDate()
+        self.date_edit.setMinimumDate(today.addDays(-30))
+        self.date_edit.setDate(today)
+        self.__bank_dialog = None
+
+        # progress and cancel button of a running PDF build in the status bar
+        self.__build = None
+        self.build_progress = QProgressBar(self)
+        self.build_progress.setRange(0, 0)  # busy indicator
+        self.build_progress.setMaximumWidth(150)
+        self.build_progress.hide()
+        self.cancel_button = QPushButton('Abbrechen', self)
+        self.cancel_button.hide()
+        self.cancel_button.clicked.connect(self.cancel_pdf)
+        self.statusbar.addPermanentWidget(self.build_progress)
+        self.statusbar.addPermanentWidget(self.cancel_button)
+
+        # LETTER_TIMING=log|summary|FILE times the stages of save_tex and create_pdf
+        self.__timing = None
+        if os.environ.get('LETTER_TIMING'):
+            self.__timing = make_sink(os.environ['LETTER_TIMING'])
+
+        self._setup_preview()
+        self._setup_address_book()
+        self._setup_drafts()
+        self.actionAnhang.triggered.connect(self.choose_attachment_pdfs)
+
+    # Preview pane, which is rebuilt in the background shortly after the last
+    # change. A newer change cancels the build in flight and nothing is built
+    # if the TeX source is the same as for the last preview. Cancelled builds
+    # are kept until their thread is done; the files of a build are removed
+    # when it is done, the shown image is loaded by then.
+    # The dock is only built when the preview is shown the first time.
+    def _setup_preview(self):
+        self.__preview_build = None
+        self.__preview_builds = set()  # the running ones, including cancelled
+        self.__preview_tex = None
+        self.__preview_dir = None
+
+        self.preview_dock = None
+        self.menuAnsicht = self.menubar.addMenu('Ansicht')
+        self.preview_action = self.menuAnsicht.addAction('Vorschau')
+        self.preview_action.setCheckable(True)
+        self.preview_action.toggled.connect(self._show_preview)
+
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(800)
+        self.preview_timer.timeout.connect(self.update_preview)
+
+        self._connect_changes(self._schedule_preview)
+
+    # connect slot to the change signals of all inputs
+    def _connect_changes(self, slot):
+        for widget in self.findChildren(QLineEdit):
+            widget.textChanged.connect(slot)
+        for widget in self.findChildren(QPlainTextEdit):
+            widget.textChanged.connect(slot)
+        for widget in self.findChildren(QCheckBox) + self.findChildren(QRadioButton):
+            widget.toggled.connect(slot)
+        self.date_edit.dateChanged.connect(slot)
+
+    def _create_preview_dock(self):
+        self.preview_label = QLabel(self)
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_scroll = QScrollArea(self)
+        self.preview_scroll.setWidget(self.preview_label)
+        self.preview_scroll.setWidgetResizable(True)
+        self.preview_dock = QDockWidget('Vorschau', self)
+        self.preview_dock.setObjectName('preview_dock')
+        self.preview_dock.setWidget(self.preview_scroll)
+        self.preview_dock.setMinimumWidth(400)
+        self.addDockWidget(Qt.RightDockWidgetArea, self.preview_dock)
+        self.preview_dock.visibilityChanged.connect(self._preview_visibility)
+
+    def _show_preview(self, visible):
+        if self.preview_dock is None:
+            if not visible:
+                return
+            self._create_preview_dock()
+        self.preview_dock.setVisible(visible)
+
+    def _preview_visibility(self, visible):
+        # also when the dock is closed with its own button
+        self.preview_action.setChecked(visible)
+        if visible:
+            self.update_preview()
+
+    def _schedule_preview(self, *args):
+        if self.preview_dock is not None and self.preview_dock.isVisible():
+            self.preview_timer.start()  # restarts the timer on every change
+
+    def update_preview(self):
+        if not shutil.which('pdftoppm'):
+            self.preview_label.setText('Die Vorschau benötigt pdftoppm (poppler-utils).')
+            return
+        self.__collect_values()
+        tex = self.letter.render_tex()
+        if tex == self.__preview_tex:
+            return
+        self.__preview_tex = tex
+
+        if self.__preview_build is not None:
+            self.__preview_build.cancel()
+        if self.__preview_dir is None:
+            self.__preview_dir = tempfile.mkdtemp(prefix='letter-preview-')
+        # a new file for every build, the cancelled one may still be running
+        fd, filename = tempfile.mkstemp(suffix='.pdf', dir=self.__preview_dir)
+        os.close(fd)
+
+        build = PreviewThread(self.letter, filename, self)
+        build.succeeded.connect(lambda image: self._preview_ready(build, image))
+        build.failed.connect(lambda error: self._preview_failed(build, error))
+        build.finished.connect(lambda: self._preview_finished(build))
+        self.__preview_builds.add(build)
+        self.__preview_build = build
+        self.preview_dock.setWindowTitle('Vorschau (wird erstellt ...)')
+        build.start()
+
+    def _preview_ready(self, build, image):
+        if build is not self.__preview_build:
+            return
+        self.__preview_build = None
+        self.preview_label.setPixmap(QPixmap(image))
+        self.preview_dock.setWindowTitle('Vorschau')
+
+    def _preview_failed(self, build, error):
+        if build is not self.__preview_build:
+            return
+        self.__preview_build = None
+        self.preview_label.setText('Vorschau fehlgeschlagen:\n%s' % error)
+        self.preview_dock.setWindowTitle('Vorschau')
+
+    def _preview_finished(self, build):
+        self.__preview_builds.discard(build)
+        base = os.path.splitext(build.build.filename)[0]
+        for filename in (base + '.pdf', base + '.png'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(filename)
+        build.deleteLater()
+
+    # Completion of the sender while its name is typed and of the recipient
+    # while the first line of the address is typed. Selecting a contact fills
+    # the other fields. LETTER_ADDRESS_BOOK overrides the path of the database.
+    def _setup_address_book(self):
+        self.__address_book = os.environ.get('LETTER_ADDRESS_BOOK') or None
+        self.__contact_search = None  # started with the first search
+        self.__contact_widget = None
+        self.__contact_query = None
+        self.__contacts = []
+        self.__filling = False
+
+        self.contact_model = QStringListModel(self)
+        self.contact_completer = QCompleter(self.contact_model, self)
+        # the contacts are already filtered by the address book
+        self.contact_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.contact_completer.activated[QModelIndex].connect(self._contact_selected)
+        self.contact_completer.popup().installEventFilter(self)
+
+        self.name_line.textEdited.connect(lambda text: self._search_contacts(self.name_line, text))
+        self.recipient_text.textChanged.connect(self._recipient_changed)
+
+        self.menuAdressbuch = self.menubar.addMenu('Adressbuch')
+        self.menuAdressbuch.addAction('Absender speichern', self.save_sender)
+        self.menuAdressbuch.addAction('Empfänger speichern', self.save_recipient)
+
+    # The completer passes the keys of its popup on to its widget first, where
+    # Return would insert a new line into recipient_text instead of selecting
+    def eventFilter(self, obj, event):
+        if obj is self.contact_completer.popup() and event.type() == QEvent.KeyPress and \
+                event.key() in (Qt.Key_Return, Qt.Key_Enter, Qt.Key_Tab) and \
+                self.__contact_widget is self.recipient_text:
+            index = obj.currentIndex()
+            obj.hide()
+            if index.isValid():
+                self._contact_selected(index)
+            return True
+        return super(MainWindow, self).eventFilter(obj, event)
+
+    def _recipient_changed(self):
+        if self.__filling:
+            return
+        text = self.recipient_text.toPlainText()
+        if '\n' not in text:
+            self._search_contacts(self.recipient_text, text)
+
+    def _search_contacts(self, widget, text):
+        self.__contact_widget = widget
+        self.__contact_query = text
+        if not text.strip():
+            self.contact_completer.popup().hide()
+            return
+        if self.__contact_search is None:
+            self.__contact_search = ContactSearch(self.__address_book, self)
+            self.__contact_search.found.connect(self._contacts_found)
+            self.__contact_search.start()
+        self.__contact_search.search(text)
+
+    def _contacts_found(self, text, contacts):
+        if text != self.__contact_query:
+            return  # the user has typed on, a newer search is running
+        self.__contacts = contacts
+        self.contact_model.setStringList([', '.join(contact.address()) for contact in contacts])
+        if not contacts:
+            self.contact_completer.popup().hide()
+            return
+        widget = self.__contact_widget
+        self.contact_completer.setWidget(widget)
+        if widget is self.recipient_text:
+            self.contact_completer.complete(widget.cursorRect())
+        else:
+            self.contact_completer.complete()
+
+    def _contact_selected(self, index):
+        contact = self.__contacts[index.row()]
+        self.__filling = True
+        try:
+            if self.__contact_widget is self.recipient_text:
+                self.fill_recipient(contact)
+            else:
+                self.fill_sender(contact)
+        finally:
+            self.__filling = False
+
+    def fill_sender(self, contact):
+        self.name_line.setText(contact.name)
+        self.street_line.setText(contact.strasse)
+        self.city_line.setText(contact.ort)
+        self.country_line.setText(contact.land)
+        self.phone_line.setText(contact.telefon)
+        self.email_line.setText(contact.email)
+
+    def fill_recipient(self, contact):
+        self.recipient_text.setPlainText('\n'.join(contact.address()))
+        if contact.anrede:
+            self.salutation_line.setText(contact.anrede)
+
+    def __add_contact(self, contact):
+        import sqlite3
+        from letter.addressbook import AddressBook
+        try:
+            with AddressBook(self.__address_book) as book:
+                book.add(contact)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            QMessageBox.warning(self, 'Adressbuch', 'Der Kontakt wurde nicht gespeichert:\n%s' % e)
+            return
+        self.statusbar.showMessage('Kontakt gespeichert', 3000)
+
+    def save_sender(self):
+        self.__add_contact({'name': self.name_line.text(), 'strasse': self.street_line.text(),
+                            'ort': self.city_line.text(), 'land': self.country_line.text(),
+                            'telefon': self.phone_line.text(), 'email': self.email_line.text()})
+
+    def save_recipient(self):
+        from letter.addressbook import Contact
+        self.__add_contact(Contact.from_address(self.recipient_text.toPlainText(),
+                                                anrede=self.salutation_line.text()))
+
+    # The letter is saved as draft (see letter.draft) a few seconds after the
+    # last change. The draft is only collected here, an AutoSaver thread writes
+    # it. LETTER_AUTOSAVE overrides the path of the draft. It is removed when
+    # the letter is saved as draft and when the window is closed, so only the
+    # letter of a session which ended otherwise is offered to be restored.
+    def _setup_drafts(self):
+        self.__autosave_path = os.environ.get('LETTER_AUTOSAVE') or default_autosave_path()
+        self.__autosaver = None  # started with the first change
+
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setSingleShot(True)
+        self.autosave_timer.setInterval(2000)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self._connect_changes(lambda *args: self.autosave_timer.start())
+
+        self.menuEntwurf = self.menubar.addMenu('Entwurf')
+        self.menuEntwurf.addAction('Entwurf öffnen ...', self.open_draft)
+        self.menuEntwurf.addAction('Entwurf speichern ...', self.save_draft)
+
+    # the raw values of the inputs by their name
+    def _gui_values(self):
+        values = {}
+        for widget in self.findChildren(QLineEdit) + self.findChildren(QPlainTextEdit) + \
+                self.findChildren(QCheckBox) + self.findChildren(QRadioButton):
+            name = widget.objectName()
+            # only the inputs of the form, not e.g. the ones inside the calendar
+            if getattr(self, name, None) is not widget:
+                continue
+            if isinstance(widget, QLineEdit):
+                values[name] = widget.text()
+            elif isinstance(widget, QPlainTextEdit):
+                values[name] = widget.toPlainText()
+            else:
+                values[name] = widget.isChecked()
+        values['date_edit'] = self.date_edit.date().toString(Qt.ISODate)
+        return values
+
+    def _set_gui_values(self, values):
+        for name, val in values.items():
+            widget = getattr(self, name, None)
+            if isinstance(widget, QLineEdit):
+                widget.setText(val)
+            elif isinstance(widget, QPlainTextEdit):
+                widget.setPlainText(val)
+            elif isinstance(widget, (QCheckBox, QRadioButton)):
+                widget.setChecked(val)
+        # drafts saved before date_edit replaced the calendar have calendarWidget
+        date = values.get('date_edit', values.get('calendarWidget'))
+        if date:
+            self.date_edit.setDate(QDate.fromString(date, Qt.ISODate))
+
+    def _draft(self):
+        self.__collect_values()
+        return draft_from_letter(self.letter, self._gui_values())
+
+    def autosave(self):
+        if self.__autosaver is None:
+            self.__autosaver = AutoSaver(self.__autosave_path,
+                                         lambda e: print('Draft not saved: %s' % e))
+        self.__autosaver.save(self._draft())
+
+    def discard_autosave(self):
+        self.autosave_timer.stop()
+        if self.__autosaver is not None:
+            self.__autosaver.discard()
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.__autosave_path)
+
+    def load_draft(self, draft):
+        letter_from_draft(draft, self.letter)
+        self.__filling = True  # no completion of the recipient
+        try:
+            self._set_gui_values(draft.get('gui', {}))
+        finally:
+            self.__filling = False
+
+    # offers to continue the letter of the last session
+    def restore_autosave(self):
+        if not os.path.isfile(self.__autosave_path):
+            return
+        try:
+            draft = load_draft(self.__autosave_path)
+        except (OSError, ValueError) as e:
+            print('Draft not restored: %s' % e)
+            return
+        answer = QMessageBox.question(self, 'Entwurf', 'Den zuletzt bearbeiteten Brief wiederherstellen?')
+        if answer == QMessageBox.Yes:
+            self.load_draft(draft)
+
+    def open_draft(self):
+        filename = QFileDialog.getOpenFileName(self, 'Entwurf öffnen', '', 'Entwürfe (*.json)')[0]
+        if not filename:
+            return
+        try:
+            self.load_draft(load_draft(filename))
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, 'Entwurf', 'Der Entwurf kann nicht geöffnet werden:\n%s' % e)
+
+    def save_draft(self):
+        filename = QFileDialog.getSaveFileName(self, 'Entwurf speichern', 'entwurf.json', 'Entwürfe (*.json)')[0]
+        if not filename:
+            return
+        try:
+            save_draft(filename, self._draft())
+        except (OSError, TypeError) as e:
+            QMessageBox.warning(self, 'Entwurf', 'Der Entwurf wurde nicht gespeichert:\n%s' % e)
+            return
+        self.discard_autosave()
+        self.statusbar.showMessage('Entwurf gespeichert', 3000)
+
+    def set_letter(self, letter):
+        self.letter = letter
+        if self.__timing is not None:
+            letter.set_recorder(Recorder())
+
+    def _emit_timing(self, key, records=()):
+        if self.__timing is not None:
+            recorder = self.letter.get_recorder()
+            recorder.extend(records)
+            self.__timing.emit(key, recorder.take())
+
+    def __prepare_line(self, line):
+        return prepare_line(line)
+
+    def __prepare_text(self, raw):
+        return prepare_text(raw)
+
+    def __prepare_content(self, content):
+        return content_source(content)
+
+    def __prepare_attachment(self, raw, label):
+        return prepare_attachment(raw, label)
+
+    def __collect_values(self):
+        missing = []
+
+        self.letter.set_lochermarke(self.lochermarke_checkbox.isChecked())
+        self.letter.set_faltmarken(self.faltmarken_checkbox.isChecked())
+        self.letter.set_fenstermarken(self.fenstermarken_checkbox.isChecked())
+        self.letter.set_trennlinien(self.trennlinien_checkbox.isChecked())
+
+        name = self.name_line.text()
+        street = self.street_line.text()
+        city = self.city_line.text()
+        country = self.country_line.text()
+        if not name:
+            missing.append(self.name_label)
+        if not street:
+            missing.append(self.street_label)
+        if not city:
+            missing.append(self.city_label)
+        self.letter.set_absender(name, street, city, country)
+        self.letter.set_unterschrift(name)
+
+        recipient = self.recipient_text.toPlainText()
+        if not recipient:
+            missing.append(self.recipient_label)
+        recipient = self.__prepare_text(recipient)
+        self.letter.set_adresse(recipient)
+
+        content = self.content_text.toPlainText()
+        if not content:
+            missing.append(self.content_label)
+        text = self.__prepare_content(content)
+        self.letter.set_text(text)
+
+        subject = self.subject_line.text()
+        if not subject:
+            missing.append(self.subject_label)
+        subject = self.__prepare_line(subject)
+        self.letter.set_betreff(subject)
+        salutation = self.salutation_line.text()
+        if not salutation:
+            missing.append(self.salutation_label)
+        salutation = self.__prepare_line(salutation)
+        self.letter.set_anrede(salutation)
+        greeting = self.greeting_line.text()
+        if not greeting:
+            missing.append(self.greeting_label)
+        greeting = self.__prepare_line(greeting)
+        self.letter.set_gruss(greeting)
+
+        mail = self.email_line.text()
+        if mail:
+            self.letter.set_mail(mail)
+        phone = self.phone_line.text()
+        if phone:
+            self.letter.set_phone(phone)
+
+        date = self.date_edit.date().toString("dd.MM.yyyy")
+        if self.only_date_radio.isChecked():
+            self.letter.set_datum(date)
+        else:
+            city = city.partition(' ')[2]
+            self.letter.set_datum('%s, %s' % (city, date))
+
+        attachment = self.attachment_text.toPlainText()
+        label = ''
+        if self.attachment_dash_radio.isChecked():
+            label = '--'
+        elif self.attachment_dot_radio.isChecked():
+            label = '$\cdot$'
+        else:  # default; shouldn't be used since one radio button has to be selected
+            label = '$\bullet$'
+        if attachment:
+            self.letter.set_anlagen(self.__prepare_attachment(attachment, label))
+
+        return missing
+
+    def _check_values(self):
+        with self.letter.get_recorder().stage('collect'):
+            missing = self.__collect_values()
+        if missing:
+            print('Missing fields:')
+            for miss in missing:
+                print(miss.text(), miss.buddy())
+            return False
+        else:
+            return True
+
+    # PDF files appended to the PDF of the letter, their names are listed as
+    # attachments unless the list is filled in already
+    def choose_attachment_pdfs(self):
+        filenames = QFileDialog.getOpenFileNames(self, 'Anhang', '', 'PDF (*.pdf)')[0]
+        if not filenames:
+            return
+        self.letter.set_attachment_pdfs(filenames)
+        if not self.attachment_text.toPlainText():
+            self.attachment_text.setPlainText('\n'.join(os.path.splitext(os.path.basename(f))[0]
+                                                        for f in filenames))
+        self.statusbar.showMessage('%d PDF-Dateien werden angehängt' % len(filenames), 3000)
+        self.autosave_timer.start()
+
+    def showBank(self):
+        bank, blz, konto, result = self._getBank(self)
+        if result:
+            self.letter.set_bank(bank, blz, konto)
+
+    def save_tex(self):
+        if self._check_values():
+            self.letter.save_tex()
+            self._emit_timing('letter.tex')
+            print('letter.tex created')
+
+    def create_pdf(self):
+        if self.__build is not None:
+            self.statusbar.showMessage('Es wird bereits eine PDF-Datei erstellt', 3000)
+            return
+        if self._check_values():
+            self.__build = BuildThread(self.letter, parent=self)
+            self.__build.progress.connect(self.statusbar.showMessage)
+            self.__build.succeeded.connect(self._pdf_created)
+            self.__build.failed.connect(self._pdf_failed)
+            self.__build.cancelled.connect(self._pdf_cancelled)
+            self.__build.finished.connect(self._build_finished)
+            self.create_button.setEnabled(False)
+            self.build_progress.show()
+            self.cancel_button.show()
+            self.__build.start()
+
+    def cancel_pdf(self):
+        if self.__build is not None:
+            self.cancel_button.setEnabled(False)
+            self.__build.cancel()
+
+    def _pdf_created(self, filename):
+        self.statusbar.showMessage('%s erstellt' % filename, 5000)
+        print('%s created' % filename)
+
+    def _pdf_failed(self, error):
+        self.statusbar.showMessage('Erstellen der PDF-Datei fehlgeschlagen', 5000)
+        QMessageBox.warning(self, 'PDF erstellen', 'Die PDF-Datei konnte nicht erstellt werden:\n%s' % error)
+
+    def _pdf_cancelled(self):
+        self.statusbar.showMessage('Erstellen der PDF-Datei abgebrochen', 5000)
+
+    def _build_finished(self):
+        if not self.__build.build.cancelled:
+            self._emit_timing(self.__build.build.filename, self.__build.build.records)
+        self.__build.deleteLater()
+        self.__build = None
+        self.build_progress.hide()
+        self.cancel_button.hide()
+        self.cancel_button.setEnabled(True)
+        self.create_button.setEnabled(True)
+
+    def closeEvent(self, event):
+        for build in [self.__build] + list(self.__preview_builds):
+            if build is not None:
+                build.cancel()
+                build.wait()
+        if self.__contact_search is not None:
+            self.__contact_search.stop()
+            self.__contact_search.wait()
+        self.discard_autosave()
+        if self.__autosaver is not None:
+            self.__autosaver.close()
+        if self.__preview_dir:
+            shutil.rmtree(self.__preview_dir, ignore_errors=True)
+        if self.__timing is not None:
+            self.__timing.close()
+            if hasattr(self.__timing, 'format_report'):
+                print(self.__timing.format_report())
+        super(MainWindow, self).closeEvent(event)
+
+    # the bank dialog is built when it is opened the first time and reused
+    def bank_dialog(self):
+        if self.__bank_dialog is None:
+            self.__bank_dialog = BankDialog(self)
+        return self.__bank_dialog
+
+    # static method to show the bank dialog and get bank name, code, and account
+    @staticmethod
+    def _getBank(parent=None):
+        dialog = parent.bank_dialog() if isinstance(parent, MainWindow) else BankDialog(parent)
+        try:
+            if parent.letter and isinstance(parent.letter, Letter):
+                bank, blz, konto = parent.letter.get_bank()
+                dialog.bank_name_line.setText(bank)
+                dialog.bank_code_line.setText(blz)
+                dialog.account_line.setText(konto)
+        except AttributeError:
+            pass
+        result = dialog.exec_()
+        return (dialog.bank_name_line.text(), dialog.bank_code_line.text(), dialog.account_line.text(), result == QDialog.Accepted)
+
+
+def main():
+    if os.environ.get('LETTER_TIMING') == 'log':
+        import logging
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+    # main.py --startup-time measures the startup, see StartupTimer
+    startup = None
+    measure = '--startup-time' in sys.argv
+    if measure:
+        sys.argv.remove('--startup-time')
+    with Letter() as letter:
+        app = QApplication(sys.argv)
+        if measure:
+            startup = StartupTimer(app)
+            startup.mark('qt')
+            app.installEventFilter(startup)
+        w = MainWindow()
+        if startup is not None:
+            startup.mark('window')
+        w.set_letter(letter)
+        w.show()
+        if startup is None:
+            w.restore_autosave()
+        sys.exit(app.exec_())
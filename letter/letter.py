@@ -1,86 +1,335 @@
 # -*- coding: utf-8 -*-
 
-import sys, os
-from collections import OrderedDict
-from tempfile import TemporaryFile as tmp_file
-
-try:
-    from latex import build_pdf, LatexBuildError
-except ImportError:
-    print("The package 'latex' for Python is not available!")
-    print("Please make sure to install it: pip install latex")
-    print("with enough rights to install something.")
-    sys.exit(1)
+import abc, io, sys, os, re, time
+from collections import namedtuple
+
+from letter.files import replacing
+from letter.timing import NULL_RECORDER
+
+
+class LatexNotAvailable(RuntimeError):
+    pass
+
+
+# The latex package is only imported when the first PDF is built, so scripts and
+# worker processes which don't compile anything don't pay for it
+def _latex():
+    try:
+        import latex
+    except ImportError:
+        raise LatexNotAvailable("The package 'latex' for Python is not available! "
+                                "Please make sure to install it: pip install latex")
+    return latex
+
+
+# Exceptions of a failed compilation for except clauses and isinstance checks,
+# looked up lazily as well. Empty if the latex package isn't available.
+def build_errors():
+    try:
+        from latex import LatexBuildError
+    except ImportError:
+        return ()
+    return (LatexBuildError,)
+
+
+def describe_error(exc):
+    if isinstance(exc, build_errors()):
+        errors = exc.get_errors()
+        if errors:
+            return u'line {0[line]}: {0[error]}'.format(errors[0])
+        return 'Building PDF failed!'
+    return '%s: %s' % (type(exc).__name__, exc)
+
+# fixed part of every letter, it doesn't depend on the content of the letter
+PREAMBLE = ['\documentclass[11pt]{g-brief}\n',
+        '\\usepackage[utf8]{inputenc}\n',
+        '\\usepackage[ngerman]{babel}\n',
+        '\\usepackage{enumerate}\n',
+        '\\usepackage{gensymb}\n',
+        '\\usepackage{eurosym}\n\n']
+
+# pdfTeX writes the time of the build into the info dictionary, a trailer ID
+# derived from that time and the name of the temporary file, and its banner.
+# Without them the same source gives the same bytes. The commands are skipped
+# by engines which don't know them.
+REPRODUCIBLE_SETUP = [
+    '\\ifdefined\\pdfinfoomitdate\\pdfinfoomitdate=1\\fi\n',
+    '\\ifdefined\\pdftrailerid\\pdftrailerid{}\\fi\n',
+    '\\ifdefined\\pdfsuppressptexinfo\\pdfsuppressptexinfo=-1\\fi\n',
+    ]
+
+
+def source_date_epoch():
+    """The date of reproducible builds from SOURCE_DATE_EPOCH, None if not set."""
+    epoch = os.environ.get('SOURCE_DATE_EPOCH', '').strip()
+    return int(epoch) if epoch else None
+
+
+# The TeX which makes a build reproducible, with the date of \today fixed to
+# source_date in seconds since the epoch (UTC) if given
+def reproducible_setup(source_date=None):
+    setup = list(REPRODUCIBLE_SETUP)
+    if source_date is not None:
+        date = time.gmtime(source_date)
+        setup.append('\\year=%d \\month=%d \\day=%d \\time=%d\n'
+                     % (date.tm_year, date.tm_mon, date.tm_mday, date.tm_hour * 60 + date.tm_min))
+    return ''.join(setup)
+
+# symbols which will mess up the latex compilation and their replacement
+LATEX_SYMBOLS = {
+        '\\': '\\textbackslash ',
+        '%': '\%',
+        '$': '\$',
+        '{': '\{',
+        '}': '\}',
+        '_': '\_',
+        '&': '\&',
+        '#': '\#',
+        '§': '\S ',
+        '€': '\euro ',
+        '~': '\\textasciitilde ',
+        '^': '\\textasciicircum ',
+        '|': '\\textbar ',
+        '°': '\degree ',
+        '<': '\\textless ',
+        '>': '\\textgreater ',
+        '£': '\pounds ',
+        '™': '\\texttrademark ',
+        '©': '\copyright ',
+        '®': '\\textregistered ',
+        '†': '\dag ',
+        '‡': '\ddag ',
+        '¶': '\P ',
+        '¿': '\\textquestiondown ',
+        '¡': '\\textexclamdown '
+        }
+
+# LaTeX symbols are escaped in one of two ways, depending on the length of the
+# text. Long texts, like the body of a letter, which letter.text escapes as a
+# whole, are run through str.replace once for each symbol found in them. The
+# backslash goes first, so the backslashes of the TeX commands put in for the
+# other symbols aren't replaced again.
+_SPLIT_SIZE = 64
+_LATEX_REPLACEMENTS = tuple(sorted(LATEX_SYMBOLS.items(), key=lambda item: item[0] != '\\'))
+
+# Short strings, e.g. a line of the address, are split at the symbols by a
+# precompiled pattern, which leaves the symbols at the odd indices, where they
+# are mapped to their replacement. Strings without a symbol are returned as
+# they are.
+_LATEX_RE = re.compile('([%s])' % re.escape(''.join(LATEX_SYMBOLS)))
+_latex_symbol = LATEX_SYMBOLS.__getitem__
+
+
+def escape_latex(text):
+    if len(text) > _SPLIT_SIZE:
+        for symbol, replacement in _LATEX_REPLACEMENTS:
+            if symbol in text:
+                text = text.replace(symbol, replacement)
+        return text
+    if _LATEX_RE.search(text) is None:
+        return text
+    parts = _LATEX_RE.split(text)
+    parts[1::2] = map(_latex_symbol, parts[1::2])
+    return ''.join(parts)
+
+# The fields of a letter in the order they are written to the TeX file: name,
+# TeX command and default value. Booleans switch a command on or off (it is
+# commented out), lists are TeX lines put in braces and strings a single
+# argument. The schema is shared by all letters, which only keep the values.
+Field = namedtuple('Field', ['name', 'command', 'default'])
+
+FIELDS = (
+    # allgemeine Einstellungen
+    Field('lochermarke', '\\lochermarke', True),
+    Field('faltmarken', '\\faltmarken', True),
+    Field('fenstermarken', '\\fenstermarken', True),
+    Field('trennlinien', '\\trennlinien', True),
+    Field('klassisch', '\\klassisch', False),
+    Field('unserzeichen', '\\unserzeichen', False),
+    # Korrespondenz
+    Field('ihrzeichen', '\\IhrZeichen', ''),
+    Field('ihrschreiben', '\\IhrSchreiben', ''),
+    Field('meinzeichen', '\\MeinZeichen', ''),
+
+    # Absender-Adresse
+    Field('name', '\\Name', ''),
+    Field('strasse', '\\Strasse', ''),
+    Field('zusatz', '\\Zusatz', ''),
+    Field('retouradresse', '\\RetourAdresse', ''),
+    Field('ort', '\\Ort', ''),
+    Field('land', '\\Land', ''),
+    # Kontaktinformationen
+    Field('telefon', '\\Telefon', ''),
+    Field('telefax', '\\Telefax', ''),
+    Field('telex', '\\Telex', ''),
+    Field('http', '\\HTTP', ''),
+    Field('email', '\\EMail', ''),
+    # Bankverbindung
+    Field('bank', '\\Bank', ''),
+    Field('blz', '\\BLZ', ''),
+    Field('konto', '\\Konto', ''),
+    # Anschrift
+    Field('postvermerk', '\\Postvermerk', ''),
+    Field('adresse', '\\Adresse', ''),
+    # Inhaltsbezogen
+    Field('datum', '\\Datum', ''),
+    Field('betreff', '\\Betreff', ''),
+    Field('anrede', '\\Anrede', ''),
+    Field('gruss', '\\Gruss', ''),
+    Field('unterschrift', '\\Unterschrift', ''),
+
+    Field('anlagen', '\\Anlagen', ()),
+    Field('verteiler', '\\Verteiler', ''),
+
+    # eigentlicher Brieftext, begin document
+    Field('text', 'text', ()),
+    )
+
+FIELD_NAMES = tuple(field.name for field in FIELDS)
+_INDEX = {name: i for i, name in enumerate(FIELD_NAMES)}
+_DEFAULTS = tuple(field.default for field in FIELDS)
+
+
+# What is written for each field, prepared once: the line for a string value,
+# the line for a boolean switched on and off and the opening line of a list.
+# The lines of the text are written as they are.
+def _layout(field):
+    line = field.command + '{%s}'
+    if field.name == 'gruss':
+        line += '{1cm}'
+    group = None if field.name == 'text' else field.command + '{\n'
+    return line + '\n', field.command + '\n', '%' + field.command + '\n', group
+
+_LAYOUT = tuple(_layout(field) for field in FIELDS)
+
+
+class TextSource(abc.ABC):
+    """Base of values whose TeX lines are only generated while they are written.
+
+    Such a value can be used instead of a list of lines, e.g. for the text of a
+    letter (see ``letter.text``). Iterating over it yields the lines. Its
+    rendered TeX isn't kept, so a large body is only in memory while the whole
+    document is rendered to a string, not when it is written with ``write_tex``.
+    """
+
+    @abc.abstractmethod
+    def __iter__(self):
+        """Yield the TeX lines of the value."""
+
+
+def _render_field(layout, val):
+    line, on, off, group = layout
+    kind = type(val)
+    if kind is str:
+        return line % val
+    if kind is bool:
+        return on if val else off
+    if kind is list or kind is tuple or isinstance(val, TextSource):
+        if group is None:
+            return ''.join(val)
+        return group + ''.join(val) + '}\n'
+    return line % (val,)
+
+
+class LetterTemplate:
+    """Values shared by many letters, e.g. of a mail merge, rendered only once.
+
+    A letter created from the template starts with references to the values of
+    the template and their rendered TeX, so only the fields set per letter are
+    stored and rendered again. The values of a template can't be changed, lists
+    are kept as tuples.
+
+    :param letter: The :class:`Letter` with the shared values, an empty letter if not given.
+        Its attachment PDFs are shared as well.
+    :param spec: The spec the letter was made from, if any, see ``letter.spec``.
+    """
+
+    __slots__ = ('values', 'fragments', 'attachments', 'spec')
+
+    def __init__(self, letter=None, spec=None):
+        values = _DEFAULTS if letter is None else letter._values()
+        self.values = tuple(tuple(val) if type(val) is list else val for val in values)
+        self.fragments = tuple(None if isinstance(val, TextSource) else _render_field(layout, val)
+                               for layout, val in zip(_LAYOUT, self.values))
+        self.attachments = () if letter is None else letter.get_attachment_pdfs()
+        self.spec = spec
+
+    def new_letter(self):
+        return Letter(self)
+
+
+# the template of all letters not created from another one
+_EMPTY_TEMPLATE = LetterTemplate()
+
+# write_tex collects pieces up to this number of characters before writing them
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+# A function writing a string to a text file, a binary file or pipe or a socket
+def _tex_writer(target, encoding):
+    if not hasattr(target, 'write') and hasattr(target, 'sendall'):
+        return lambda text: target.sendall(text.encode(encoding))
+    if isinstance(target, io.TextIOBase):
+        return target.write
+    if isinstance(target, (io.RawIOBase, io.BufferedIOBase)) or 'b' in getattr(target, 'mode', ''):
+        if isinstance(target, io.RawIOBase):
+            def write_raw(text):
+                view = memoryview(text.encode(encoding))
+                while view:
+                    view = view[target.write(view) or 0:]
+            return write_raw
+        return lambda text: target.write(text.encode(encoding))
+    return target.write
+
 
 class Letter:
-    def __init__(self):
-        self.__tex = None
+    __slots__ = ('__tex', '__builder', '__cache', '__recorder', '__values', '__fragments', '__attachments',
+                 '__setup', '__weakref__')
 
-        self.__data = OrderedDict([
-            # allgemeine Einstellungen
-            ('lochermarke', ['\lochermarke', True]),
-            ('faltmarken', ['\\faltmarken', True]),
-            ('fenstermarken', ['\\fenstermarken', True]),
-            ('trennlinien', ['\\trennlinien', True]),
-            ('klassisch', ['\klassisch', False]),
-            ('unserzeichen', ['\\unserzeichen', False]),
-            # Korrespondenz
-            ('ihrzeichen', ['\IhrZeichen', '']),
-            ('ihrschreiben', ['\IhrSchreiben', '']),
-            ('meinzeichen', ['\MeinZeichen', '']),
-
-            # Absender-Adresse
-            ('name', ['\\Name', '']),
-            ('strasse', ['\Strasse', '']),
-            ('zusatz', ['\Zusatz', '']),
-            ('retouradresse', ['\RetourAdresse', '']),
-            ('ort', ['\Ort', '']),
-            ('land', ['\Land', '']),
-            # Kontaktinformationen
-            ('telefon', ['\Telefon', '']),
-            ('telefax', ['\Telefax', '']),
-            ('telex', ['\Telex', '']),
-            ('http', ['\HTTP', '']),
-            ('email', ['\EMail', '']),
-            # Bankverbindung
-            ('bank', ['\Bank', '']),
-            ('blz', ['\BLZ', '']),
-            ('konto', ['\Konto', '']),
-            # Anschrift
-            ('postvermerk', ['\Postvermerk', '']),
-            ('adresse', ['\Adresse', '']),
-            # Inhaltsbezogen
-            ('datum', ['\Datum', '']),
-            ('betreff', ['\Betreff', '']),
-            ('anrede', ['\Anrede', '']),
-            ('gruss', ['\Gruss', '']),
-            ('unterschrift', ['\\Unterschrift', '']),
-
-            ('anlagen', ['\Anlagen', []]),
-            ('verteiler', ['\Verteiler', '']),
-
-            # eigentlicher Brieftext, begin document
-            ('text', ['text', []]),
-            ])
+    def __init__(self, template=None):
+        template = template or _EMPTY_TEMPLATE
+        self.__tex = None
+        self.__builder = None
+        self.__cache = None
+        self.__recorder = NULL_RECORDER
+        # one value per entry of FIELDS and its rendered TeX, None if the field
+        # was set since the last rendering. Both are shared with the template
+        # until the field is set.
+        self.__values = list(template.values)
+        self.__fragments = list(template.fragments)
+        self.__attachments = template.attachments
+        # TeX between the preamble and the fields, see set_reproducible
+        self.__setup = ''
 
     # Define __enter__ and __exit__ methods to use Letter with the 'with' statement
-    # as a context manager. Use exit to only close the temporary file, no exception
+    # as a context manager. Use exit to only drop the rendered document, no exception
     # handling (if exc_stuff is not None), therefore return nothing like True
     def __enter__(self):
-        if not self.__tex:
+        if self.__tex is None:
             self._create_tex()
         return self
 
     def __exit__(self, exc_type=None, exc_value=None, traceback=None):
-        if self.__tex:
-            self.__tex.close()  # close temp file to delete it
-            self.__tex = None
+        self.__tex = None
+
+    # Raise a KeyError for unknown field names. Only fields set with this are
+    # rendered again, a list changed in place has to be set again. Setting an
+    # equal value again, e.g. from the GUI, which sets all fields each time,
+    # keeps the rendered TeX.
+    def _set_val(self, name, val):
+        index = _INDEX[name]
+        current = self.__values[index]
+        if val == current and not (val is current and type(val) is list):
+            return
+        self.__values[index] = val
+        self.__fragments[index] = None
+        self.__tex = None
 
-    def _set_val(self, name, val, idx=1):
-        self.__data[name][idx] = val
+    def _get_val(self, name):
+        return self.__values[_INDEX[name]]
 
-    def _get_val(self, name, idx=1):
-        return self.__data[name][idx]
+    def _values(self):
+        return tuple(self.__values)
 
     def set_lochermarke(self, val):
         self._set_val('lochermarke', val)
@@ -284,126 +533,214 @@ class Letter:
     def get_text(self):
         return self._get_val('text')
 
-    def _create_tex(self):
-        if self.__tex:
-            self.__tex.close()
-            self.__tex = None
+    # Use another builder than the default one of the latex package, e.g. a
+    # FormatBuilder from letter.fmt. It has to provide build_pdf(source).
+    def set_builder(self, builder):
+        self.__builder = builder
+
+    def get_builder(self):
+        return self.__builder
+
+    # Look up the PDF in a PdfCache from letter.cache before compiling it
+    def set_cache(self, cache):
+        self.__cache = cache
+
+    def get_cache(self):
+        return self.__cache
+
+    # PDF files appended to the PDF of the letter, e.g. the documents listed in
+    # anlagen. They aren't part of the TeX source, so the PdfCache keeps the
+    # letter without them and they are appended to each copy. Needs pypdf.
+    def set_attachment_pdfs(self, filenames):
+        self.__attachments = tuple(filenames)
+
+    def get_attachment_pdfs(self):
+        return self.__attachments
+
+    def _append_attachments(self, filename):
+        if self.__attachments:
+            from letter.attach import append_pdfs
+            with self.__recorder.stage('attach') as stage:
+                append_pdfs(filename, self.__attachments)
+                stage.size = os.path.getsize(filename)
+
+    # Build the same PDF bytes from the same contents, without the time of the
+    # build or random IDs, e.g. for caches and comparing the PDF files of two
+    # versions. \today is the date source_date (seconds since the epoch),
+    # SOURCE_DATE_EPOCH if not given, and the day of the build without both.
+    def set_reproducible(self, reproducible=True, source_date=None):
+        if source_date is None:
+            source_date = source_date_epoch()
+        self.__setup = reproducible_setup(source_date) if reproducible else ''
+        self.__tex = None
 
-        self.__tex = tmp_file()
+    def is_reproducible(self):
+        return bool(self.__setup)
 
-    def _update_tex(self):
-        if not self.__tex:
-            self._create_tex()
+    def _setup(self):
+        return self.__setup
+
+    # Record the time of the stages of save_tex and compile_pdf, see letter.timing
+    def set_recorder(self, recorder):
+        self.__recorder = recorder or NULL_RECORDER
+
+    def get_recorder(self):
+        return self.__recorder
 
-        # delete the content of the temporary file
-        self.__tex.seek(0)
-        self.__tex.truncate()
-
-        preamble = ['\documentclass[11pt]{g-brief}\n',
-                '\\usepackage[utf8]{inputenc}\n',
-                '\\usepackage[ngerman]{babel}\n',
-                '\\usepackage{enumerate}\n',
-                '\\usepackage{gensymb}\n',
-                '\\usepackage{eurosym}\n\n']
-
-        self.__tex.writelines(l.encode('utf-8') for l in preamble)
-        #for line in preamble:
-        #    self.tex.write(line.encode('utf-8'))
-
-        for values in self.__data.values():
-            if type(values[1]) is list:
-                if 'text' in values[0]:
-                    self.__tex.writelines(line.encode('utf-8') for line in values[1])
-                else:
-                    line = '%s{\n' % values[0]
-                    self.__tex.write(line.encode('utf-8'))
-                    self.__tex.writelines(line.encode('utf-8') for line in values[1])
-                    self.__tex.write('}\n'.encode('utf-8'))
+    def _builder_settings(self):
+        builder = self.__builder
+        if builder is None:
+            return 'latex.build_pdf'
+        settings = sorted((k, v) for k, v in vars(builder).items() if k != 'cache_dir')
+        return '%s.%s%r' % (type(builder).__module__, type(builder).__name__, settings)
+
+    def _create_tex(self):
+        self.__tex = ''
+
+    # The rendered TeX of each field, in the order of FIELDS. The TeX of a
+    # TextSource is rendered each time instead of being kept.
+    def _fragments(self):
+        cached = self.__fragments
+        fragments = list(cached)
+        if None in fragments:
+            for index, fragment in enumerate(fragments):
+                if fragment is None:
+                    val = self.__values[index]
+                    fragments[index] = _render_field(_LAYOUT[index], val)
+                    if not isinstance(val, TextSource):
+                        cached[index] = fragments[index]
+        return fragments
+
+    # Only the fields set since the last call are rendered again and nothing at
+    # all if the document is still the same
+    def _update_tex(self):
+        if self.__tex:
+            return
+        tex = list(PREAMBLE)
+        tex.append(self.__setup)
+        tex.extend(self._fragments())
+        tex.append('\endinput')
+
+        self.__tex = ''.join(tex)
+
+    # The pieces of the TeX document in the order they are written, without
+    # putting them together: the lines of a body set since the last rendering
+    # are yielded one by one
+    def iter_tex(self):
+        yield from PREAMBLE
+        if self.__setup:
+            yield self.__setup
+        for layout, val, fragment in zip(_LAYOUT, self.__values, self.__fragments):
+            if fragment is not None:
+                yield fragment
+            elif type(val) is list or type(val) is tuple or isinstance(val, TextSource):
+                group = layout[3]
+                if group is not None:
+                    yield group
+                yield from val
+                if group is not None:
+                    yield '}\n'
             else:
-                line = ''
-                if type(values[1]) is bool:
-                    if values[1]:
-                        line = values[0]
-                    else:
-                        line = '%' + values[0]
-                else:
-                    line = '%s{%s}' % tuple(values)
-                    if '\Gruss' in values[0]:
-                        line += '{1cm}'
-                line += '\n'
-                self.__tex.write(line.encode('utf-8'))
-        self.__tex.write('\endinput'.encode('utf-8'))
+                yield _render_field(layout, val)
+        yield '\endinput'
+
+    def write_tex(self, target, encoding='utf-8'):
+        """Write the TeX document to a file, a pipe or a socket.
+
+        The document is written piece by piece while it is generated, so the
+        memory needed doesn't depend on the size of the body.
+
+        :param target: A text or binary file object, e.g. the stdin of a TeX
+            process, or a socket.
+        :param encoding: The encoding used for binary targets and sockets.
+        """
+        write = _tex_writer(target, encoding)
+        buffered = []
+        size = 0
+        for piece in self.iter_tex():
+            buffered.append(piece)
+            size += len(piece)
+            if size >= WRITE_BUFFER_SIZE:
+                write(''.join(buffered))
+                buffered = []
+                size = 0
+        if buffered:
+            write(''.join(buffered))
 
     def _make_tex(self):
-        if not self.__tex:
+        self._update_tex()
+
+    # Render the whole document to a string, which is shared by save_tex and
+    # create_pdf, so every letter is only rendered once per call. Like the TeX
+    # of a TextSource itself, a document with such a body isn't kept.
+    def render_tex(self):
+        self._make_tex()
+        tex = self.__tex
+        if any(isinstance(val, TextSource) for val in self.__values):
             self._create_tex()
-        else:
-            self._update_tex()
+        return tex
 
     def save_tex(self, filename=''):
-        self._make_tex()
         if not filename:
             filename = 'letter.tex'
 
-        self.__tex.seek(0)
-        lines = self.__tex.readlines()
-        # check if the path exists, if not create the base directory
-        basedir = os.path.dirname(filename)
-        if basedir and not os.path.exists(basedir):
-            os.makedirs(basedir)
-        with open(filename, 'w') as f:
-            f.writelines(line.decode('utf-8') for line in lines)
-
-    def create_pdf(self, filename=''):
-        self._make_tex()
+        # the document is written while it is generated, see write_tex
+        with self.__recorder.stage('save') as stage:
+            # check if the path exists, if not create the base directory
+            basedir = os.path.dirname(filename)
+            if basedir and not os.path.exists(basedir):
+                os.makedirs(basedir)
+            with open(filename, 'w', encoding='utf-8') as f:
+                self.write_tex(f)
+            stage.size = os.path.getsize(filename)
+
+    # Build the PDF and raise a LatexBuildError if the compilation fails, e.g. to
+    # use the letter in a batch run where one broken letter shouldn't exit
+    def compile_pdf(self, filename=''):
+        recorder = self.__recorder
+        with recorder.stage('render') as stage:
+            source = self.render_tex()
+            stage.size = len(source)
         if not filename:
             filename = 'letter.pdf'
 
-        self.__tex.seek(0)
+        if self.__cache is not None:
+            with recorder.stage('cache'):
+                key = self.__cache.key(source, self._builder_settings())
+                hit = self.__cache.get(key, filename)
+            if hit:
+                self._append_attachments(filename)
+                return filename
+
+        with recorder.stage('compile') as stage:
+            stage.size = len(source)
+            if self.__builder is None:
+                pdf = _latex().build_pdf(source)
+            else:
+                pdf = self.__builder.build_pdf(source)
+
+        with recorder.stage('save') as stage:
+            if self.__cache is not None:
+                self.__cache.put(key, pdf, filename)
+            else:
+                # replaced instead of written into, it may be linked to an entry of a PdfCache
+                with replacing(filename) as tmp:
+                    pdf.save_to(tmp)
+            stage.size = os.path.getsize(filename)
+        self._append_attachments(filename)
+        return filename
+
+    def create_pdf(self, filename=''):
         try:
-            pdf = build_pdf(self.__tex.read().decode('utf-8'))
-            pdf.save_to(filename)
-        except LatexBuildError as e:
+            self.compile_pdf(filename)
+        except build_errors() as e:
             for error in e.get_errors():
                 print(u'Error in {0[filename]}, line {0[line]}: {0[error]}'.format(error))
                 # also print one line of context
                 print(u'    {}'.format(error['context'][1]))
                 print()
-            self.__tex.close()
+            self.__tex = None
             sys.exit("Building PDF failed!")
 
     def replace_symbols_latex(self, text):
-        replace = {
-                '%': '\%',
-                '$': '\$',
-                '{': '\{',
-                '}': '\}',
-                '_': '\_',
-                '&': '\&',
-                '#': '\#',
-                '§': '\S ',
-                '€': '\euro ',
-                '~': '\\textasciitilde ',
-                '^': '\\textasciicircum ',
-                '|': '\\textbar ',
-                '°': '\degree ',
-                '<': '\\textless ',
-                '>': '\\textgreater ',
-                '£': '\pounds ',
-                '™': '\\texttrademark ',
-                '©': '\copyright ',
-                '®': '\\textregistered ',
-                '†': '\dag ',
-                '‡': '\ddag ',
-                '¶': '\P ',
-                '¿': '\\textquestiondown ',
-                '¡': '\\textexclamdown '
-                }
-
-        # first replace all backslashes that this won't mess up already replaced symbols
-        text = text.replace('\\', '\\textbackslash ')
-        # and now replace symbols which will mess up the latex compilation
-        for i, j in replace.items():
-            text = text.replace(i, j)
-        return text
-
+        return escape_latex(text)
@@ -145,11 +145,13 @@ class Ui_MainWindow(object):
         self.date_label = QtWidgets.QLabel(self.verticalLayoutWidget_5)
         self.date_label.setObjectName("date_label")
         self.calendar_layout.addWidget(self.date_label)
-        self.calendarWidget = QtWidgets.QCalendarWidget(self.verticalLayoutWidget_5)
-        self.calendarWidget.setMinimumDate(QtCore.QDate(2015, 8, 20))
-        self.calendarWidget.setGridVisible(False)
-        self.calendarWidget.setObjectName("calendarWidget")
-        self.calendar_layout.addWidget(self.calendarWidget)
+        self.date_edit = QtWidgets.QDateEdit(self.verticalLayoutWidget_5)
+        self.date_edit.setMinimumDate(QtCore.QDate(2015, 8, 20))
+        self.date_edit.setCalendarPopup(True)
+        self.date_edit.setObjectName("date_edit")
+        self.calendar_layout.addWidget(self.date_edit)
+        spacerItem1 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
+        self.calendar_layout.addItem(spacerItem1)
         self.verticalLayoutWidget_6 = QtWidgets.QWidget(self.centralwidget)
         self.verticalLayoutWidget_6.setGeometry(QtCore.QRect(20, 640, 271, 181))
         self.verticalLayoutWidget_6.setObjectName("verticalLayoutWidget_6")
@@ -183,8 +185,8 @@ class Ui_MainWindow(object):
         self.salutation_line = QtWidgets.QLineEdit(self.verticalLayoutWidget_7)
         self.salutation_line.setObjectName("salutation_line")
         self.salutation_layout.addWidget(self.salutation_line)
-        spacerItem1 = QtWidgets.QSpacerItem(78, 28, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
-        self.salutation_layout.addItem(spacerItem1)
+        spacerItem2 = QtWidgets.QSpacerItem(78, 28, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.salutation_layout.addItem(spacerItem2)
         self.letter_content_layout.addLayout(self.salutation_layout)
         self.verticalLayout = QtWidgets.QVBoxLayout()
         self.verticalLayout.setObjectName("verticalLayout")
@@ -202,8 +204,8 @@ class Ui_MainWindow(object):
         self.greeting_line = QtWidgets.QLineEdit(self.verticalLayoutWidget_7)
         self.greeting_line.setObjectName("greeting_line")
         self.greeting_layout.addWidget(self.greeting_line)
-        spacerItem2 = QtWidgets.QSpacerItem(78, 28, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
-        self.greeting_layout.addItem(spacerItem2)
+        spacerItem3 = QtWidgets.QSpacerItem(78, 28, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.greeting_layout.addItem(spacerItem3)
         self.verticalLayout.addLayout(self.greeting_layout)
         self.letter_content_layout.addLayout(self.verticalLayout)
         MainWindow.setCentralWidget(self.centralwidget)
@@ -256,7 +258,7 @@ class Ui_MainWindow(object):
         self.country_label.setBuddy(self.country_line)
         self.phone_label.setBuddy(self.phone_line)
         self.email_label.setBuddy(self.email_line)
-        self.date_label.setBuddy(self.calendarWidget)
+        self.date_label.setBuddy(self.date_edit)
         self.attachment_label.setBuddy(self.attachment_text)
         self.subject_label.setBuddy(self.subject_line)
         self.salutation_label.setBuddy(self.salutation_line)
@@ -288,8 +290,8 @@ class Ui_MainWindow(object):
         MainWindow.setTabOrder(self.subject_line, self.salutation_line)
         MainWindow.setTabOrder(self.salutation_line, self.content_text)
         MainWindow.setTabOrder(self.content_text, self.greeting_line)
-        MainWindow.setTabOrder(self.greeting_line, self.calendarWidget)
-        MainWindow.setTabOrder(self.calendarWidget, self.attachment_text)
+        MainWindow.setTabOrder(self.greeting_line, self.date_edit)
+        MainWindow.setTabOrder(self.date_edit, self.attachment_text)
         MainWindow.setTabOrder(self.attachment_text, self.place_date_radio)
         MainWindow.setTabOrder(self.place_date_radio, self.only_date_radio)
         MainWindow.setTabOrder(self.only_date_radio, self.attachment_dot_radio)
@@ -325,6 +327,7 @@ class Ui_MainWindow(object):
         self.phone_label.setText(_translate("MainWindow", "Telefon"))
         self.email_label.setText(_translate("MainWindow", "E-Mail"))
         self.date_label.setText(_translate("MainWindow", "Datum"))
+        self.date_edit.setDisplayFormat(_translate("MainWindow", "dd.MM.yyyy"))
         self.attachment_label.setText(_translate("MainWindow", "Anhang"))
         self.subject_label.setText(_translate("MainWindow", "Betreff"))
         self.salutation_label.setText(_translate("MainWindow", "Anrede"))
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+# The manifest of a batch records which letters are built, so a batch which
+# was interrupted, e.g. by a crashing TeX or a reboot, continues where it
+# stopped instead of starting over (see letter.batch --manifest).
+#
+# It is a journal of JSON lines next to the letters, one line per letter
+# which was built:
+#
+#   {"key":"mueller.pdf","input":"3f2a...","size":23817,"sha256":"9c1e..."}
+#
+# key is the name of the PDF file relative to the output directory, input a
+# hash of everything the letter is built from (see input_digest), including
+# the options of the batch which change the PDF file, and size and sha256
+# those of the PDF file written. A letter is skipped when it is run again if
+# its entry has the same input hash and the PDF file still has the recorded
+# size and hash; all others are built again.
+#
+# Each line is appended with a single write and synced to the disk, so after a
+# crash the journal ends at most with one torn line, which is ignored. When
+# the manifest is opened, the journal is compacted to the last entry of each
+# letter: written to a temporary file, which replaces the journal.
+#
+# In memory, a letter only takes the size of its PDF file and a short hash of
+# the rest of its entry, about a third of the entry itself, which is enough
+# to tell whether it is done.
+
+import hashlib, json, os
+
+from letter.files import replacing
+
+from letter.letter import PREAMBLE, source_date_epoch
+from letter.spec import ATTACHMENT_PDFS, TEXT_FILE, attachment_pdfs
+
+
+# The files a spec or draft refers to, which are read while the letter is built
+def _input_files(spec):
+    files = []
+    fields = spec.get('fields', {}) if isinstance(spec.get('fields'), dict) else spec
+    text = fields.get('text')
+    if isinstance(text, dict) and 'file' in text:
+        files.append(text['file'])
+    if spec.get(TEXT_FILE):
+        files.append(spec[TEXT_FILE])
+    if spec.get(ATTACHMENT_PDFS):
+        files.extend(attachment_pdfs(spec[ATTACHMENT_PDFS]))
+    return files
+
+
+def _update(h, spec):
+    h.update(json.dumps(spec, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
+    h.update(b'\0')
+    for filename in _input_files(spec or {}):
+        try:
+            st = os.stat(filename)
+            h.update(('%s %d %d\0' % (filename, st.st_size, st.st_mtime_ns)).encode('utf-8'))
+        except OSError:
+            h.update(('%s missing\0' % filename).encode('utf-8'))
+
+
+def template_digest(template, options=None):
+    """The hash of the template of a batch, to be passed to input_digest.
+
+    The template is hashed once per batch, together with the preamble, so
+    the letters are built again when the package changes. Of the options of
+    the batch (see letter.batch.iter_batch), the ones which change the PDF
+    files are hashed as well: the builder and reproducible builds with the
+    date of SOURCE_DATE_EPOCH.
+    """
+    options = options or {}
+    settings = {'format': bool(options.get('format')),
+                'combined': (options.get('chunk') or 1) > 1,
+                'reproducible': bool(options.get('reproducible'))}
+    if settings['reproducible']:
+        settings['source_date'] = source_date_epoch()
+    h = hashlib.sha256(''.join(PREAMBLE).encode('utf-8'))
+    h.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    _update(h, template)
+    return h
+
+
+# The hash of the inputs of one letter: the template, the spec of the
+# recipient and the sizes and modification times of the files they refer to
+def input_digest(template_hash, spec):
+    h = template_hash.copy()
+    _update(h, spec)
+    return h.hexdigest()
+
+
+def file_digest(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# What is kept of an entry in memory: the size of the PDF file, which is
+# checked before the file is hashed, and a hash of the input and file hashes
+def _packed(entry):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(('%s\0%s' % (entry['input'], entry['sha256'])).encode('utf-8'))
+    return entry['size'].to_bytes(8, 'little') + h.digest()
+
+
+class Manifest:
+    """Journal of the letters of a batch which are built.
+
+    :param filename: The JSON lines file of the journal, it is created if it
+                     doesn't exist.
+    :param sync: Sync each entry to the disk, so it survives a reboot.
+    """
+
+    def __init__(self, filename, sync=True):
+        self.filename = filename
+        self.sync = sync
+        self.__entries = {entry['key']: packed for entry, packed in self.__read()}
+        self.__compact()
+        self.__fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    # Yields the entries of the journal with what is kept of them
+    def __read(self):
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        packed = _packed(entry)
+                        if not isinstance(entry['key'], str):
+                            continue
+                    except (ValueError, KeyError, TypeError, AttributeError, OverflowError):
+                        continue  # a line torn by a crash
+                    yield entry, packed
+        except FileNotFoundError:
+            pass
+
+    # Replace the journal with the last entry of each letter, which are read
+    # from the journal again
+    def __compact(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        written = set()
+        with replacing(self.filename) as tmp:
+            with open(tmp, 'wb') as f:
+                for entry, packed in self.__read():
+                    key = entry['key']
+                    if key not in written and self.__entries[key] == packed:
+                        f.write(self.__line(entry))
+                        written.add(key)
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def __line(entry):
+        return (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def done(self, key, digest, filename):
+        """Whether the letter key was built from the inputs with the hash
+        digest and filename is still the PDF file written then."""
+        packed = self.__entries.get(key)
+        if packed is None:
+            return False
+        try:
+            size = os.path.getsize(filename)
+            if size.to_bytes(8, 'little') != packed[:8]:
+                return False
+            return _packed({'input': digest, 'size': size, 'sha256': file_digest(filename)}) == packed
+        except OSError:
+            return False
+
+    def record(self, key, digest, filename):
+        """Record that the letter key was built from the inputs with the hash
+        digest into the PDF file filename."""
+        entry = {'key': key, 'input': digest, 'size': os.path.getsize(filename), 'sha256': file_digest(filename)}
+        os.write(self.__fd, self.__line(entry))
+        if self.sync:
+            os.fsync(self.__fd)
+        self.__entries[key] = _packed(entry)
+
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
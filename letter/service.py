@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+# A small HTTP service to create letters from other tools, on top of the same
+# render function as the batch mode:
+#
+#   python -m letter.service --port 8080 -j 2 --queue 8
+#
+#   POST /letters           JSON spec of a letter, answers 202 with the job id
+#   POST /letters?wait=1    the same, but waits and answers with the PDF, or
+#                           202 if it isn't done within the timeout
+#   GET  /letters/<id>      state of the job: queued, running, done or failed
+#   GET  /letters/<id>/pdf  the PDF of a finished job
+#   GET  /health            whether the service is up
+#   GET  /queue             number of queued and running jobs and the limit
+#
+# At most workers letters are compiled at the same time and queue more wait for
+# a worker. Further letters are rejected with 429 until jobs have finished, so
+# a client retries later instead of piling up work the service can't do.
+#
+# The spec of a client may only have plain values, which are escaped: no file
+# names of the server (text_file, anlagen_pdf), no drafts and no TeX lines,
+# which could read any file of the server. PDF attachments are uploaded base64
+# encoded as a list in anlagen_pdf_data.
+
+import base64, json, os, shutil, sys, tempfile, threading, uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from letter.draft import is_draft
+from letter.spec import ATTACHMENT_PDFS, TEXT_FILE, load_spec, merge_specs
+
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+# the PDF attachments uploaded with a letter, base64 encoded
+ATTACHMENT_DATA = 'anlagen_pdf_data'
+
+# the seconds a client waits for its letter with ?wait=1
+DEFAULT_TIMEOUT = 300
+
+
+class Overloaded(RuntimeError):
+    pass
+
+
+# Raise a ValueError if the spec of a client refers to files of the server or
+# has values which aren't escaped
+def check_spec(spec):
+    if not isinstance(spec, dict):
+        raise ValueError('the letter has to be a JSON object')
+    if is_draft(spec):
+        raise ValueError('drafts are not accepted')
+    for name, val in spec.items():
+        if name in (TEXT_FILE, ATTACHMENT_PDFS):
+            raise ValueError("'%s' is not accepted, upload the attachments as %s" % (name, ATTACHMENT_DATA))
+        if name == ATTACHMENT_DATA:
+            if not isinstance(val, list) or not all(isinstance(data, str) for data in val):
+                raise ValueError("'%s' has to be a list of base64 encoded PDF files" % name)
+        elif val is not None and not isinstance(val, (str, bool, int, float)):
+            raise ValueError("'%s' has to be a string" % name)
+
+
+class Job:
+    __slots__ = ('id', 'filename', 'attachments', 'future', 'error', 'finished')
+
+    def __init__(self, id, filename):
+        self.id = id
+        self.filename = filename
+        # the uploaded attachments, removed when the letter is built
+        self.attachments = []
+        self.future = None
+        self.error = None
+        # set once the error is known
+        self.finished = threading.Event()
+
+    @property
+    def state(self):
+        if self.finished.is_set():
+            return 'failed' if self.error else 'done'
+        return 'running' if self.future is not None and self.future.running() else 'queued'
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def describe(self):
+        return {'id': self.id, 'state': self.state, 'error': self.error}
+
+
+class LetterService:
+    """Compiles letters on a bounded pool of workers.
+
+    :param workers: The number of letters compiled at the same time.
+    :param queue_size: The number of letters waiting for a worker, further ones are rejected.
+    :param template: A spec with the fields shared by all letters, see ``letter.spec``.
+    :param options: The options of ``letter.batch.render_letter``, e.g. 'format' or 'cache'.
+    :param render: The function called in the workers with the spec, the name of the PDF
+        file and the options, returning the error message (None on success) first.
+        ``letter.batch.render_letter`` if not given.
+    :param executor: The pool running render, a process pool with workers processes if not given,
+        which is replaced if a worker process dies.
+    :param keep: The number of finished jobs kept, the oldest ones are removed with their PDF.
+    :param timeout: The seconds a client waits for its letter with ``?wait=1``.
+    """
+
+    def __init__(self, workers=2, queue_size=8, template=None, options=None, render=None,
+                 executor=None, keep=1000, timeout=DEFAULT_TIMEOUT):
+        if render is None:
+            from letter.batch import render_letter as render
+        self.__new_executor = None
+        if executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.__new_executor = lambda: ProcessPoolExecutor(max_workers=workers)
+            executor = self.__new_executor()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.template = template or {}
+        self.options = options or {}
+        self.keep = keep
+        self.timeout = timeout
+        self.__render = render
+        self.__executor = executor
+        self.__lock = threading.Lock()
+        self.__jobs = OrderedDict()
+        self.__pending = 0
+        self.__dir = tempfile.mkdtemp(prefix='letter-service-')
+
+    @property
+    def limit(self):
+        return self.workers + self.queue_size
+
+    def submit(self, spec):
+        """Queue a letter and return its :class:`Job`.
+
+        :raises ValueError: If the spec isn't accepted, see check_spec.
+        :raises Overloaded: If the queue is full.
+        """
+        check_spec(spec)
+        attachments = [base64.b64decode(data, validate=True) for data in spec.get(ATTACHMENT_DATA) or ()]
+        with self.__lock:
+            if self.__pending >= self.limit:
+                raise Overloaded('%d letters are already waiting' % self.__pending)
+            self.__pending += 1
+            id = uuid.uuid4().hex
+            job = Job(id, os.path.join(self.__dir, '%s.pdf' % id))
+            self.__jobs[id] = job
+            self.__drop_old()
+        try:
+            spec = merge_specs(self.template, spec)
+            spec.pop(ATTACHMENT_DATA, None)
+            for index, data in enumerate(attachments):
+                job.attachments.append(os.path.join(self.__dir, '%s-%d.pdf' % (id, index)))
+                with open(job.attachments[-1], 'wb') as f:
+                    f.write(data)
+            if job.attachments:
+                spec[ATTACHMENT_PDFS] = job.attachments
+            job.future = self.__submit(spec, job.filename)
+        except Exception:
+            with self.__lock:
+                self.__pending -= 1
+                del self.__jobs[job.id]
+            self.__remove_attachments(job)
+            raise
+        job.future.add_done_callback(lambda future: self.__finished(job))
+        return job
+
+    # A process pool whose worker died is broken, it is replaced by a new one
+    def __submit(self, spec, filename):
+        from concurrent.futures.process import BrokenProcessPool
+        executor = self.__executor
+        try:
+            return executor.submit(self.__render, spec, filename, self.options)
+        except BrokenProcessPool:
+            if self.__new_executor is None:
+                raise
+        with self.__lock:
+            if self.__executor is executor:
+                self.__executor = self.__new_executor()
+                executor.shutdown(wait=False)
+            executor = self.__executor
+        return executor.submit(self.__render, spec, filename, self.options)
+
+    def __finished(self, job):
+        try:
+            job.error = job.future.result()[0]
+        except Exception as e:  # e.g. a worker process died
+            job.error = '%s: %s' % (type(e).__name__, e)
+        self.__remove_attachments(job)
+        with self.__lock:
+            self.__pending -= 1
+        job.finished.set()
+
+    @staticmethod
+    def __remove_attachments(job):
+        for filename in job.attachments:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def __drop_old(self):
+        # called with the lock held
+        finished = [job for job in self.__jobs.values() if job.finished.is_set()]
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self.__jobs[job.id]
+            if os.path.exists(job.filename):
+                os.remove(job.filename)
+
+    def job(self, id):
+        with self.__lock:
+            return self.__jobs.get(id)
+
+    def queue(self):
+        with self.__lock:
+            running = sum(1 for job in self.__jobs.values() if job.state == 'running')
+            return {'queued': self.__pending - running, 'running': running,
+                    'workers': self.workers, 'limit': self.limit}
+
+    def close(self):
+        self.__executor.shutdown(wait=True)
+        shutil.rmtree(self.__dir, ignore_errors=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'LetterService/1.0'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(RequestHandler, self).log_message(format, *args)
+
+    def send_json(self, status, data, headers=()):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_pdf(self, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path.rstrip('/').split('/')[1:]
+        if path == ['health']:
+            return self.send_json(200, {'status': 'ok'})
+        if path == ['queue']:
+            return self.send_json(200, self.service.queue())
+        if len(path) in (2, 3) and path[0] == 'letters':
+            job = self.service.job(path[1])
+            if job is None:
+                return self.send_json(404, {'error': 'unknown job'})
+            if len(path) == 2:
+                return self.send_json(200, job.describe())
+            if path[2] == 'pdf':
+                if job.state == 'done':
+                    return self.send_pdf(job.filename)
+                return self.send_json(409 if job.state == 'failed' else 202, job.describe())
+        self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') != '/letters':
+            return self.send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self.send_json(400, {'error': 'invalid Content-Length'})
+        if length > MAX_REQUEST_SIZE:
+            return self.send_json(413, {'error': 'request too large'})
+        try:
+            spec = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as e:
+            return self.send_json(400, {'error': 'invalid JSON: %s' % e})
+
+        try:
+            job = self.service.submit(spec)
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+        except Overloaded as e:
+            return self.send_json(429, {'error': str(e)}, [('Retry-After', '1')])
+
+        location = [('Location', '/letters/%s' % job.id)]
+        if parse_qs(url.query).get('wait', ['0'])[0] not in ('', '0', 'false'):
+            if not job.wait(self.service.timeout):
+                return self.send_json(202, job.describe(), location)
+            if job.error:
+                return self.send_json(422, job.describe())
+            return self.send_pdf(job.filename)
+        self.send_json(202, job.describe(), location)
+
+
+class LetterServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        super(LetterServer, self).__init__(address, RequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve letters over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on (default: 8080)')
+    parser.add_argument('-j', '--jobs', type=int, default=2, help='number of letters compiled at the same time')
+    parser.add_argument('--queue', type=int, default=8, help='number of letters waiting before new ones are rejected')
+    parser.add_argument('--template', help='JSON file with the fields shared by all letters')
+    parser.add_argument('--format', action='store_true',
+                        help='load the preamble from a precompiled format (see letter.fmt)')
+    parser.add_argument('--reproducible', action='store_true',
+                        help='build identical PDF files from identical letters (see Letter.set_reproducible)')
+    parser.add_argument('--cache', metavar='DIR', help='reuse PDF files of identical letters from this directory')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='seconds a client waits for its letter with ?wait=1 (default: %d)' % DEFAULT_TIMEOUT)
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+
+    template = load_spec(args.template) if args.template else None
+    options = {'format': args.format, 'reproducible': args.reproducible, 'cache': args.cache}
+    service = LetterService(args.jobs, args.queue, template, options, timeout=args.timeout)
+    server = LetterServer((args.host, args.port), service, args.verbose)
+    print('Serving letters on http://%s:%d' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# A letter spec is a plain dict mapping the field names of the Letter class to
+# values, e.g. read from a JSON template or one row of a CSV file. Plain text
+# is prepared the same way the GUI does it; lists are taken as finished TeX
+# lines and passed on unchanged. A draft (see letter.draft) can be used
+# wherever a spec is expected, its fields are set as they are.
+
+import json, re
+
+from letter.draft import is_draft, letter_from_draft
+from letter.letter import Letter, LetterTemplate
+from letter.text import Content, prepare_line, prepare_text, prepare_content, prepare_attachment
+
+BOOL_FIELDS = ('lochermarke', 'faltmarken', 'fenstermarken', 'trennlinien', 'klassisch', 'unserzeichen')
+
+# the name of a text file with the body, which is read while the letter is written
+TEXT_FILE = 'text_file'
+
+# PDF files appended to the PDF of the letter, a list or a string with the
+# names separated by ; or new lines
+ATTACHMENT_PDFS = 'anlagen_pdf'
+
+# fields which are escaped like the single line inputs of the GUI
+LINE_FIELDS = ('betreff', 'anrede', 'gruss')
+
+# keys which configure how a spec is applied but are no letter fields
+OPTION_KEYS = ('key', 'anlagen_label')
+
+
+def _to_bool(val):
+    if isinstance(val, str):
+        return val.strip().lower() in ('1', 'true', 'yes', 'ja', 'x')
+    return bool(val)
+
+
+def merge_specs(*specs):
+    merged = {}
+    for spec in specs:
+        merged.update((k, v) for k, v in spec.items() if v is not None)
+    return merged
+
+
+def attachment_pdfs(val):
+    if isinstance(val, str):
+        return [f.strip() for f in re.split('[;\n]', val) if f.strip()]
+    return list(val)
+
+
+def load_spec(filename):
+    with open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Only the fields in names are applied if given, the others are taken as already set
+def apply_spec(letter, spec, names=None):
+    items = spec.items() if names is None else ((name, spec[name]) for name in names)
+    for name, val in items:
+        if name in OPTION_KEYS:
+            continue
+        if name == TEXT_FILE:
+            letter.set_text(Content.from_file(val))
+            continue
+        if name == ATTACHMENT_PDFS:
+            letter.set_attachment_pdfs(attachment_pdfs(val))
+            continue
+        if name in BOOL_FIELDS:
+            val = _to_bool(val)
+        elif isinstance(val, str):
+            if name == 'adresse':
+                val = prepare_text(val)
+            elif name == 'text':
+                val = prepare_content(val)
+            elif name == 'anlagen':
+                val = prepare_attachment(val, spec.get('anlagen_label', '--')) if val.strip() else []
+            elif name in LINE_FIELDS:
+                val = prepare_line(val)
+        try:
+            letter._set_val(name, val)
+        except KeyError:
+            raise ValueError("Unknown letter field '%s'" % name)
+
+    # the GUI signs with the name of the sender, do the same if nothing is given
+    applied = names is None or 'name' in names or 'unterschrift' in names
+    if applied and not spec.get('unterschrift') and spec.get('name'):
+        letter.set_unterschrift(spec['name'])
+    return letter
+
+
+def letter_from_spec(spec):
+    if is_draft(spec):
+        return letter_from_draft(spec)
+    return apply_spec(Letter(), spec)
+
+
+# Prepare the fields shared by many letters once, see LetterTemplate
+def template_from_spec(spec):
+    if is_draft(spec):
+        # the fields of each letter are applied on top of the whole draft
+        return LetterTemplate(letter_from_draft(spec), {})
+    return LetterTemplate(letter_from_spec(spec), spec)
+
+
+# The letter of the merged template and spec, where only the fields which differ
+# from the template spec are prepared and rendered again
+def letter_from_template(template, spec):
+    if is_draft(spec):
+        return letter_from_draft(spec, template.new_letter())
+    merged = merge_specs(template.spec, spec)
+    names = [name for name, val in merged.items() if template.spec.get(name) != val]
+    if 'anlagen_label' in names and 'anlagen' in merged and 'anlagen' not in names:
+        names.append('anlagen')
+    return apply_spec(template.new_letter(), merged, names)
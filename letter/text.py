@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Helpers to turn plain text into the TeX lines the Letter class expects.
+# They are used by the GUI as well as by the headless batch mode, hence they
+# don't depend on Qt.
+
+import mmap, os
+
+from letter.letter import TextSource, escape_latex
+
+# bodies larger than this are escaped while the letter is written, see content_source
+LAZY_CONTENT_SIZE = 1024 * 1024
+
+CONTENT_BEGIN = ['\\begin{document}\n', '\\begin{g-brief}\n']
+CONTENT_END = ['\end{g-brief}\n', '\end{document}\n']
+
+
+def prepare_line(line):
+    return escape_latex(line)
+
+
+# The whole text is escaped at once, which is faster than line by line
+def prepare_text(raw):
+    raw = escape_latex(raw).split('\n')
+    text = []
+    for line in raw:
+        line += '\\\\\n'
+        text.append(line)
+    return text
+
+
+def prepare_content(content):
+    content = prepare_text(content)
+    text = list(CONTENT_BEGIN)
+    text += content
+    text += CONTENT_END
+    return text
+
+
+def prepare_attachment(raw, label):
+    raw = escape_latex(raw).split('\n')
+    label_cmd = '\\renewcommand{\labelitemi}{%s}\n' % label
+    text = [label_cmd, '\\vspace{1em} \\textbf{Anlagen:} \\begin{itemize}\n']
+    for line in raw:
+        if not line.strip():
+            continue
+        line = '    \item %s\n' % line
+        text.append(line)
+    text.append('\end{itemize}\n')
+    return text
+
+
+# The lines of a string like str.split('\n'), without splitting it at once
+def _string_lines(raw):
+    start = 0
+    while True:
+        end = raw.find('\n', start)
+        if end < 0:
+            yield raw[start:]
+            return
+        yield raw[start:end]
+        start = end + 1
+
+
+# The lines of a file like str.split('\n') of its content, without the \r of
+# Windows line ends. The file is mapped into memory, so only the current line
+# is read into a string.
+def _file_lines(filename, encoding):
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield ''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while True:
+                end = data.find(b'\n', start)
+                if end < 0:
+                    yield data[start:].rstrip(b'\r').decode(encoding)
+                    return
+                yield data[start:end].rstrip(b'\r').decode(encoding)
+                start = end + 1
+
+
+# The lines of text given in chunks of any size, e.g. read from a stream
+def _chunk_lines(chunks):
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        yield from lines
+    yield rest
+
+
+class _OneShot:
+    # chunks of an iterator, which can't be iterated again
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.used = False
+
+    def __iter__(self):
+        if self.used:
+            raise RuntimeError('The text of an iterator can only be written once')
+        self.used = True
+        return self.chunks
+
+
+class Content(TextSource):
+    """The body of a letter, prepared like prepare_content while it is written.
+
+    Use one of the class methods to create it. The raw text is kept as it is
+    and escaped line by line whenever the letter is rendered or written. Bodies
+    from strings and files can be pickled, e.g. for a BuildProcess.
+    """
+
+    def __init__(self, lines, *args):
+        self._lines = lines
+        self._args = args
+
+    @classmethod
+    def from_string(cls, raw):
+        return cls(_string_lines, raw)
+
+    @classmethod
+    def from_file(cls, filename, encoding='utf-8'):
+        return cls(_file_lines, filename, encoding)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """The text from an iterable of strings, which can only be written once."""
+        return cls(_chunk_lines, _OneShot(chunks))
+
+    @property
+    def file(self):
+        """The filename and encoding of a body from a file, else None."""
+        return self._args if self._lines is _file_lines else None
+
+    def __iter__(self):
+        yield from CONTENT_BEGIN
+        for line in self._lines(*self._args):
+            yield prepare_line(line) + '\\\\\n'
+        yield from CONTENT_END
+
+
+# The prepared body for Letter.set_text: a list of lines for usual bodies and a
+# Content escaped while it is written for large ones
+def content_source(content):
+    if len(content) > LAZY_CONTENT_SIZE:
+        return Content.from_string(content)
+    return prepare_content(content)
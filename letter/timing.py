@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+# Opt-in timing of the stages of building a letter.
+#
+# A Recorder is attached to a letter with Letter.set_recorder and collects how
+# long each stage took and how much data it handled:
+#
+#   collect  gathering and preparing the values (GUI or batch spec)
+#   render   generating the TeX source to compile (size: characters of TeX)
+#   cache    looking up the PDF in the cache
+#   compile  the TeX compilation (size: characters of TeX)
+#   save     generating and writing the TeX file or writing the PDF file
+#            (size: bytes of the file)
+#
+# The records of a letter are handed to a sink, which writes them as a log
+# line (LogSink), appends them to a JSON lines file (JsonSink) or sums them
+# up to report percentiles at the end of a batch (Aggregator).
+
+import math, os, random, time
+
+
+class _Stage:
+    __slots__ = ('recorder', 'name', 'size', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.size = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        self.recorder.add(self.name, time.perf_counter() - self.start, self.size)
+
+
+class _NullStage:
+    __slots__ = ('size',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        pass
+
+
+class NullRecorder:
+    """Recorder which records nothing, used if timing is off."""
+
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def add(self, name, seconds, size=None):
+        pass
+
+    def take(self):
+        return []
+
+
+class Recorder:
+    """Collects the timings of the stages of one letter."""
+
+    def __init__(self):
+        self.records = []
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, seconds, size=None):
+        self.records.append({'stage': name, 'seconds': seconds, 'size': size})
+
+    def extend(self, records):
+        self.records.extend(records)
+
+    def take(self):
+        records, self.records = self.records, []
+        return records
+
+
+NULL_RECORDER = NullRecorder()
+
+
+class LogSink:
+    """Writes one log line per letter."""
+
+    def __init__(self, logger=None):
+        if logger is None:
+            import logging
+            logger = logging.getLogger('letter.timing')
+        self.logger = logger
+
+    def emit(self, key, records):
+        stages = ', '.join('%s %.1f ms%s' % (r['stage'], r['seconds'] * 1000,
+                                             '' if r['size'] is None else ' (%d)' % r['size'])
+                           for r in records)
+        self.logger.info('%s: %s', key, stages)
+
+    def close(self):
+        pass
+
+
+class JsonSink:
+    """Appends one JSON object per letter to a file."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def emit(self, key, records):
+        import json
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'letter': key, 'time': time.time(), 'stages': records}) + '\n')
+
+    def close(self):
+        pass
+
+
+def percentile(values, p):
+    # nearest rank of the sorted values
+    if not values:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(values))))
+    return values[rank - 1]
+
+
+# The timings of one stage: count, sum, minimum and maximum of all of them
+# and a uniform sample of at most size of them for the percentiles
+# (reservoir sampling), so the memory doesn't grow with the batch.
+class _StageStats:
+    __slots__ = ('count', 'total', 'min', 'max', 'size', 'sample')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.size = None
+        self.sample = []
+
+    def add(self, seconds, size, sample_size, rng):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        if size is not None:
+            self.size = (self.size or 0) + size
+        if len(self.sample) < sample_size:
+            self.sample.append(seconds)
+        else:
+            i = rng.randrange(self.count)
+            if i < sample_size:
+                self.sample[i] = seconds
+
+
+class Aggregator:
+    """Sums up the timings per stage to report percentiles.
+
+    Count, total, minimum and maximum are exact. The percentiles are taken
+    from a random sample of sample_size timings per stage, they are exact
+    as long as a stage has no more timings.
+    """
+
+    def __init__(self, sample_size=10000):
+        self.sample_size = sample_size
+        self.stages = {}
+        self.letters = 0
+        self.__random = random.Random(0)
+
+    def emit(self, key, records):
+        self.letters += 1
+        for r in records:
+            stats = self.stages.get(r['stage'])
+            if stats is None:
+                stats = self.stages[r['stage']] = _StageStats()
+            stats.add(r['seconds'], r['size'], self.sample_size, self.__random)
+
+    def report(self):
+        report = {}
+        for stage, stats in self.stages.items():
+            sample = sorted(stats.sample)
+            report[stage] = {
+                'count': stats.count,
+                'total': stats.total,
+                'p50': percentile(sample, 50),
+                'p90': percentile(sample, 90),
+                'p99': percentile(sample, 99),
+                'min': stats.min,
+                'max': stats.max,
+                'size': stats.size,
+                }
+        return report
+
+    def format_report(self):
+        lines = ['%-8s %7s %10s %10s %10s %10s %12s' % ('stage', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'size')]
+        for stage, r in sorted(self.report().items(), key=lambda s: -s[1]['total']):
+            lines.append('%-8s %7d %10.1f %10.1f %10.1f %10.1f %12s' % (
+                stage, r['count'], r['p50'] * 1000, r['p90'] * 1000, r['p99'] * 1000, r['max'] * 1000,
+                '' if r['size'] is None else r['size']))
+        return '\n'.join(lines)
+
+    def close(self):
+        pass
+
+
+def make_sink(spec):
+    # 'log', 'summary' or the name of a JSON lines file
+    if spec == 'log':
+        return LogSink()
+    if spec == 'summary':
+        return Aggregator()
+    return JsonSink(spec)
+
+
+# The time.time() the current process was started, to measure the startup of
+# the GUI including the interpreter and the imports. None if unknown, it is
+# only available on Linux. The resolution is that of /proc/uptime, 10 ms.
+def process_start_time():
+    try:
+        with open('/proc/self/stat') as f:
+            stat = f.read()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        ticks = os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, AttributeError):
+        return None
+    # the fields after the command name, which may contain spaces, start with
+    # the third field; the start time since boot in clock ticks is the 22nd
+    started = int(stat.rpartition(')')[2].split()[19]) / ticks
+    return time.time() - (uptime - started)
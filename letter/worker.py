@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+# Spread a batch over several hosts: the letters are queued in a SQLite
+# database on a shared filesystem, workers on any host pull them from there.
+#
+#   python -m letter.worker /shared/queue.db enqueue template.json recipients.csv -o /shared/letters
+#   python -m letter.worker /shared/queue.db work -j 8        # on every host
+#   python -m letter.worker /shared/queue.db status --wait
+#
+# A worker leases the letter it builds for a while (lease) and renews the
+# leases of its letters with a heartbeat from a background thread. If a worker
+# dies, e.g. with its host, its leases run out and other workers take over
+# the letters. A letter whose workers died max_attempts times is failed, so a
+# letter which crashes every worker doesn't stop the batch.
+#
+# A worker whose lease ran out may still be building its letter while another
+# one builds it again. Each of them writes the PDF to a file of its own, which
+# only replaces the PDF of the letter while the lease is confirmed (see
+# JobStore.finish), so the PDF is never written by two workers at once.
+#
+# The leases are compared with the clocks of the hosts, which have to be in
+# sync (NTP) within a small part of the lease. The database is locked with the
+# locks of the filesystem, so the shared filesystem has to support them (e.g.
+# NFS with lockd); every access only holds the lock for a moment.
+
+import json, os, socket, sqlite3, sys, threading, time, uuid
+from collections import namedtuple
+from contextlib import contextmanager
+
+from letter.batch import iter_recipients, output_filename
+from letter.spec import load_spec
+
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    spec TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    cached INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until);
+'''
+
+STATES = ('queued', 'running', 'done', 'failed')
+
+DEFAULT_LEASE = 60
+DEFAULT_MAX_ATTEMPTS = 3
+
+# filename is relative to the output directory of the batch
+Job = namedtuple('Job', ['id', 'spec', 'filename', 'attempts'])
+
+
+def default_worker_id():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class JobStore:
+    """The queue of the letters of one batch in the SQLite database at path.
+
+    A connection may only be used by the thread which opened it, so the
+    heartbeat thread of a worker opens its own JobStore on the same path.
+
+    :param path: The database, created if missing.
+    :param lease: Seconds a letter stays with its worker without a heartbeat.
+    :param max_attempts: The number of workers which may die building a letter
+                         before it is failed.
+    """
+
+    def __init__(self, path, lease=DEFAULT_LEASE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        # the transactions are started explicitly, see __transaction
+        self.__db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        version = self.__db.execute('PRAGMA user_version').fetchone()[0]
+        if version > SCHEMA_VERSION:
+            self.__db.close()
+            raise ValueError('%s was created by a newer version (schema %d)' % (path, version))
+        if version < SCHEMA_VERSION:
+            self.__db.executescript('BEGIN IMMEDIATE;%sPRAGMA user_version = %d;COMMIT;'
+                                    % (SCHEMA, SCHEMA_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.__db.close()
+
+    # Writes take the lock of the database right at the start. A transaction
+    # which only takes it with its first write fails at once if another one
+    # is writing, instead of waiting for it.
+    @contextmanager
+    def __transaction(self):
+        self.__db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.__db.execute('ROLLBACK')
+            raise
+        self.__db.execute('COMMIT')
+
+    def set_batch(self, template, outdir, options=None):
+        """Set the template, output directory and options of render_letter of the batch.
+
+        :raises ValueError: If letters queued with other settings aren't built yet, they
+                            would be built with these instead.
+        """
+        settings = {'template': template, 'outdir': outdir, 'options': options or {}}
+        with self.__transaction():
+            current = {name: json.loads(value) for name, value in
+                       self.__db.execute('SELECT name, value FROM settings')}
+            if current and current != settings and self.__db.execute(
+                    "SELECT 1 FROM jobs WHERE state IN ('queued', 'running') LIMIT 1").fetchone():
+                raise ValueError('%s has letters of another batch which are not built yet' % self.path)
+            self.__db.executemany('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)',
+                                  [(name, json.dumps(value, ensure_ascii=False))
+                                   for name, value in settings.items()])
+
+    def batch(self):
+        """The template, output directory and options of the batch, see set_batch."""
+        settings = {name: json.loads(value) for name, value in self.__db.execute('SELECT name, value FROM settings')}
+        if 'outdir' not in settings:
+            raise ValueError('%s has no batch, see enqueue' % self.path)
+        return settings['template'], settings['outdir'], settings['options']
+
+    def add_many(self, recipients):
+        """Queue a letter for each recipient and return their number.
+
+        The PDF files are named like the ones of letter.batch, the index counts
+        on from the letters queued before.
+        """
+        with self.__transaction():
+            first = self.__db.execute('SELECT count(*) FROM jobs').fetchone()[0]
+            cursor = self.__db.executemany(
+                'INSERT INTO jobs (spec, filename) VALUES (?, ?)',
+                ((json.dumps(recipient, ensure_ascii=False), output_filename('', index, recipient))
+                 for index, recipient in enumerate(recipients, first)))
+        return cursor.rowcount
+
+    def claim(self, worker):
+        """Lease the next letter to worker and return its Job, None if there is none.
+
+        Letters whose lease ran out are taken over, or failed after max_attempts.
+        """
+        with self.__transaction():
+            now = time.time()
+            self.__db.execute("UPDATE jobs SET state = 'failed', worker = NULL, lease_until = NULL, "
+                              "error = 'The workers building the letter died ' || attempts || ' times' "
+                              "WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                              (now, self.max_attempts))
+            row = self.__db.execute("SELECT id, spec, filename, attempts FROM jobs "
+                                    "WHERE state = 'running' AND lease_until < ? LIMIT 1", (now,)).fetchone() or \
+                self.__db.execute("SELECT id, spec, filename, attempts FROM jobs "
+                                  "WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.__db.execute("UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, "
+                              "attempts = attempts + 1 WHERE id = ?", (worker, now + self.lease, row[0]))
+        return Job(row[0], json.loads(row[1]), row[2], row[3] + 1)
+
+    def heartbeat(self, worker):
+        """Renew the leases of the letters of worker and return their number."""
+        with self.__transaction():
+            cursor = self.__db.execute("UPDATE jobs SET lease_until = ? WHERE worker = ? AND state = 'running'",
+                                       (time.time() + self.lease, worker))
+        return cursor.rowcount
+
+    def finish(self, id, worker, error=None, cached=False, replace=None):
+        """Record the result of the letter id.
+
+        Returns False if worker lost the letter to another worker meanwhile,
+        whose result counts then.
+
+        :param replace: The names of the PDF file built by worker and of the
+            PDF file of the letter, which the first one replaces if the letter
+            was built and worker still has it.
+        """
+        with self.__transaction():
+            if self.__db.execute("SELECT 1 FROM jobs WHERE id = ? AND worker = ? AND state = 'running'",
+                                 (id, worker)).fetchone() is None:
+                return False
+            if replace and not error:
+                try:
+                    os.replace(*replace)
+                except OSError as e:
+                    error = 'The PDF file could not be written: %s' % e
+            self.__db.execute("UPDATE jobs SET state = ?, error = ?, cached = ?, lease_until = NULL WHERE id = ?",
+                              ('failed' if error else 'done', error, bool(cached), id))
+        return True
+
+    def counts(self):
+        """The number of letters in each state."""
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.__db.execute('SELECT state, count(*) FROM jobs GROUP BY state'))
+        return counts
+
+    def failed(self):
+        """The filenames and errors of the failed letters."""
+        return self.__db.execute("SELECT filename, error FROM jobs WHERE state = 'failed' ORDER BY id").fetchall()
+
+
+
+class Heartbeat(threading.Thread):
+    """Renews the leases of worker every interval seconds until stopped."""
+
+    def __init__(self, path, worker, lease, interval):
+        super(Heartbeat, self).__init__(name='Heartbeat', daemon=True)
+        self.path = path
+        self.worker = worker
+        self.lease = lease
+        self.interval = interval
+        self.__stopped = threading.Event()
+
+    def run(self):
+        with JobStore(self.path, self.lease) as store:
+            while not self.__stopped.wait(self.interval):
+                try:
+                    store.heartbeat(self.worker)
+                except sqlite3.Error:
+                    pass  # e.g. locked too long, the next beat tries again
+
+    def stop(self):
+        self.__stopped.set()
+        self.join()
+
+
+# Build the letters of the queue at path until none is left and return the
+# number of letters built. outdir overrides the output directory of the batch,
+# e.g. if the shared filesystem is mounted elsewhere on this host. render is
+# called like letter.batch.render_letter with the spec of the recipient, the
+# template of the batch is set up for it in this process. The worker waits for
+# the letters running elsewhere, which it takes over if their worker dies, and
+# returns once all letters are done or failed.
+def run_worker(path, outdir=None, worker=None, render=None, lease=DEFAULT_LEASE,
+               max_attempts=DEFAULT_MAX_ATTEMPTS, poll=1.0, options=None):
+    from letter.batch import _init_worker, render_letter
+
+    render = render or render_letter
+    worker = worker or default_worker_id()
+    built = 0
+    with JobStore(path, lease, max_attempts) as store:
+        template, batch_outdir, batch_options = store.batch()
+        _init_worker(template)
+        outdir = outdir or batch_outdir
+        options = dict(batch_options, **(options or {}))
+        heartbeat = Heartbeat(path, worker, lease, lease / 4.0)
+        heartbeat.start()
+        try:
+            while True:
+                job = store.claim(worker)
+                if job is None:
+                    if not store.counts()['running']:
+                        break
+                    time.sleep(poll)
+                    continue
+                filename = os.path.join(outdir, job.filename)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                # the file of this worker, see JobStore.finish
+                tmp = '%s.%s.tmp' % (filename, uuid.uuid4().hex)
+                try:
+                    error, cached = render(job.spec, tmp, options)[:2]
+                except Exception as e:
+                    error, cached = '%s: %s' % (type(e).__name__, e), False
+                try:
+                    if store.finish(job.id, worker, error, cached, (tmp, filename)) and not error:
+                        built += 1
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+        finally:
+            heartbeat.stop()
+    return built
+
+
+def _print_counts(counts):
+    print(', '.join('%d %s' % (counts[state], state) for state in STATES))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the letters of a batch with workers on several hosts.')
+    parser.add_argument('queue', help='the SQLite database of the queue, on a filesystem shared by the hosts')
+    parser.add_argument('--lease', type=float, default=DEFAULT_LEASE, metavar='SECONDS',
+                        help='time after which the letters of a worker without heartbeat are taken over '
+                             '(default: %d)' % DEFAULT_LEASE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    enqueue = commands.add_parser('enqueue', help='queue a letter for each recipient')
+    enqueue.add_argument('template', help='JSON file with the fields shared by all letters')
+    enqueue.add_argument('recipients', help='CSV, JSON or JSON lines file with one entry per letter')
+    enqueue.add_argument('-o', '--outdir', default='letters', help='directory for the PDF files, shared by the hosts')
+    enqueue.add_argument('--format', action='store_true',
+                         help='load the preamble from a precompiled format (see letter.fmt)')
+    enqueue.add_argument('--reproducible', action='store_true',
+                         help='build identical PDF files from identical letters (see Letter.set_reproducible)')
+    enqueue.add_argument('--cache', metavar='DIR', help='reuse PDF files of identical letters from this directory')
+    work = commands.add_parser('work', help='build queued letters until none is left')
+    work.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                      help='number of worker processes (default: one per core)')
+    work.add_argument('-o', '--outdir', help='directory for the PDF files, if mounted elsewhere on this host')
+    work.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                      help='fail a letter after its workers died that often (default: %d)' % DEFAULT_MAX_ATTEMPTS)
+    status = commands.add_parser('status', help='print the number of letters in each state and the failed ones')
+    status.add_argument('--wait', action='store_true', help='wait until all letters are done or failed')
+    args = parser.parse_args(argv)
+
+    if args.command == 'enqueue':
+        with JobStore(args.queue, args.lease) as store:
+            try:
+                store.set_batch(load_spec(args.template), os.path.abspath(args.outdir),
+                                {'format': args.format, 'reproducible': args.reproducible,
+                                 'cache': args.cache and os.path.abspath(args.cache)})
+            except ValueError as e:
+                parser.error(str(e))
+            print('%d letters queued' % store.add_many(iter_recipients(args.recipients)))
+        return 0
+
+    if args.command == 'work':
+        import multiprocessing
+        processes = [multiprocessing.Process(target=run_worker, args=(args.queue, args.outdir),
+                                             kwargs={'lease': args.lease, 'max_attempts': args.max_attempts})
+                     for _ in range(max(1, args.jobs))]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    with JobStore(args.queue, args.lease) as store:
+        counts = store.counts()
+        while args.command == 'status' and args.wait and (counts['queued'] or counts['running']):
+            time.sleep(1)
+            counts = store.counts()
+        _print_counts(counts)
+        for filename, error in store.failed():
+            print('FAILED  %s: %s' % (filename, error))
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+# Stand-ins shared by the tests, which don't run TeX.
+
+
+class Pdf:
+    # stands in for the data returned by the builders, only save_to is used
+    def __init__(self, content):
+        self.content = content
+
+    def save_to(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.content)
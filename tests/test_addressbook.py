@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_addressbook
+----------------------------------
+
+Tests for `letter.addressbook` module.
+"""
+
+import unittest
+import os, shutil, tempfile
+from os.path import join as pjoin
+
+KLAUS = {'name': 'Klaus Störtebeker', 'strasse': 'Hafenstraße 1', 'ort': '20359 Hamburg', 'anrede': 'Moin,'}
+
+
+class TestAddressBook(unittest.TestCase):
+
+    def setUp(self):
+        from letter.addressbook import AddressBook
+        self.test_dir = tempfile.mkdtemp()
+        self.path = pjoin(self.test_dir, 'adressen', 'addresses.db')
+        self.book = AddressBook(self.path)
+
+    def names(self, text, limit=10):
+        return [contact.name for contact in self.book.search(text, limit)]
+
+    def test_search(self):
+        id = self.book.add(KLAUS)
+        self.book.add({'name': 'Hans Hamburger', 'ort': '10115 Berlin'})
+        self.assertEqual('Klaus Störtebeker', self.book.get(id).name)
+        # prefixes of every word, without umlauts, contacts with the name first
+        self.assertEqual(['Klaus Störtebeker'], self.names('stort hamb'))
+        self.assertEqual(['Hans Hamburger', 'Klaus Störtebeker'], self.names('ham'))
+        self.assertEqual(['Hans Hamburger'], self.names('ham', limit=1))
+        self.assertEqual([], self.names(''))
+        self.assertEqual([], self.names('"*) OR ('))
+
+    def test_update_remove(self):
+        id = self.book.add(KLAUS)
+        self.book.update(id, dict(KLAUS, ort='24937 Flensburg'))
+        self.assertEqual([], self.names('hamburg'))
+        self.assertEqual(['Klaus Störtebeker'], self.names('flens'))
+        self.book.remove(id)
+        self.assertEqual([], self.names('klaus'))
+        with self.assertRaises(KeyError):
+            self.book.get(id)
+
+    def test_add_many(self):
+        self.book.add(KLAUS)
+        count = self.book.add_many({'name': 'Erika Muster %d' % i, 'ort': '%05d Köln' % i} for i in range(1000))
+        self.assertEqual(1000, count)
+        self.assertEqual(1001, len(self.book))
+        self.assertEqual(10, len(self.names('erika köln')))
+        self.assertEqual(['Erika Muster 123'], self.names('muster 123 köln'))
+        # the index of single contacts is kept up to date again
+        self.book.add({'name': 'Erika Neu'})
+        self.assertEqual(['Erika Neu'], self.names('erika neu'))
+        # another connection, e.g. the one of the search thread in the GUI
+        from letter.addressbook import AddressBook
+        with AddressBook(self.path) as book:
+            self.assertEqual(1002, len(book))
+
+    def test_contact(self):
+        from letter.addressbook import Contact
+        text = 'Firma Muster\nz. Hd. Frau Muster\nAbteilung 3\nWeg 2\nA-1010 Wien\nÖsterreich'
+        contact = Contact.from_address(text, anrede='Sehr geehrte Frau Muster,')
+        self.assertEqual(('Firma Muster', 'z. Hd. Frau Muster\nAbteilung 3', 'Weg 2', 'A-1010 Wien', 'Österreich'),
+                         contact[1:6])
+        self.assertEqual(text.split('\n'), contact.address())
+        self.assertEqual({'adresse': text, 'anrede': 'Sehr geehrte Frau Muster,'}, contact.recipient_spec())
+        self.assertEqual(('Erika', '', '', 'Köln', ''), Contact.from_address('Erika\nKöln')[1:6])
+        # recipients of the batch mode are split the same way
+        id = self.book.add({'key': 'muster', 'adresse': text, 'anrede': 'Hallo,'})
+        self.assertEqual(contact._replace(id=id, anrede='Hallo,'), self.book.get(id))
+
+    def test_resolve_contact(self):
+        from letter.addressbook import resolve_contact
+        id = self.book.add(KLAUS)
+        address = 'Klaus Störtebeker\nHafenstraße 1\n20359 Hamburg'
+        self.assertEqual({'adresse': address, 'anrede': 'Moin,', 'key': 'klaus'},
+                         resolve_contact({'kontakt': str(id), 'anrede': None, 'key': 'klaus'}, self.book))
+        # like with merge_specs only None is no value, an empty field stays empty
+        self.assertEqual({'adresse': address, 'anrede': ''},
+                         resolve_contact({'kontakt': id, 'anrede': ''}, self.book))
+        self.assertEqual({'adresse': 'Erika Muster'}, resolve_contact({'adresse': 'Erika Muster'}, self.book))
+        for unknown in (id + 1, 'Klaus', ''):
+            with self.assertRaises(ValueError):
+                resolve_contact({'kontakt': unknown}, self.book)
+
+    def test_batch(self):
+        from letter.batch import iter_batch
+        from letter.cache import PdfCache
+        from letter.spec import letter_from_template, template_from_spec
+        from tests.helpers import Pdf
+        id = self.book.add(KLAUS)
+        template = {'name': 'John Doe', 'betreff': 'Rechnung', 'text': 'Hallo'}
+        # the letters come from the cache, TeX isn't needed
+        cache = PdfCache(pjoin(self.test_dir, 'cache'))
+        for spec in ({'adresse': 'Klaus Störtebeker\nHafenstraße 1\n20359 Hamburg', 'anrede': 'Moin,',
+                      'key': 'klaus'}, {'adresse': 'Erika Muster', 'key': 'erika'}):
+            letter = letter_from_template(template_from_spec(template), spec)
+            cache.put(cache.key(letter.render_tex(), letter._builder_settings()), Pdf(b'%PDF-1.4'))
+        recipients = [{'kontakt': id, 'key': 'klaus'}, {'kontakt': id + 1, 'key': 'unknown'},
+                      {'kontakt': 'Klaus', 'key': 'invalid'}, {'adresse': 'Erika Muster', 'key': 'erika'}]
+        options = {'contacts': self.book, 'cache': cache.directory}
+        results = sorted(iter_batch(template, recipients, pjoin(self.test_dir, 'out'), workers=1,
+                                    options=options))
+        # the recipients with an unknown contact fail, the others are still built
+        self.assertEqual([True, False, False, True], [result.ok for result in results])
+        self.assertIn("There is no contact 'Klaus'", results[2].error)
+        self.assertTrue(os.path.isfile(pjoin(self.test_dir, 'out', 'erika.pdf')))
+
+    def tearDown(self):
+        self.book.close()
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
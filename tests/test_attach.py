@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_attach
+----------------------------------
+
+Tests for `letter.attach` module.
+"""
+
+import unittest
+import io, os, shutil, tempfile
+from os.path import join as pjoin
+
+from tests.helpers import Pdf
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+
+def make_pdf(filename, pages):
+    # every page with its own compressed content stream
+    from pypdf.generic import DecodedStreamObject, NameObject
+    writer = pypdf.PdfWriter()
+    for i in range(pages):
+        page = writer.add_blank_page(595, 842)
+        stream = DecodedStreamObject()
+        stream.set_data(b'BT /F1 12 Tf 72 700 Td (Seite %d) Tj ET\n' % i)
+        page[NameObject('/Contents')] = writer._add_object(stream.flate_encode())
+    with open(filename, 'wb') as f:
+        writer.write(f)
+
+
+# Stands in for TeX, every letter has one page. The runs are counted by the
+# class, the attributes of a builder are part of the key of the cache.
+class OnePageBuilder:
+    runs = 0
+
+    def build_pdf(self, source, texinputs=[]):
+        OnePageBuilder.runs += 1
+        writer = pypdf.PdfWriter()
+        writer.add_blank_page(595, 842)
+        out = io.BytesIO()
+        writer.write(out)
+        return Pdf(out.getvalue())
+
+
+@unittest.skipIf(pypdf is None, 'pypdf is not installed')
+class TestAttach(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.agb = pjoin(self.test_dir, 'agb.pdf')
+        make_pdf(self.agb, 3)
+        self.filename = pjoin(self.test_dir, 'brief.pdf')
+        OnePageBuilder.runs = 0
+
+    def pages(self, filename):
+        return len(pypdf.PdfReader(filename).pages)
+
+    def letter(self, attachments):
+        from letter.letter import Letter
+        letter = Letter()
+        letter.set_builder(OnePageBuilder())
+        letter.set_attachment_pdfs(attachments)
+        return letter
+
+    def test_append_pdfs(self):
+        from letter.attach import append_pdfs
+        make_pdf(self.filename, 1)
+        link = pjoin(self.test_dir, 'link.pdf')
+        os.link(self.filename, link)
+        os.chmod(self.filename, 0o640)
+        append_pdfs(self.filename, [self.agb, self.agb])
+        self.assertEqual(7, self.pages(self.filename))
+        # a new file, the linked one isn't changed
+        self.assertEqual(1, self.pages(link))
+        self.assertEqual(0o640, os.stat(self.filename).st_mode & 0o777)
+        # the content streams are copied as they are
+        appended = pypdf.PdfReader(self.filename).pages[3]['/Contents'].get_object()
+        original = pypdf.PdfReader(self.agb).pages[2]['/Contents'].get_object()
+        self.assertEqual('/FlateDecode', appended['/Filter'])
+        self.assertEqual(original._data, appended._data)
+
+    def test_closed_before_replace(self):
+        from unittest import mock
+        from letter.attach import append_pdfs
+        make_pdf(self.filename, 1)
+        opened = []
+
+        def tracked_open(*args):
+            opened.append(open(*args))
+            return opened[-1]
+
+        # on Windows a file which is still open can't be replaced
+        def replace(src, dst):
+            self.assertTrue(all(f.closed for f in opened))
+            os.rename(src, dst)
+
+        with mock.patch('letter.attach.open', tracked_open, create=True), \
+                mock.patch('letter.files.os.replace', replace):
+            append_pdfs(self.filename, [self.agb])
+        self.assertEqual(2, len(opened))
+        self.assertEqual(4, self.pages(self.filename))
+
+    def test_invalid(self):
+        from letter.attach import append_pdfs
+        make_pdf(self.filename, 1)
+        broken = pjoin(self.test_dir, 'kaputt.pdf')
+        with open(broken, 'w') as f:
+            f.write('kein PDF')
+        with self.assertRaises(ValueError):
+            append_pdfs(self.filename, [broken])
+        with self.assertRaises(OSError):
+            append_pdfs(self.filename, [pjoin(self.test_dir, 'fehlt.pdf')])
+        self.assertEqual(1, self.pages(self.filename))
+        self.assertEqual(['agb.pdf', 'brief.pdf', 'kaputt.pdf'], sorted(os.listdir(self.test_dir)))
+
+    def test_letter(self):
+        from letter.cache import PdfCache
+        letter = self.letter([self.agb])
+        letter.set_cache(PdfCache(pjoin(self.test_dir, 'cache')))
+        letter.compile_pdf(self.filename)
+        self.assertEqual(4, self.pages(self.filename))
+        # from the cache, which has the letter without the attachments
+        other = pjoin(self.test_dir, 'kopie.pdf')
+        letter.compile_pdf(other)
+        self.assertEqual(1, OnePageBuilder.runs)
+        self.assertEqual(4, self.pages(other))
+        entry = letter.get_cache().path(letter.get_cache().key(letter.render_tex(), letter._builder_settings()))
+        self.assertEqual(1, self.pages(entry))
+
+    def test_spec(self):
+        from letter.spec import letter_from_spec, letter_from_template, template_from_spec
+        self.assertEqual(('a.pdf', 'b c.pdf'), letter_from_spec({'anlagen_pdf': 'a.pdf; b c.pdf\n'})
+                         .get_attachment_pdfs())
+        template = template_from_spec({'anlagen_pdf': [self.agb]})
+        self.assertEqual((self.agb,), letter_from_template(template, {'betreff': 'Hallo'}).get_attachment_pdfs())
+        self.assertEqual(('a.pdf',), letter_from_template(template, {'anlagen_pdf': 'a.pdf'}).get_attachment_pdfs())
+
+    def test_combined(self):
+        from letter.combine import build_combined
+        letters = [self.letter([self.agb]), self.letter([]), self.letter([pjoin(self.test_dir, 'fehlt.pdf')])]
+        filenames = [pjoin(self.test_dir, '%d.pdf' % i) for i in range(len(letters))]
+        results = build_combined(letters, filenames)
+        self.assertEqual([None, None], [error for error, cached in results[:2]])
+        self.assertIn('fehlt.pdf', results[2][0])
+        self.assertEqual([4, 1], [self.pages(f) for f in filenames[:2]])
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_batch
+----------------------------------
+
+Tests for `letter.batch` and `letter.spec` modules.
+"""
+
+import unittest
+import json, multiprocessing, os, shutil, tempfile
+from os.path import join as pjoin
+
+
+# Stands in for render_letter in the worker processes, a recipient with
+# 'crash' kills its worker like the OOM killer
+def crashing_render(spec, filename, options=None):
+    if spec.get('crash'):
+        os._exit(1)
+    return None, False, []
+
+
+class TestBatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = tempfile.mkdtemp()
+        cls.template = {
+            'name': 'John Doe',
+            'strasse': 'Straße der Freiheit 1',
+            'ort': '12345 Berlin',
+            'betreff': 'Rechnung #1',
+            'anrede': 'Hallo,',
+            'gruss': 'Viele Grüße',
+            'text': 'Zeile 1 mit 50%\nZeile 2',
+            }
+
+    def test_read_recipients(self):
+        from letter.batch import read_recipients
+        csv_file = pjoin(self.test_dir, 'recipients.csv')
+        with open(csv_file, 'w', encoding='utf-8') as f:
+            f.write('key,adresse\na,Klaus Störtebeker\nb,Hein Blöd\n')
+        jsonl_file = pjoin(self.test_dir, 'recipients.jsonl')
+        with open(jsonl_file, 'w', encoding='utf-8') as f:
+            f.write('{"key": "a", "adresse": "Klaus Störtebeker"}\n\n{"key": "b", "adresse": "Hein Blöd"}\n')
+        json_file = pjoin(self.test_dir, 'recipients.json')
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump([{'key': 'a', 'adresse': 'Klaus Störtebeker'}, {'key': 'b', 'adresse': 'Hein Blöd'}], f)
+
+        expected = [{'key': 'a', 'adresse': 'Klaus Störtebeker'}, {'key': 'b', 'adresse': 'Hein Blöd'}]
+        self.assertEqual(expected, read_recipients(csv_file))
+        self.assertEqual(expected, read_recipients(jsonl_file))
+        self.assertEqual(expected, read_recipients(json_file))
+
+    def test_read_recipients_bom(self):
+        from letter.batch import read_recipients
+        # as saved by Excel
+        csv_file = pjoin(self.test_dir, 'excel.csv')
+        with open(csv_file, 'w', encoding='utf-8-sig') as f:
+            f.write('key,adresse\na,Klaus Störtebeker\n')
+        self.assertEqual([{'key': 'a', 'adresse': 'Klaus Störtebeker'}], read_recipients(csv_file))
+
+    def test_output_filename(self):
+        from letter.batch import output_filename
+        self.assertEqual(pjoin('out', 'letter_00001.pdf'), output_filename('out', 0, {}))
+        self.assertEqual(pjoin('out', 'mueller.pdf'), output_filename('out', 0, {'key': 'mueller'}))
+
+    def test_spec(self):
+        from letter.spec import letter_from_spec, merge_specs
+        spec = merge_specs(self.template, {'adresse': 'Klaus Störtebeker\nHamburg', 'faltmarken': 'false'})
+        letter = letter_from_spec(spec)
+        self.assertEqual(['Klaus Störtebeker\\\\\n', 'Hamburg\\\\\n'], letter.get_adresse())
+        self.assertEqual('Rechnung \\#1', letter.get_betreff())
+        self.assertEqual('John Doe', letter.get_unterschrift())
+        self.assertFalse(letter._get_val('faltmarken'))
+        self.assertEqual(['\\begin{document}\n', '\\begin{g-brief}\n', 'Zeile 1 mit 50\\%\\\\\n',
+                          'Zeile 2\\\\\n', '\end{g-brief}\n', '\end{document}\n'], letter.get_text())
+        with self.assertRaises(ValueError):
+            letter_from_spec({'unknown': 'field'})
+
+    def test_template(self):
+        from letter.spec import letter_from_spec, letter_from_template, merge_specs, template_from_spec
+        template = template_from_spec(dict(self.template, anlagen='Rechnung'))
+        recipients = [
+            {},
+            {'adresse': 'Klaus Störtebeker\nHamburg', 'anrede': 'Moin,', 'datum': None},
+            {'name': 'Jane Doe', 'anlagen_label': '*'},
+            {'betreff': 'Rechnung #1', 'text': ['\\begin{document}\n', '\end{document}\n']},
+            # signed with the name of the sender like without the template
+            {'unterschrift': ''},
+            ]
+        for recipient in recipients:
+            expected = letter_from_spec(merge_specs(template.spec, recipient)).render_tex()
+            self.assertEqual(expected, letter_from_template(template, recipient).render_tex())
+        # the shared values aren't prepared again and can't be changed
+        letter = letter_from_template(template, recipients[1])
+        self.assertIs(template.new_letter().get_betreff(), letter.get_betreff())
+        self.assertIsInstance(letter.get_text(), tuple)
+        self.assertEqual(['Klaus Störtebeker\\\\\n', 'Hamburg\\\\\n'], letter.get_adresse())
+        # setting a field of one letter leaves the template and other letters alone
+        letter.set_betreff('Mahnung')
+        self.assertEqual('Rechnung \\#1', template.new_letter().get_betreff())
+
+    def test_run_batch(self):
+        from letter.batch import run_batch
+        outdir = pjoin(self.test_dir, 'out')
+        recipients = [
+            {'key': 'good', 'adresse': 'Klaus Störtebeker\nHamburg'},
+            # missing \end{document}, this one has to fail without stopping the run
+            {'key': 'broken', 'text': ['\\begin{document}\n', '\\begin{g-brief}\n', '\end{g-brief}\n']},
+            ]
+        reported = []
+        results = run_batch(self.template, recipients, outdir, workers=2, callback=reported.append)
+        self.assertEqual(2, len(reported))
+        self.assertEqual([0, 1], [r.index for r in results])
+        self.assertTrue(results[0].ok)
+        self.assertTrue(os.path.isfile(pjoin(outdir, 'good.pdf')))
+        self.assertFalse(results[1].ok)
+        self.assertTrue(results[1].error)
+
+    def test_iter_batch(self):
+        from letter.batch import iter_batch, iter_recipients
+        csv_file = pjoin(self.test_dir, 'many.csv')
+        with open(csv_file, 'w', encoding='utf-8') as f:
+            f.write('adresse\n')
+            f.writelines('Erika Muster %d\n' % i for i in range(6))
+        read = []
+
+        def recipients():
+            for recipient in iter_recipients(csv_file):
+                read.append(recipient)
+                yield recipient
+
+        # the recipients are only read as far as the window of jobs allows
+        batch = iter_batch(self.template, recipients(), pjoin(self.test_dir, 'window'), workers=1,
+                           options={'window': 2})
+        first = next(batch)
+        self.assertLessEqual(len(read), 2)
+        indices = [first.index] + [result.index for result in batch]
+        self.assertEqual(list(range(6)), sorted(indices))
+        self.assertEqual(6, len(read))
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == 'fork', 'the workers have to inherit the mock')
+    def test_worker_died(self):
+        from unittest import mock
+        from letter.batch import iter_batch
+        recipients = [{'adresse': 'Erika Muster %d' % i} for i in range(8)]
+        recipients[2]['crash'] = True
+        with mock.patch('letter.batch.render_letter', crashing_render):
+            results = sorted(iter_batch(self.template, recipients, pjoin(self.test_dir, 'died'), workers=2))
+        # only the letter which kills its worker fails, the batch goes on
+        self.assertEqual(list(range(8)), [result.index for result in results])
+        self.assertEqual([True, True, False] + [True] * 5, [result.ok for result in results])
+        self.assertIn('BrokenProcessPool', results[2].error)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
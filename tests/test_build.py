@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_build
+----------------------------------
+
+Tests for `letter.build` module.
+"""
+
+import unittest
+import shutil, tempfile, time
+from os.path import join as pjoin
+
+from letter.letter import Letter
+
+
+class SlowLetter(Letter):
+    # a build which takes long enough to be cancelled
+    def compile_pdf(self, filename=''):
+        time.sleep(60)
+
+
+class TestBuildProcess(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = tempfile.mkdtemp()
+        cls.pdf = pjoin(cls.test_dir, 'test_out.pdf')
+
+    def test_build_fails(self):
+        from letter.build import BuildProcess
+        letter = Letter()
+        letter.set_text(["\\begin{document}\n", "\\begin{g-brief}\n", "\end{g-brief}\n"])
+        build = BuildProcess(letter, self.pdf)
+        build.start()
+        self.assertTrue(build.wait(60))
+        self.assertFalse(build.ok)
+        self.assertFalse(build.cancelled)
+        self.assertTrue(build.error)
+
+    def test_broken_attachment(self):
+        from letter.build import BuildProcess
+        from tests.test_attach import OnePageBuilder, pypdf
+        if pypdf is None:
+            self.skipTest('pypdf is not installed')
+        broken = pjoin(self.test_dir, 'kaputt.pdf')
+        with open(broken, 'w') as f:
+            f.write('kein PDF')
+        letter = Letter()
+        letter.set_builder(OnePageBuilder())
+        letter.set_attachment_pdfs([broken])
+        build = BuildProcess(letter, self.pdf)
+        build.start()
+        self.assertTrue(build.wait(60))
+        # reported as the error of the build, not as a build which died
+        self.assertFalse(build.ok)
+        self.assertIn('ValueError', build.error)
+        self.assertIn('kaputt.pdf', build.error)
+
+    def test_cancel(self):
+        from letter.build import BuildProcess
+        build = BuildProcess(SlowLetter(), self.pdf)
+        build.start()
+        self.assertFalse(build.wait(0.5))
+        start = time.time()
+        build.cancel()
+        self.assertTrue(build.wait(5))
+        self.assertLess(time.time() - start, 5)
+        self.assertTrue(build.cancelled)
+        self.assertFalse(build.ok)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------------------------------
+
+Tests for `letter.cache` module.
+"""
+
+import unittest
+import os, shutil, tempfile
+from os.path import join as pjoin
+
+from tests.helpers import Pdf
+
+
+class TestPdfCache(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = pjoin(self.test_dir, 'cache')
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_key(self):
+        from letter.cache import PdfCache
+        self.assertEqual(PdfCache.key('a', 's'), PdfCache.key('a', 's'))
+        self.assertNotEqual(PdfCache.key('a', 's'), PdfCache.key('a', 't'))
+        self.assertNotEqual(PdfCache.key('a', 's'), PdfCache.key('b', 's'))
+
+    def test_put_get(self):
+        from letter.cache import PdfCache
+        cache = PdfCache(self.cache_dir, link=True)
+        out = pjoin(self.test_dir, 'out.pdf')
+        key = cache.key('source')
+        self.assertFalse(cache.get(key, out))
+        self.assertFalse(os.path.exists(out))
+
+        cache.put(key, Pdf(b'%PDF-1'), out)
+        self.assertEqual(b'%PDF-1', self.read(out))
+        self.assertTrue(os.path.samefile(cache.path(key), out))
+
+        # a hit must not write through a link into another entry
+        other = cache.key('other')
+        cache.put(other, Pdf(b'%PDF-2'))
+        self.assertTrue(cache.get(other, out))
+        self.assertEqual(b'%PDF-2', self.read(out))
+        self.assertEqual(b'%PDF-1', self.read(cache.path(key)))
+        self.assertEqual({'hits': 1, 'misses': 1, 'size': 12}, cache.stats())
+
+    def test_copy(self):
+        from letter.cache import PdfCache
+        cache = PdfCache(self.cache_dir)
+        out = pjoin(self.test_dir, 'out.pdf')
+        cache.put(cache.key('source'), Pdf(b'%PDF-1'), out)
+        self.assertFalse(os.path.samefile(cache.path(cache.key('source')), out))
+
+    def test_linked_output_replaced(self):
+        from letter.cache import PdfCache
+        from letter.letter import Letter
+        cache = PdfCache(self.cache_dir, link=True)
+        out = pjoin(self.test_dir, 'out.pdf')
+        key = cache.key('a')
+        cache.put(key, Pdf(b'%PDF-a'), out)
+        os.chmod(out, 0o640)
+
+        # building another letter into the linked output doesn't change the entry
+        class Builder:
+            def build_pdf(self, source, texinputs=[]):
+                return Pdf(b'%PDF-b')
+
+        letter = Letter()
+        letter.set_builder(Builder())
+        letter.compile_pdf(out)
+        self.assertEqual(b'%PDF-b', self.read(out))
+        self.assertEqual(0o640, os.stat(out).st_mode & 0o777)
+        self.assertTrue(cache.get(key, pjoin(self.test_dir, 'again.pdf')))
+        self.assertEqual(b'%PDF-a', self.read(pjoin(self.test_dir, 'again.pdf')))
+        self.assertEqual(['again.pdf', 'cache', 'out.pdf'], sorted(os.listdir(self.test_dir)))
+
+    def test_eviction(self):
+        from unittest import mock
+        from letter.cache import PdfCache
+        cache = PdfCache(self.cache_dir, max_size=25)
+        keys = [cache.key(str(i)) for i in range(3)]
+        for i, key in enumerate(keys):
+            cache.put(key, Pdf(b'0123456789'))
+            os.utime(cache.path(key), (i, i))
+        # the oldest entry is removed when the limit is exceeded
+        self.assertFalse(os.path.exists(cache.path(keys[0])))
+        # using an entry makes it the most recent one
+        self.assertTrue(cache.get(keys[1], pjoin(self.test_dir, 'out.pdf')))
+        cache.put(cache.key('3'), Pdf(b'0123456789'))
+        self.assertTrue(os.path.exists(cache.path(keys[1])))
+        self.assertFalse(os.path.exists(cache.path(keys[2])))
+        self.assertEqual(20, cache.size())
+        # the directory is listed once, the later puts and gets only update the index
+        with mock.patch.object(cache, '_entries') as entries:
+            cache.put(cache.key('4'), Pdf(b'0123456789'))
+            self.assertTrue(cache.get(cache.key('3'), pjoin(self.test_dir, 'out.pdf')))
+            cache.put(cache.key('5'), Pdf(b'0123456789'))
+        entries.assert_not_called()
+        self.assertEqual([False, True, False, True],
+                         [os.path.exists(cache.path(cache.key(k))) for k in '1345'])
+        self.assertEqual(20, cache.size())
+
+    def test_letter_uses_cache(self):
+        from letter.letter import Letter
+        from letter.cache import PdfCache
+        cache = PdfCache(self.cache_dir)
+        out = pjoin(self.test_dir, 'letter.pdf')
+        with Letter() as letter:
+            letter.set_cache(cache)
+            key = cache.key(letter.render_tex(), letter._builder_settings())
+            cache.put(key, Pdf(b'%PDF-cached'))
+            # no compilation at all on a hit
+            self.assertEqual(out, letter.compile_pdf(out))
+        self.assertEqual(b'%PDF-cached', self.read(out))
+        self.assertEqual(1, cache.hits)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_combine
+----------------------------------
+
+Tests for `letter.combine` module.
+"""
+
+import unittest
+import io, os, shutil, tempfile
+from os.path import join as pjoin
+
+from tests.helpers import Pdf
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+
+class FakeBuilder:
+    # Stands in for TeX: every letter gets one page plus one per 'newpage' and
+    # the page boundaries are recorded like the code in SETUP does. A letter
+    # containing FEHLER fails to build, like TeX with an error.
+    def __init__(self):
+        self.runs = []
+
+    def build_pdf(self, source, texinputs=[]):
+        from letter.combine import LETTER_END, INFO_KEY
+        self.runs.append(source)
+        if 'FEHLER' in source:
+            raise RuntimeError('TeX failed')
+        letters = source.split(LETTER_END)[:-1] if LETTER_END in source else [source]
+        writer = pypdf.PdfWriter()
+        ends = []
+        for letter in letters:
+            for _ in range(letter.count('newpage') + 1):
+                writer.add_blank_page(595, 842)
+            ends.append(len(writer.pages))
+        if LETTER_END in source:
+            writer.add_metadata({INFO_KEY: ' '.join(map(str, ends)) + ' '})
+        out = io.BytesIO()
+        writer.write(out)
+        return Pdf(out.getvalue())
+
+
+@unittest.skipIf(pypdf is None, 'pypdf is not installed')
+class TestCombine(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.builder = FakeBuilder()
+
+    def letter(self, content, faltmarken=True):
+        from letter.letter import Letter
+        from letter.text import prepare_content
+        letter = Letter()
+        letter.set_text(prepare_content(content))
+        letter.set_faltmarken(faltmarken)
+        letter.set_builder(self.builder)
+        return letter
+
+    def pages(self, filename):
+        return len(pypdf.PdfReader(filename).pages)
+
+    def test_letter_body(self):
+        from letter.combine import letter_body, BEGIN_DOCUMENT, END_DOCUMENT
+        body = ''.join(letter_body(self.letter('Hallo')))
+        self.assertNotIn(BEGIN_DOCUMENT, body)
+        self.assertNotIn(END_DOCUMENT, body)
+        self.assertIn('\\begin{g-brief}\n', body)
+        letter = self.letter('Hallo')
+        letter.set_text(['\\begin{document}\n', '\\begin{g-brief}\n', '\\end{g-brief}\n'])
+        self.assertIsNone(letter_body(letter))
+
+    def test_build_combined(self):
+        from letter.combine import build_combined
+        contents = ['Eins', 'Zwei\n\\newpage\nZwei', 'Drei', 'Vier\n\\newpage\n\\newpage']
+        letters = [self.letter(content) for content in contents]
+        filenames = [pjoin(self.test_dir, '%d.pdf' % i) for i in range(len(letters))]
+        self.assertEqual([(None, False)] * 4, build_combined(letters, filenames, chunk_size=10))
+        self.assertEqual(1, len(self.builder.runs))
+        self.assertEqual([1, 2, 1, 3], [self.pages(f) for f in filenames])
+
+    def test_chunks(self):
+        from letter.combine import build_combined
+        # the switches can't be reset within one document
+        letters = [self.letter('A'), self.letter('B', faltmarken=False), self.letter('C'), self.letter('D')]
+        filenames = [pjoin(self.test_dir, '%d.pdf' % i) for i in range(len(letters))]
+        build_combined(letters, filenames, chunk_size=2)
+        self.assertEqual(3, len(self.builder.runs))
+        self.assertTrue(all(os.path.isfile(f) for f in filenames))
+
+    def test_reproducible(self):
+        from letter.combine import build_combined
+        from letter.letter import REPRODUCIBLE_SETUP
+        letters = [self.letter(content) for content in ('A', 'B', 'C')]
+        letters[0].set_reproducible()
+        letters[2].set_reproducible()
+        filenames = [pjoin(self.test_dir, '%d.pdf' % i) for i in range(len(letters))]
+        build_combined(letters, filenames)
+        self.assertEqual(2, len(self.builder.runs))
+        self.assertEqual([True, False], [''.join(REPRODUCIBLE_SETUP) in run for run in self.builder.runs])
+        # splitting the PDF doesn't add anything which changes between two builds
+        again = [pjoin(self.test_dir, 'again%d.pdf' % i) for i in range(len(letters))]
+        build_combined(letters, again)
+        for first, second in zip(filenames, again):
+            with open(first, 'rb') as f, open(second, 'rb') as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_failing_letter_is_isolated(self):
+        from letter.combine import build_combined
+        letters = [self.letter(content) for content in ('A', 'B', 'FEHLER', 'D')]
+        # missing \end{document}, built on its own
+        letters.append(self.letter('E'))
+        letters[-1].set_text(['\\begin{document}\n', '\\begin{g-brief}\n', 'FEHLER\n'])
+        filenames = [pjoin(self.test_dir, '%d.pdf' % i) for i in range(len(letters))]
+        results = build_combined(letters, filenames, chunk_size=4)
+        self.assertEqual([None, None, 'RuntimeError: TeX failed', None, 'RuntimeError: TeX failed'],
+                         [error for error, cached in results])
+        self.assertEqual([True, True, False, True, False], [os.path.isfile(f) for f in filenames])
+        # the separate letter, the chunk, both halves and the two letters of the failing half
+        self.assertEqual(6, len(self.builder.runs))
+
+    def test_cache(self):
+        from letter.cache import PdfCache
+        from letter.combine import build_combined
+        cache = PdfCache(pjoin(self.test_dir, 'cache'))
+        letters = [self.letter(content) for content in ('A', 'B')]
+        for letter in letters:
+            letter.set_cache(cache)
+        filenames = [pjoin(self.test_dir, '%d.pdf' % i) for i in range(len(letters))]
+        self.assertEqual([(None, False)] * 2, build_combined(letters, filenames))
+        self.assertEqual([(None, True)] * 2, build_combined(letters, filenames))
+        self.assertEqual(1, len(self.builder.runs))
+
+    def test_missing_page_info(self):
+        from letter.combine import split_pdf, PageInfoError
+        writer = pypdf.PdfWriter()
+        writer.add_blank_page(595, 842)
+        out = io.BytesIO()
+        writer.write(out)
+        with self.assertRaises(PageInfoError):
+            split_pdf(Pdf(out.getvalue()), 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
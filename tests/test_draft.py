@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_draft
+----------------------------------
+
+Tests for `letter.draft` module.
+"""
+
+import unittest
+import json, os, shutil, tempfile
+from os.path import join as pjoin
+
+
+class TestDraft(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = pjoin(self.test_dir, 'entwurf.json')
+
+    def letter(self):
+        from letter.letter import Letter
+        from letter.text import prepare_content, prepare_line, prepare_text
+        letter = Letter()
+        letter.set_absender('John Doe', 'Straße der Freiheit 1', '12345 Berlin')
+        letter.set_adresse(prepare_text('Klaus Störtebeker\nHafenstraße 1\n20359 Hamburg'))
+        letter.set_betreff(prepare_line('Rechnung #4711 über 100 €'))
+        letter.set_text(prepare_content('Hallo,\n\nanbei 19% MwSt.'))
+        letter.set_faltmarken(False)
+        letter.set_bank('Sparkasse', '100 500 00', '4711')
+        letter.set_attachment_pdfs(['agb.pdf'])
+        return letter
+
+    def test_save_load(self):
+        from letter.draft import draft_from_letter, letter_from_draft, load_draft, save_draft
+        letter = self.letter()
+        save_draft(self.filename, draft_from_letter(letter, {'name_line': 'John Doe'}))
+        self.assertEqual(['entwurf.json'], os.listdir(self.test_dir))
+        draft = load_draft(self.filename)
+        self.assertEqual({'name_line': 'John Doe'}, draft['gui'])
+        # only the fields which differ from the default
+        self.assertNotIn('lochermarke', draft['fields'])
+        self.assertEqual(letter.render_tex(), letter_from_draft(draft).render_tex())
+        self.assertEqual(('agb.pdf',), letter_from_draft(draft).get_attachment_pdfs())
+
+        # all other fields of the letter get their default
+        other = self.letter()
+        other.set_zeichen('', 'ab-12')
+        other.set_attachment_pdfs(['other.pdf'])
+        other.set_betreff('Mahnung')
+        self.assertEqual(letter.render_tex(), letter_from_draft(draft, other).render_tex())
+        self.assertEqual(('agb.pdf',), other.get_attachment_pdfs())
+
+    def test_text_file(self):
+        from letter.draft import draft_from_letter, encode_draft, decode_draft, letter_from_draft
+        from letter.text import Content
+        text_file = pjoin(self.test_dir, 'text.txt')
+        with open(text_file, 'w', encoding='latin-1') as f:
+            f.write('Grüße\n' * 10)
+        letter = self.letter()
+        letter.set_text(Content.from_file(text_file, 'latin-1'))
+        data = encode_draft(draft_from_letter(letter))
+        # the file is referenced, not copied
+        self.assertEqual({'file': text_file, 'encoding': 'latin-1'}, json.loads(data.decode('utf-8'))['fields']['text'])
+        self.assertEqual(letter.render_tex(), letter_from_draft(decode_draft(data)).render_tex())
+
+        letter.set_text(Content.from_string('Grüße\n' * 10))
+        self.assertEqual(letter.render_tex(), letter_from_draft(decode_draft(encode_draft(draft_from_letter(letter))))
+                         .render_tex())
+
+    def test_invalid(self):
+        from letter.draft import decode_draft, FORMAT, VERSION
+        with self.assertRaises(ValueError):
+            decode_draft(b'{"name": "John Doe"}')
+        with self.assertRaises(ValueError):
+            decode_draft(json.dumps({'format': FORMAT, 'version': VERSION + 1, 'fields': {}}))
+        with self.assertRaises(ValueError):
+            decode_draft(json.dumps({'format': FORMAT, 'version': VERSION, 'fields': {'nom': 'John'}}))
+
+    def test_autosave(self):
+        from letter.draft import AutoSaver, draft_from_letter, load_draft
+        errors = []
+        saver = AutoSaver(pjoin(self.test_dir, 'neu', 'autosave.json'), errors.append)
+        letter = self.letter()
+        for subject in ('Eins', 'Zwei', 'Drei'):
+            letter.set_betreff(subject)
+            saver.save(draft_from_letter(letter))
+        self.assertTrue(saver.flush(10))
+        self.assertEqual('Drei', load_draft(saver.filename)['fields']['betreff'])
+        self.assertLessEqual(saver.saved, 3)
+        letter.set_betreff('Vier')
+        saver.save(draft_from_letter(letter))
+        saver.close()
+        self.assertEqual('Vier', load_draft(saver.filename)['fields']['betreff'])
+        self.assertEqual([], errors)
+        with self.assertRaises(RuntimeError):
+            saver.save(draft_from_letter(letter))
+        saver.discard()
+        self.assertFalse(os.path.exists(saver.filename))
+        saver.discard()
+
+        saver = AutoSaver(pjoin(self.test_dir, 'neu'), errors.append)  # a directory
+        saver.save(draft_from_letter(letter))
+        saver.close()
+        self.assertEqual(1, len(errors))
+        self.assertEqual(0, saver.saved)
+
+    def test_batch(self):
+        from letter.batch import read_recipients
+        from letter.draft import draft_from_letter, save_draft
+        from letter.spec import letter_from_spec, letter_from_template, template_from_spec
+        from letter.text import prepare_text
+        letter = self.letter()
+        save_draft(self.filename, draft_from_letter(letter))
+        recipients = read_recipients(self.filename)
+        self.assertEqual(1, len(recipients))
+        self.assertEqual(letter.render_tex(), letter_from_spec(recipients[0]).render_tex())
+
+        template = template_from_spec(recipients[0])
+        letter.set_adresse(prepare_text('Erika Muster'))
+        self.assertEqual(letter.render_tex(), letter_from_template(template, {'adresse': 'Erika Muster'}).render_tex())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_fmt
+----------------------------------
+
+Tests for `letter.fmt` module.
+"""
+
+import unittest
+import os, shutil, tempfile
+from os.path import join as pjoin
+
+
+class TestFormatBuilder(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = tempfile.mkdtemp()
+        cls.pdf = pjoin(cls.test_dir, 'test_out.pdf')
+
+    def test_preamble_files(self):
+        from letter.fmt import _preamble_files
+        from letter.letter import PREAMBLE
+        self.assertEqual(['g-brief.cls', 'inputenc.sty', 'babel.sty', 'enumerate.sty', 'gensymb.sty', 'eurosym.sty'],
+                         _preamble_files(PREAMBLE))
+
+    def test_pdf_with_format(self):
+        from letter.letter import Letter
+        from letter.fmt import FormatBuilder
+        builder = FormatBuilder(cache_dir=pjoin(self.test_dir, 'formats'))
+        with Letter() as letter:
+            letter.set_builder(builder)
+            letter.set_text(["\\begin{document}\n", "\\begin{g-brief}\n", "Content.\n", "\end{g-brief}\n", "\end{document}\n"])
+            letter.compile_pdf(self.pdf)
+            self.assertTrue(os.path.isfile(builder.format_file()))
+            # the second letter is built with the format dumped before
+            letter.set_betreff('Zweiter Brief')
+            letter.compile_pdf(self.pdf)
+        self.assertEqual(1, len([f for f in os.listdir(builder.cache_dir) if f.endswith('.fmt')]))
+        self.assertTrue(os.path.isfile(self.pdf))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,8 +9,8 @@ Tests for `letter` module.
 """
 
 import unittest
-import sys, shutil, tempfile
-from os.path import join as pjoin
+import sys, shutil, subprocess, tempfile
+from os.path import join as pjoin, dirname, abspath
 # use builtins to test ImportError
 try:
     import builtins
@@ -30,16 +30,33 @@ class TestLetter(unittest.TestCase):
         # construct a method which let the import of the latex package fail
         self.original_import = builtins.__import__
         def fail_import(name, *args, **kwargs):
-            if name is 'latex':
+            if name == 'latex':
                 raise ImportError
             return self.original_import(name, *args, **kwargs)
         builtins.__import__ = fail_import
+        # make sure the module is really imported again, other tests may have loaded it already
+        original_module = sys.modules.pop('letter.letter', None)
 
-        with self.assertRaises(SystemExit) as exc:
-            from letter.letter import Letter
-        self.assertEqual(exc.exception.code, 1)
+        try:
+            # the latex package is only needed to build the PDF
+            from letter.letter import Letter, LatexNotAvailable
+            with Letter() as letter:
+                letter.save_tex(self.tex)
+                with self.assertRaises(LatexNotAvailable):
+                    letter.create_pdf(self.pdf)
+        finally:
+            builtins.__import__ = self.original_import
+            # other modules keep using the classes of the original module
+            if original_module is not None:
+                sys.modules['letter.letter'] = original_module
+                sys.modules['letter'].letter = original_module
 
-        builtins.__import__ = self.original_import
+    def test_import_is_lightweight(self):
+        # neither the latex package nor Qt are loaded just by importing
+        code = ("import sys, main, letter.letter, letter.text, letter.spec, letter.batch; "
+                "print(sorted(m for m in ('latex', 'PyQt5') if m in sys.modules))")
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=dirname(dirname(abspath(__file__))))
+        self.assertEqual(b'[]', out.strip())
 
     def test_context_manager(self):
         from letter.letter import Letter
@@ -67,6 +84,103 @@ class TestLetter(unittest.TestCase):
             ret = letter.save_tex(self.tex)
         self.assertIsNone(ret)
 
+    def test_render_tex(self):
+        from letter.letter import Letter, PREAMBLE
+        letter = Letter()
+        letter.set_betreff("Betreff")
+        tex = letter.render_tex()
+        self.assertTrue(tex.startswith(''.join(PREAMBLE)))
+        self.assertIn("\\Betreff{Betreff}\n", tex)
+        self.assertTrue(tex.endswith("\\endinput"))
+        letter.save_tex(self.tex)
+        with open(self.tex, encoding='utf-8') as f:
+            self.assertEqual(tex, f.read())
+
+    def test_render_changed_fields(self):
+        from unittest import mock
+        import letter.letter
+        letter_ = letter.letter.Letter()
+        letter_.set_text(["\\begin{document}\n", "Text\n", "\end{document}\n"])
+        tex = letter_.render_tex()
+        # nothing changed, nothing rendered
+        self.assertIs(tex, letter_.render_tex())
+        with mock.patch('letter.letter._render_field', wraps=letter.letter._render_field) as render:
+            letter_.set_betreff("Neu")
+            tex = letter_.render_tex()
+            self.assertEqual(1, render.call_count)
+        self.assertIn("\\Betreff{Neu}\n", tex)
+        self.assertEqual(tex, ''.join(letter_.iter_tex()))
+        letter_.set_text(["\\begin{document}\n", "Anders\n", "\end{document}\n"])
+        self.assertEqual(''.join(letter_.iter_tex()), letter_.render_tex())
+        self.assertIn("Anders\n", letter_.render_tex())
+
+    def test_set_same_values(self):
+        from unittest import mock
+        import letter.letter
+        from letter.text import prepare_content, prepare_text
+
+        def fill(letter_):
+            letter_.set_absender('John Doe', 'Straße der Freiheit 1', '12345 Berlin')
+            letter_.set_adresse(prepare_text('Klaus Störtebeker\nHamburg'))
+            letter_.set_betreff('Rechnung')
+            letter_.set_faltmarken(False)
+            letter_.set_text(prepare_content('Hallo,\n\nanbei die Rechnung.'))
+
+        letter_ = letter.letter.Letter()
+        fill(letter_)
+        tex = letter_.render_tex()
+        # the GUI sets all fields again with equal, new values
+        with mock.patch('letter.letter._render_field', wraps=letter.letter._render_field) as render:
+            fill(letter_)
+            self.assertIs(tex, letter_.render_tex())
+            self.assertEqual(0, render.call_count)
+        # a list changed in place and set again is rendered again
+        lines = letter_.get_adresse()
+        lines.append('Deutschland\\\\\n')
+        letter_.set_adresse(lines)
+        self.assertIn('Deutschland', letter_.render_tex())
+
+    def test_write_tex(self):
+        import io, socket
+        from letter.letter import Letter
+        letter = Letter()
+        letter.set_betreff("Grüße")
+        letter.set_text(["\\begin{document}\n", "Zeile\n" * 3, "\end{document}\n"])
+        tex = letter.render_tex()
+        self.assertEqual(tex, ''.join(letter.iter_tex()))
+        text = io.StringIO()
+        letter.write_tex(text)
+        self.assertEqual(tex, text.getvalue())
+        data = io.BytesIO()
+        letter.write_tex(data)
+        self.assertEqual(tex.encode('utf-8'), data.getvalue())
+        # a pipe into another process and a socket
+        proc = subprocess.Popen([sys.executable, '-c', 'import sys; sys.stdout.buffer.write(sys.stdin.buffer.read())'],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        letter.write_tex(proc.stdin)
+        self.assertEqual(tex.encode('utf-8'), proc.communicate()[0])
+        left, right = socket.socketpair()
+        with left, right:
+            letter.write_tex(left)
+            left.shutdown(socket.SHUT_WR)
+            received = b''.join(iter(lambda: right.recv(65536), b''))
+        self.assertEqual(tex.encode('utf-8'), received)
+
+    def test_write_tex_memory(self):
+        import os, tracemalloc
+        from letter.letter import Letter
+        letter = Letter()
+        letter.set_text(["Eine Zeile des Brieftexts mit ein paar Wörtern.\\\\\n"] * 100000)
+        with open(os.devnull, 'wb') as f:
+            tracemalloc.start()
+            try:
+                letter.write_tex(f)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        # the body has about 5 MB, only a buffer of it is held at a time
+        self.assertLess(peak, 1024 * 1024)
+
     def test_pdf(self):
         from letter.letter import Letter
         with Letter() as letter:
@@ -100,6 +214,46 @@ class TestLetter(unittest.TestCase):
                 letter.create_pdf(self.pdf)
             self.assertEqual(exc.exception.code, 'Building PDF failed!')
 
+    def test_reproducible_pdf(self):
+        import time
+        from letter.letter import Letter
+        letter = Letter()
+        letter.set_reproducible(source_date=1700000000)
+        letter.set_text(["\\begin{document}\n", "\\begin{g-brief}\n", "Content.\n", "\\end{g-brief}\n",
+                         "\\end{document}\n"])
+        first, second = pjoin(self.test_dir, 'first.pdf'), pjoin(self.test_dir, 'second.pdf')
+        letter.compile_pdf(first)
+        # the timestamps of PDF files have a resolution of one second
+        time.sleep(1.1)
+        letter.compile_pdf(second)
+        with open(first, 'rb') as f, open(second, 'rb') as g:
+            pdf = f.read()
+            self.assertEqual(pdf, g.read())
+        self.assertNotIn(b'/CreationDate', pdf)
+        self.assertNotIn(b'/ID', pdf)
+
+    def test_reproducible_tex(self):
+        import os
+        from letter.letter import Letter, PREAMBLE, REPRODUCIBLE_SETUP
+        letter = Letter()
+        plain = letter.render_tex()
+        os.environ['SOURCE_DATE_EPOCH'] = '1700000000'
+        try:
+            letter.set_reproducible()
+        finally:
+            del os.environ['SOURCE_DATE_EPOCH']
+        tex = letter.render_tex()
+        preamble = ''.join(PREAMBLE)
+        setup = ''.join(REPRODUCIBLE_SETUP) + '\\year=2023 \\month=11 \\day=14 \\time=1333\n'
+        self.assertTrue(tex.startswith(preamble + setup))
+        self.assertEqual(tex, ''.join(letter.iter_tex()))
+        self.assertEqual(plain, tex.replace(setup, ''))
+        letter.set_reproducible(source_date=None)
+        self.assertIn(''.join(REPRODUCIBLE_SETUP) + '\\lochermarke', letter.render_tex())
+        letter.set_reproducible(False)
+        self.assertFalse(letter.is_reproducible())
+        self.assertEqual(plain, letter.render_tex())
+
     def test_symbol_replace(self):
         from letter.letter import Letter
         with Letter() as letter:
@@ -108,6 +262,23 @@ class TestLetter(unittest.TestCase):
             self.assertEqual(replaced,
                     'Lots of symbols: \%\& \_d\S  \euro a\\textasciitilde rt\\textasciicircum 4 \\textbackslash \\textbar  \pounds ö\degree o\\texttrademark ß\copyright  \\textexclamdown ?')
 
+    def test_symbol_replace_like_sequential(self):
+        from letter.letter import escape_latex, LATEX_SYMBOLS
+        # the reference: backslashes first, then one str.replace per symbol
+        def replace_sequential(text):
+            text = text.replace('\\', '\\textbackslash ')
+            for i, j in LATEX_SYMBOLS.items():
+                if i != '\\':
+                    text = text.replace(i, j)
+            return text
+        text = ''.join(LATEX_SYMBOLS) + "Text \\% {mit} Symbolen ~ €§\\\\ äöü" * 3
+        self.assertEqual(replace_sequential(text), escape_latex(text))
+        # both ways: short strings are split at the symbols, longer ones replaced symbol by symbol
+        for size in (0, 1, 10, 64, 65, 200):
+            self.assertEqual(replace_sequential(text[-size:]), escape_latex(text[-size:]))
+        for plain in ('Text ohne Symbole', 'Text ohne Symbole ' * 10):
+            self.assertIs(plain, escape_latex(plain))
+
     def test_setters_and_getters(self):
         from letter.letter import Letter
         letter = Letter()
@@ -158,6 +329,22 @@ class TestLetter(unittest.TestCase):
         self.assertEqual(["\n", "\\begin{document}\n", "\\begin{g-brief}\n", "Text bla blub.\\\\\n", text, "\end{g-brief}\n", "\end{document}\n"], letter.get_text())
         letter.__exit__()
 
+    def test_fields(self):
+        from letter.letter import Letter, FIELDS, FIELD_NAMES
+        self.assertEqual(len(FIELDS), len(FIELD_NAMES))
+        first, second = Letter(), Letter()
+        first.set_name("John Doe")
+        first.set_faltmarken(False)
+        self.assertEqual("", second.get_name())
+        self.assertTrue(second._get_val('faltmarken'))
+        self.assertFalse(hasattr(first, '__dict__'))
+        with self.assertRaises(KeyError):
+            first._set_val('unbekannt', '')
+        tex = first.render_tex()
+        self.assertIn("%\\faltmarken\n", tex)
+        self.assertIn("\\Name{John Doe}\n", tex)
+        self.assertLess(tex.index("\\Gruss{}{1cm}\n"), tex.index("\\Anlagen{\n}\n"))
+
     @classmethod
     def tearDownClass(cls):
         shutil.rmtree(cls.test_dir)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_manifest
+----------------------------------
+
+Tests for `letter.manifest` module.
+"""
+
+import unittest
+import json, os, shutil, tempfile
+from os.path import join as pjoin
+
+from tests.helpers import Pdf
+
+TEMPLATE = {'name': 'John Doe', 'betreff': 'Rechnung', 'text': 'Hallo'}
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = pjoin(self.test_dir, 'out', 'manifest.jsonl')
+        self.pdf = pjoin(self.test_dir, 'brief.pdf')
+        with open(self.pdf, 'wb') as f:
+            f.write(b'%PDF-1.4 Brief')
+
+    def test_journal(self):
+        from letter.manifest import Manifest
+        with Manifest(self.filename) as manifest:
+            manifest.record('brief.pdf', 'a', self.pdf)
+            manifest.record('brief.pdf', 'b', self.pdf)
+            self.assertTrue(manifest.done('brief.pdf', 'b', self.pdf))
+            self.assertFalse(manifest.done('brief.pdf', 'a', self.pdf))
+            self.assertFalse(manifest.done('other.pdf', 'b', self.pdf))
+        # a line torn by a crash is ignored
+        with open(self.filename, 'ab') as f:
+            f.write(b'{"key":"other.pdf","inp')
+        os.chmod(self.filename, 0o640)
+        with Manifest(self.filename) as manifest:
+            self.assertEqual(1, len(manifest))
+            self.assertTrue(manifest.done('brief.pdf', 'b', self.pdf))
+        # compacted to the last entry of each letter
+        with open(self.filename, encoding='utf-8') as f:
+            self.assertEqual(['b'], [json.loads(line)['input'] for line in f])
+        self.assertEqual(['manifest.jsonl'], os.listdir(pjoin(self.test_dir, 'out')))
+        self.assertEqual(0o640, os.stat(self.filename).st_mode & 0o777)
+
+    def test_memory(self):
+        import tracemalloc
+        from letter.manifest import Manifest
+        with Manifest(self.filename, sync=False) as manifest:
+            for i in range(2000):
+                manifest.record('letter_%05d.pdf' % i, '%064x' % i, self.pdf)
+        tracemalloc.start()
+        try:
+            manifest = Manifest(self.filename)
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        with manifest:
+            self.assertTrue(manifest.done('letter_01999.pdf', '%064x' % 1999, self.pdf))
+        # the entries have about 190 bytes, only the size and a short hash of each are kept
+        self.assertLess(size, 2000 * 190)
+
+    def test_verify(self):
+        from letter.manifest import Manifest
+        with Manifest(self.filename) as manifest:
+            manifest.record('brief.pdf', 'a', self.pdf)
+            with open(self.pdf, 'wb') as f:
+                f.write(b'%PDF-1.4 Brie!')
+            self.assertFalse(manifest.done('brief.pdf', 'a', self.pdf))
+            os.remove(self.pdf)
+            self.assertFalse(manifest.done('brief.pdf', 'a', self.pdf))
+
+    def test_input_digest(self):
+        from letter.manifest import input_digest, template_digest
+        base = template_digest(TEMPLATE)
+        digest = input_digest(base, {'adresse': 'Erika', 'text_file': self.pdf})
+        self.assertEqual(digest, input_digest(base, {'text_file': self.pdf, 'adresse': 'Erika'}))
+        self.assertNotEqual(digest, input_digest(template_digest(dict(TEMPLATE, betreff='Mahnung')),
+                                                 {'adresse': 'Erika', 'text_file': self.pdf}))
+        # the files are part of the inputs
+        with open(self.pdf, 'ab') as f:
+            f.write(b'\n')
+        self.assertNotEqual(digest, input_digest(base, {'adresse': 'Erika', 'text_file': self.pdf}))
+
+    def test_options_digest(self):
+        from unittest import mock
+        from letter.manifest import template_digest
+        digest = template_digest(TEMPLATE).hexdigest()
+        self.assertEqual(digest, template_digest(TEMPLATE, {'cache': 'cache', 'chunk': 1}).hexdigest())
+        # the options which change the PDF files
+        digests = {digest}
+        for options in ({'format': True}, {'chunk': 10}, {'reproducible': True}):
+            digests.add(template_digest(TEMPLATE, options).hexdigest())
+        with mock.patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '1600000000'}):
+            digests.add(template_digest(TEMPLATE, {'reproducible': True}).hexdigest())
+            self.assertEqual(digest, template_digest(TEMPLATE).hexdigest())
+        self.assertEqual(5, len(digests))
+
+    def test_resume(self):
+        from letter.batch import iter_batch
+        from letter.cache import PdfCache
+        from letter.spec import letter_from_template, template_from_spec
+        # the letters come from the cache, TeX isn't needed
+        cache = PdfCache(pjoin(self.test_dir, 'cache'))
+        template = template_from_spec(TEMPLATE)
+
+        def cached(recipients):
+            for recipient in recipients:
+                letter = letter_from_template(template, recipient)
+                cache.put(cache.key(letter.render_tex(), letter._builder_settings()),
+                          Pdf(('%%PDF-1.4 %s' % recipient['adresse']).encode('utf-8')))
+            return recipients
+
+        outdir = pjoin(self.test_dir, 'out')
+        options = {'cache': cache.directory, 'manifest': self.filename}
+
+        def run(recipients):
+            results = sorted(iter_batch(TEMPLATE, recipients, outdir, workers=1, options=options))
+            self.assertTrue(all(result.ok for result in results))
+            return [result.skipped for result in results]
+
+        recipients = cached([{'adresse': 'Erika %d' % i} for i in range(4)])
+        self.assertEqual([False] * 4, run(recipients))
+        self.assertEqual([True] * 4, run(recipients))
+        # only changed and missing letters are built again
+        recipients[1] = cached([{'adresse': 'Erika Muster'}])[0]
+        os.remove(pjoin(outdir, 'letter_00004.pdf'))
+        self.assertEqual([True, False, True, False], run(recipients))
+        # other options which change the PDF files build all letters again
+        options['reproducible'] = True
+        results = list(iter_batch(TEMPLATE, recipients, outdir, workers=1, options=options))
+        self.assertEqual([False] * 4, [result.skipped for result in results])
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_service
+----------------------------------
+
+Tests for `letter.service` module.
+"""
+
+import unittest
+import base64, json, os, threading
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+# letters with 'warten' block until this is set
+release = threading.Event()
+
+
+def fake_render(spec, filename, options):
+    # stands in for letter.batch.render_letter, without TeX
+    if spec.get('warten'):
+        release.wait(10)
+    if spec.get('betreff') == 'kaputt':
+        return 'ValueError: kaputt', False, []
+    if spec.get('anlagen_pdf'):
+        attachments = []
+        for attachment in spec['anlagen_pdf']:
+            with open(attachment, 'rb') as f:
+                attachments.append(f.read().decode('utf-8'))
+        spec = dict(spec, anlagen_pdf=attachments)
+    with open(filename, 'wb') as f:
+        f.write(b'%PDF-1.4 ' + json.dumps(spec, sort_keys=True).encode('utf-8'))
+    return None, False, []
+
+
+def crashing_render(spec, filename, options):
+    # kills the worker process like the OOM killer
+    if spec.get('betreff') == 'absturz':
+        os._exit(1)
+    return fake_render(spec, filename, options)
+
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        from letter.service import LetterService, LetterServer
+        release.clear()
+        self.service = LetterService(workers=1, queue_size=1, template={'name': 'John Doe'},
+                                     render=fake_render, executor=ThreadPoolExecutor(1))
+        self.server = LetterServer(('127.0.0.1', 0), self.service)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def request(self, path, data=None):
+        # returns status, content type and body, also for errors
+        if data is not None and not isinstance(data, bytes):
+            data = json.dumps(data).encode('utf-8')
+        try:
+            with urlopen(Request(self.url + path, data=data), timeout=10) as response:
+                return response.status, response.headers['Content-Type'], response.read()
+        except HTTPError as e:
+            return e.code, e.headers['Content-Type'], e.read()
+
+    def test_health_and_queue(self):
+        self.assertEqual((200, 'application/json', b'{"status": "ok"}'), self.request('/health'))
+        status, _, body = self.request('/queue')
+        self.assertEqual({'queued': 0, 'running': 0, 'workers': 1, 'limit': 2}, json.loads(body))
+
+    def test_wait_for_pdf(self):
+        status, content_type, body = self.request('/letters?wait=1', {'betreff': 'Hallo'})
+        self.assertEqual((200, 'application/pdf'), (status, content_type))
+        # merged with the template of the service
+        self.assertEqual({'betreff': 'Hallo', 'name': 'John Doe'}, json.loads(body[9:].decode('utf-8')))
+
+        status, _, body = self.request('/letters?wait=1', {'betreff': 'kaputt'})
+        self.assertEqual(422, status)
+        self.assertEqual('ValueError: kaputt', json.loads(body)['error'])
+
+    def test_job(self):
+        status, _, body = self.request('/letters', {'betreff': 'Hallo'})
+        self.assertEqual(202, status)
+        job = json.loads(body)
+        self.service.job(job['id']).wait(10)
+        status, _, body = self.request('/letters/%s' % job['id'])
+        self.assertEqual('done', json.loads(body)['state'])
+        status, content_type, body = self.request('/letters/%s/pdf' % job['id'])
+        self.assertEqual((200, 'application/pdf'), (status, content_type))
+        self.assertEqual(404, self.request('/letters/unbekannt')[0])
+
+    def test_overload(self):
+        running = json.loads(self.request('/letters', {'warten': True})[2])
+        waiting = json.loads(self.request('/letters', {'warten': True})[2])
+        status, _, body = self.request('/letters', {'betreff': 'Zu viel'})
+        self.assertEqual(429, status)
+        queue = json.loads(self.request('/queue')[2])
+        self.assertEqual(2, queue['queued'] + queue['running'])
+        self.assertEqual(202, self.request('/letters/%s/pdf' % waiting['id'])[0])
+
+        release.set()
+        for job in (running, waiting):
+            self.service.job(job['id']).wait(10)
+        self.assertEqual(202, self.request('/letters', {'betreff': 'Wieder da'})[0])
+
+    def test_bad_requests(self):
+        self.assertEqual(400, self.request('/letters', b'{kein json')[0])
+        self.assertEqual(400, self.request('/letters', [1, 2])[0])
+        self.assertEqual(404, self.request('/unbekannt')[0])
+        for length in ('viel', '-1'):
+            connection = HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=10)
+            connection.putrequest('POST', '/letters')
+            connection.putheader('Content-Length', length)
+            connection.endheaders()
+            self.assertEqual(400, connection.getresponse().status)
+            connection.close()
+
+    def test_files_of_the_server(self):
+        # neither files of the server nor TeX lines, which could \input them
+        for spec in ({'text_file': '/etc/passwd'}, {'anlagen_pdf': '/etc/passwd'},
+                     {'text': ['\\input{/etc/passwd}']}, {'format': 'latex-letter-draft', 'fields': {}},
+                     {'anlagen_pdf_data': 'JVBERi0='}):
+            status, _, body = self.request('/letters', spec)
+            self.assertEqual(400, status, spec)
+            self.assertIn('error', json.loads(body))
+        self.assertEqual(0, len(os.listdir(self.service._LetterService__dir)))
+
+    def test_upload_attachments(self):
+        data = [base64.b64encode(b'%PDF-1.4 AGB').decode('ascii')]
+        status, _, body = self.request('/letters?wait=1', {'betreff': 'Hallo', 'anlagen_pdf_data': data})
+        self.assertEqual(200, status)
+        self.assertEqual(['%PDF-1.4 AGB'], json.loads(body[9:].decode('utf-8'))['anlagen_pdf'])
+        # only the PDF of the letter is kept
+        self.assertEqual(1, len(os.listdir(self.service._LetterService__dir)))
+
+    def test_wait_timeout(self):
+        self.service.timeout = 0.1
+        status, _, body = self.request('/letters?wait=1', {'warten': True})
+        self.assertEqual(202, status)
+        self.assertEqual('running', json.loads(body)['state'])
+
+    def tearDown(self):
+        release.set()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.service.close()
+
+
+class TestBrokenPool(unittest.TestCase):
+
+    def test_worker_died(self):
+        from letter.service import LetterService
+        service = LetterService(workers=1, queue_size=1, render=crashing_render)
+        try:
+            job = service.submit({'betreff': 'absturz'})
+            self.assertTrue(job.wait(30))
+            self.assertIn('BrokenProcessPool', job.error)
+            # a new pool builds the following letters
+            job = service.submit({'betreff': 'Hallo'})
+            self.assertTrue(job.wait(30))
+            self.assertIsNone(job.error)
+        finally:
+            service.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_text
+----------------------------------
+
+Tests for `letter.text` module.
+"""
+
+import unittest
+import os, pickle, shutil, tempfile
+from os.path import join as pjoin
+
+RAW = 'Sehr geehrte Damen und Herren,\n\nanbei 100 € (19% MwSt.) für #4711.\r\nGrüße\n'
+
+
+class TestContent(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = pjoin(self.test_dir, 'text.txt')
+        with open(self.filename, 'w', encoding='utf-8', newline='') as f:
+            f.write(RAW)
+
+    def test_sources(self):
+        from letter.text import Content, prepare_content
+        expected = prepare_content(RAW)
+        self.assertEqual(expected, list(Content.from_string(RAW)))
+        self.assertEqual(expected, list(Content.from_chunks(RAW[i:i + 7] for i in range(0, len(RAW), 7))))
+        # the \r of Windows line ends is dropped from files
+        self.assertEqual(prepare_content(RAW.replace('\r', '')), list(Content.from_file(self.filename)))
+        open(self.filename, 'w').close()
+        self.assertEqual(prepare_content(''), list(Content.from_file(self.filename)))
+
+    def test_chunks_once(self):
+        from letter.text import Content
+        content = Content.from_chunks(['Hallo'])
+        list(content)
+        with self.assertRaises(RuntimeError):
+            list(content)
+
+    def test_letter(self):
+        import io
+        from letter.letter import Letter
+        from letter.text import Content, prepare_content
+        expected = Letter()
+        expected.set_text(prepare_content(RAW))
+        letter = Letter()
+        letter.set_text(Content.from_string(RAW))
+        self.assertEqual(expected.render_tex(), letter.render_tex())
+        out = io.StringIO()
+        letter.write_tex(out)
+        self.assertEqual(expected.render_tex(), out.getvalue())
+        # a copy, like the one of a BuildProcess
+        self.assertEqual(expected.render_tex(), pickle.loads(pickle.dumps(letter)).render_tex())
+
+    def test_letter_not_kept(self):
+        from letter.letter import Letter
+        from letter.text import Content
+        letter = Letter()
+        letter.set_text(Content.from_file(self.filename))
+        self.assertIn('\\#4711', letter.render_tex())
+        # the document isn't kept, so the file is read again
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            f.write('Neuer Text\n')
+        tex = letter.render_tex()
+        self.assertIn('Neuer Text', tex)
+        self.assertNotIn('\\#4711', tex)
+
+    def test_text_source(self):
+        from letter.letter import TextSource
+        from letter.text import Content
+        self.assertIsInstance(Content.from_string(RAW), TextSource)
+        # the lines have to come from somewhere
+        with self.assertRaises(TypeError):
+            TextSource()
+
+    def test_content_source(self):
+        from letter.text import Content, content_source, LAZY_CONTENT_SIZE
+        self.assertIsInstance(content_source(RAW), list)
+        self.assertIsInstance(content_source('x' * (LAZY_CONTENT_SIZE + 1)), Content)
+
+    def test_write_file_memory(self):
+        import tracemalloc
+        from letter.letter import Letter
+        from letter.text import Content
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            for _ in range(40000):
+                f.write('Eine Zeile der Anlage zum Vertrag mit 5% Zinsen und § 3.\n')
+        letter = Letter()
+        letter.set_text(Content.from_file(self.filename))
+        with open(os.devnull, 'w', encoding='utf-8') as f:
+            tracemalloc.start()
+            try:
+                letter.write_tex(f)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        # the file has about 2.4 MB, only a buffer of it is held at a time
+        self.assertLess(peak, 1024 * 1024)
+
+    def test_spec(self):
+        from letter.spec import letter_from_spec
+        from letter.text import prepare_content
+        letter = letter_from_spec({'text_file': self.filename})
+        self.assertEqual(''.join(prepare_content(RAW.replace('\r', ''))), ''.join(letter.get_text()))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
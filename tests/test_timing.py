@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_timing
+----------------------------------
+
+Tests for `letter.timing` module.
+"""
+
+import unittest
+import json, os, shutil, tempfile
+from os.path import join as pjoin
+
+
+class TestTiming(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def test_recorder(self):
+        from letter.timing import Recorder
+        recorder = Recorder()
+        with recorder.stage('render') as stage:
+            stage.size = 42
+        recorder.add('compile', 1.5)
+        records = recorder.take()
+        self.assertEqual([r['stage'] for r in records], ['render', 'compile'])
+        self.assertEqual(records[0]['size'], 42)
+        self.assertGreaterEqual(records[0]['seconds'], 0)
+        self.assertEqual(records[1], {'stage': 'compile', 'seconds': 1.5, 'size': None})
+        self.assertEqual(recorder.take(), [])
+
+    def test_null_recorder(self):
+        from letter.timing import NULL_RECORDER
+        with NULL_RECORDER.stage('render') as stage:
+            stage.size = 42
+        NULL_RECORDER.add('compile', 1.5)
+        self.assertEqual(NULL_RECORDER.take(), [])
+
+    def test_percentile(self):
+        from letter.timing import percentile
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([7], 90), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_aggregator(self):
+        from letter.timing import Aggregator
+        sink = Aggregator()
+        for i in range(1, 11):
+            sink.emit('letter_%d' % i, [{'stage': 'render', 'seconds': i / 1000.0, 'size': 100},
+                                        {'stage': 'compile', 'seconds': i, 'size': None}])
+        report = sink.report()
+        self.assertEqual(report['render']['count'], 10)
+        self.assertEqual(report['render']['size'], 1000)
+        self.assertEqual(report['compile']['p50'], 5)
+        self.assertEqual(report['compile']['p90'], 9)
+        self.assertEqual(report['compile']['max'], 10)
+        self.assertIsNone(report['compile']['size'])
+        # the stage taking the most time comes first
+        lines = sink.format_report().splitlines()
+        self.assertTrue(lines[1].startswith('compile'))
+
+    def test_aggregator_sample(self):
+        from letter.timing import Aggregator
+        sink = Aggregator(sample_size=100)
+        for i in range(1, 1001):
+            sink.emit('letter_%d' % i, [{'stage': 'compile', 'seconds': float(i), 'size': 1}])
+        stats = sink.stages['compile']
+        # only the sample is kept, the counters are exact
+        self.assertEqual(100, len(stats.sample))
+        report = sink.report()['compile']
+        self.assertEqual((1000, 500500.0, 1.0, 1000.0, 1000),
+                         (report['count'], report['total'], report['min'], report['max'], report['size']))
+        self.assertTrue(300 < report['p50'] < 700)
+        self.assertTrue(report['p50'] <= report['p90'] <= report['p99'] <= report['max'])
+
+    def test_json_sink(self):
+        from letter.timing import make_sink
+        filename = pjoin(self.test_dir, 'timing.jsonl')
+        sink = make_sink(filename)
+        sink.emit('a', [{'stage': 'render', 'seconds': 0.1, 'size': 1}])
+        sink.emit('b', [])
+        sink.close()
+        with open(filename, encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([l['letter'] for l in lines], ['a', 'b'])
+        self.assertEqual(lines[0]['stages'][0]['stage'], 'render')
+
+    def test_letter_stages(self):
+        from letter.letter import Letter
+        from letter.timing import Recorder
+        letter = Letter()
+        letter.set_text('Hallo')
+        recorder = Recorder()
+        letter.set_recorder(recorder)
+        filename = pjoin(self.test_dir, 'letter.tex')
+        letter.save_tex(filename)
+        records = recorder.take()
+        self.assertEqual([r['stage'] for r in records], ['save'])
+        self.assertEqual(records[0]['size'], os.path.getsize(filename))
+
+    def test_process_start_time(self):
+        import time
+        from letter.timing import process_start_time
+        started = process_start_time()
+        if started is not None:
+            # this process was started before the test, within the resolution of /proc/uptime
+            self.assertLess(started, time.time() + 0.1)
+            self.assertGreater(started, time.time() - 3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_worker
+----------------------------------
+
+Tests for `letter.worker` module.
+"""
+
+import unittest
+import multiprocessing, os, shutil, tempfile, time
+from os.path import join as pjoin
+
+
+def fake_render(spec, filename, options):
+    # stands in for letter.batch.render_letter, without TeX. The first worker
+    # building a letter with 'absturz' dies, like a host going down.
+    if spec.get('absturz'):
+        try:
+            fd = os.open(spec['absturz'], os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            os.write(fd, str(os.getpid()).encode('ascii'))
+            os.close(fd)
+            os._exit(1)
+        except FileExistsError:
+            pass
+    if spec.get('betreff') == 'kaputt':
+        return 'ValueError: kaputt', False, []
+    time.sleep(0.01)
+    with open(filename, 'w') as f:
+        f.write(str(os.getpid()))
+    return None, False, []
+
+
+class TestWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = pjoin(self.test_dir, 'queue.db')
+        self.outdir = pjoin(self.test_dir, 'out')
+
+    def store(self, recipients, lease=60, max_attempts=3):
+        from letter.worker import JobStore
+        store = JobStore(self.path, lease, max_attempts)
+        store.set_batch({'name': 'John Doe'}, self.outdir)
+        store.add_many(recipients)
+        return store
+
+    def test_lease(self):
+        with self.store([{'key': 'a'}, {'key': 'b'}], lease=0.2) as store:
+            self.assertEqual((1, {'key': 'a'}, 'a.pdf', 1), store.claim('eins'))
+            self.assertEqual(2, store.claim('zwei').id)
+            self.assertIsNone(store.claim('drei'))
+            self.assertEqual(1, store.heartbeat('eins'))
+            self.assertTrue(store.finish(2, 'zwei'))
+            # without heartbeats the letter is taken over
+            time.sleep(0.3)
+            job = store.claim('drei')
+            self.assertEqual((1, 2), job[::3])
+            self.assertFalse(store.finish(1, 'eins', 'zu spät'))
+            self.assertTrue(store.finish(1, 'drei'))
+            self.assertEqual({'queued': 0, 'running': 0, 'done': 2, 'failed': 0}, store.counts())
+
+    def test_replace_with_lease(self):
+        with self.store([{'key': 'a'}], lease=0.05) as store:
+            os.makedirs(self.outdir)
+            filename = pjoin(self.outdir, 'a.pdf')
+            for worker in ('eins', 'zwei'):
+                with open(pjoin(self.outdir, worker), 'w') as f:
+                    f.write(worker)
+            store.claim('eins')
+            time.sleep(0.1)
+            store.claim('zwei')
+            # the PDF file of the worker which lost the letter doesn't replace the letter
+            self.assertFalse(store.finish(1, 'eins', replace=(pjoin(self.outdir, 'eins'), filename)))
+            self.assertFalse(os.path.exists(filename))
+            self.assertTrue(store.finish(1, 'zwei', replace=(pjoin(self.outdir, 'zwei'), filename)))
+            with open(filename) as f:
+                self.assertEqual('zwei', f.read())
+
+    def test_other_batch(self):
+        with self.store([{'key': 'a'}]) as store:
+            # the queued letter would be built with the other template
+            with self.assertRaises(ValueError):
+                store.set_batch({'name': 'Jane Doe'}, self.outdir)
+            store.set_batch({'name': 'John Doe'}, self.outdir)
+            store.finish(store.claim('eins').id, 'eins')
+            store.set_batch({'name': 'Jane Doe'}, self.outdir)
+            self.assertEqual(({'name': 'Jane Doe'}, self.outdir, {}), store.batch())
+
+    def test_max_attempts(self):
+        with self.store([{'key': 'a'}], lease=0.05, max_attempts=2) as store:
+            store.claim('eins')
+            time.sleep(0.1)
+            store.claim('zwei')
+            time.sleep(0.1)
+            self.assertIsNone(store.claim('drei'))
+            self.assertEqual([('a.pdf', 'The workers building the letter died 2 times')], store.failed())
+
+    def test_workers(self):
+        from letter.worker import run_worker
+        marker = pjoin(self.test_dir, 'abgestürzt')
+        recipients = [{'adresse': 'Erika %d' % i} for i in range(30)]
+        recipients[3] = {'key': 'absturz', 'absturz': marker}
+        recipients[7] = {'key': 'kaputt', 'betreff': 'kaputt'}
+        self.store(recipients).close()
+
+        # processes stand in for the hosts
+        workers = [multiprocessing.Process(target=run_worker, args=(self.path,),
+                                           kwargs={'render': fake_render, 'lease': 0.5, 'poll': 0.05})
+                   for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+        self.assertEqual([1, 0, 0], sorted(worker.exitcode for worker in workers)[::-1])
+
+        with self.store([]) as store:
+            self.assertEqual({'queued': 0, 'running': 0, 'done': 29, 'failed': 1}, store.counts())
+            self.assertEqual([('kaputt.pdf', 'ValueError: kaputt')], store.failed())
+        self.assertEqual(29, len(os.listdir(self.outdir)))
+        # built again by another worker
+        with open(marker) as f, open(pjoin(self.outdir, 'absturz.pdf')) as pdf:
+            self.assertNotEqual(f.read(), pdf.read())
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+if __name__ == '__main__':
+    unittest.main()